@@ -15,7 +15,9 @@ import streamlit as st
 import pandas as pd
 from bioideas.config import PROCESSED_DIR, MEMOS_DIR
 from bioideas.models import IdeaCard, ScoreCard, EloRating, Nugget, Episode
-from bioideas.storage import read_jsonl
+from bioideas.storage import read_jsonl, jsonl_exists
+from bioideas.compression import read_text_any
+from bioideas.clusters import load_cluster_map, load_clusters, NOISE
 
 st.set_page_config(
     page_title="BioIdeas Explorer",
@@ -28,23 +30,25 @@ st.set_page_config(
 def load_data():
     """Загружает все данные."""
     ideas_file = PROCESSED_DIR / "ideas_deduped.jsonl"
-    if not ideas_file.exists():
+    if not jsonl_exists(ideas_file):
         ideas_file = PROCESSED_DIR / "ideas.jsonl"
     
-    ideas = read_jsonl(ideas_file, IdeaCard) if ideas_file.exists() else []
+    ideas = read_jsonl(ideas_file, IdeaCard)
     scores = read_jsonl(PROCESSED_DIR / "scores.jsonl", ScoreCard)
     elo_ratings = read_jsonl(PROCESSED_DIR / "elo_ratings.jsonl", EloRating)
     nuggets = read_jsonl(PROCESSED_DIR / "nuggets.jsonl", Nugget)
     episodes = read_jsonl(PROCESSED_DIR / "episodes.jsonl", Episode)
+    cluster_map = load_cluster_map()
+    clusters = load_clusters()
     
-    return ideas, scores, elo_ratings, nuggets, episodes
+    return ideas, scores, elo_ratings, nuggets, episodes, cluster_map, clusters
 
 
 def main():
     st.title("🧬 BioIdeas Explorer")
     st.markdown("Анализ идей из биотех-подкастов")
     
-    ideas, scores, elo_ratings, nuggets, episodes = load_data()
+    ideas, scores, elo_ratings, nuggets, episodes, cluster_map, clusters = load_data()
     
     if not ideas:
         st.warning("Нет данных. Запустите пайплайн сначала.")
@@ -86,6 +90,23 @@ python -m bioideas.pipeline.s02_embed_chunks
     
     min_score = st.sidebar.slider("Мин. общий балл", 0, 50, 20)
     
+    selected_clusters = []
+    medoids_only = False
+    if clusters:
+        titles = {i.idea_id: i.title_ru for i in ideas}
+        cluster_names = {
+            c.cluster_id: f"#{c.cluster_id} ({c.size}): {titles.get(c.medoid_idea_id, c.medoid_idea_id)[:40]}"
+            for c in clusters
+        }
+        selected_clusters = st.sidebar.multiselect(
+            "Кластеры",
+            list(cluster_names),
+            format_func=cluster_names.get,
+            help="Пусто — все идеи",
+        )
+        medoids_only = st.sidebar.checkbox("Только медоиды кластеров", help="По одной типичной идее на кластер")
+    medoid_ids = {c.medoid_idea_id for c in clusters}
+    
     sort_by = st.sidebar.selectbox(
         "Сортировка",
         ["Elo рейтинг", "Общий балл", "Solo Start", "Community 6m", "Blue Ocean"]
@@ -96,6 +117,8 @@ python -m bioideas.pipeline.s02_embed_chunks
         if i.category in selected_categories
         and i.horizon in selected_horizons
         and (scores_map.get(i.idea_id) is None or scores_map[i.idea_id].total_score >= min_score)
+        and (not selected_clusters or cluster_map.get(i.idea_id, NOISE) in selected_clusters)
+        and (not medoids_only or i.idea_id in medoid_ids)
     ]
     
     sort_key_map = {
@@ -125,7 +148,9 @@ python -m bioideas.pipeline.s02_embed_chunks
             score = scores_map.get(idea.idea_id)
             elo = elo_map.get(idea.idea_id)
             
-            with st.expander(f"**{i+1}. {idea.title_ru}** | {idea.category} | {idea.horizon}y"):
+            cluster_id = cluster_map.get(idea.idea_id, NOISE)
+            cluster_label = f" | кластер #{cluster_id}" if cluster_id != NOISE else ""
+            with st.expander(f"**{i+1}. {idea.title_ru}** | {idea.category} | {idea.horizon}y{cluster_label}"):
                 col1, col2 = st.columns([2, 1])
                 
                 with col1:
@@ -155,6 +180,8 @@ python -m bioideas.pipeline.s02_embed_chunks
                     
                     if elo:
                         st.metric("Elo", f"{elo.elo:.0f}", f"{elo.wins}W-{elo.losses}L")
+                        if elo.elo_low is not None:
+                            st.caption(f"95% CI: {elo.elo_low:.0f}–{elo.elo_high:.0f}")
                 
                 if idea.source_nugget_ids:
                     st.markdown("---")
@@ -181,6 +208,7 @@ python -m bioideas.pipeline.s02_embed_chunks
                 "Title": title_short,
                 "Category": idea.category,
                 "Horizon": idea.horizon,
+                "Cluster": cluster_map.get(idea.idea_id, NOISE),
                 "Total": score.total_score if score else 0,
                 "Solo": score.score_solo_start if score else 0,
                 "Community": score.score_community_6m if score else 0,
@@ -271,14 +299,14 @@ python -m bioideas.pipeline.s02_embed_chunks
     
     with tab3:
         st.markdown("### Decision Memos")
-        memo_files = sorted(MEMOS_DIR.glob("*.md"))
+        memo_files = sorted([*MEMOS_DIR.glob("*.md"), *MEMOS_DIR.glob("*.md.zst")])
         
         if not memo_files:
             st.info("Нет memo. Запустите step 08.")
         else:
             for memo_file in memo_files:
-                with st.expander(memo_file.stem):
-                    st.markdown(memo_file.read_text(encoding="utf-8"))
+                with st.expander(memo_file.name.removesuffix(".zst").removesuffix(".md")):
+                    st.markdown(read_text_any(memo_file))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,579 @@
+"""
+Бенчмарки инфраструктуры пайплайна (без обращений к LLM).
+
+Запуск: `bioideas bench <name>`.
+"""
+import json
+import random
+import shutil
+import tempfile
+import time
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+from .config import PROCESSED_DIR, MEMOS_DIR
+
+console = Console()
+
+
+def _timed(func, repeat: int = 3) -> float:
+    """Лучшее время выполнения func() в миллисекундах."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_storage(processed_dir: Path = PROCESSED_DIR, samples: int = 50) -> list[dict]:
+    """
+    Сравнивает обычный JSONL и zstd-фреймы на реальных артефактах:
+    размер на диске, полное чтение с json-разбором и чтение случайной записи.
+    """
+    from .compression import (
+        compress_jsonl, compressed_path, index_path, iter_compressed_lines,
+        read_compressed_lines, write_text_compressed,
+    )
+
+    rows = []
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        for src in sorted(processed_dir.glob("*.jsonl")):
+            plain = tmp_dir / src.name
+            shutil.copyfile(src, plain)
+            with open(plain, encoding="utf-8") as f:
+                n_records = sum(1 for line in f if line.strip())
+            if not n_records:
+                continue
+            packed = tmp_dir / ("z_" + src.name)
+            shutil.copyfile(src, packed)
+            compress_jsonl(packed)
+
+            def read_plain(plain=plain):
+                with open(plain, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            json.loads(line)
+
+            def read_packed(packed=packed):
+                for line in iter_compressed_lines(packed):
+                    json.loads(line)
+
+            positions = [rng.randrange(n_records) for _ in range(samples)]
+
+            def seek_plain(plain=plain, positions=positions):
+                for pos in positions:
+                    with open(plain, encoding="utf-8") as f:
+                        for i, line in enumerate(f):
+                            if i == pos:
+                                json.loads(line)
+                                break
+
+            def seek_packed(packed=packed, positions=positions):
+                for pos in positions:
+                    json.loads(read_compressed_lines(packed, pos)[0])
+
+            plain_bytes = plain.stat().st_size
+            packed_bytes = compressed_path(packed).stat().st_size + index_path(packed).stat().st_size
+            rows.append({
+                "file": src.name,
+                "records": n_records,
+                "plain_kb": plain_bytes / 1024,
+                "zstd_kb": packed_bytes / 1024,
+                "ratio": plain_bytes / packed_bytes,
+                "read_plain_ms": _timed(read_plain),
+                "read_zstd_ms": _timed(read_packed),
+                "seek_plain_ms": _timed(seek_plain) / samples,
+                "seek_zstd_ms": _timed(seek_packed) / samples,
+            })
+
+        memo_files = sorted(MEMOS_DIR.glob("*.md"))
+        if memo_files:
+            plain_bytes = sum(p.stat().st_size for p in memo_files)
+            packed_bytes = sum(
+                write_text_compressed(tmp_dir / p.name, p.read_text(encoding="utf-8")).stat().st_size
+                for p in memo_files
+            )
+            rows.append({
+                "file": f"memos/*.md ({len(memo_files)})",
+                "records": len(memo_files),
+                "plain_kb": plain_bytes / 1024,
+                "zstd_kb": packed_bytes / 1024,
+                "ratio": plain_bytes / packed_bytes,
+            })
+
+    table = Table(title="JSONL vs zstd frames")
+    columns = [
+        ("file", "{}"), ("records", "{}"), ("plain_kb", "{:.0f}"), ("zstd_kb", "{:.0f}"),
+        ("ratio", "{:.1f}x"), ("read_plain_ms", "{:.1f}"), ("read_zstd_ms", "{:.1f}"),
+        ("seek_plain_ms", "{:.2f}"), ("seek_zstd_ms", "{:.2f}"),
+    ]
+    for name, _ in columns:
+        table.add_column(name)
+    for row in rows:
+        table.add_row(*[fmt.format(row[name]) if name in row else "-" for name, fmt in columns])
+    console.print(table)
+    return rows
+
+
+def _build_transcript_corpus(target_dir: Path, n_files: int) -> list[Path]:
+    """Собирает синтетические транскрипты из текстов chunks.jsonl."""
+    from collections import defaultdict
+    from .models import Chunk
+    from .storage import iter_jsonl
+
+    by_doc: dict[str, list[str]] = defaultdict(list)
+    for chunk in iter_jsonl(PROCESSED_DIR / "chunks.jsonl", Chunk):
+        by_doc[chunk.doc_id].append(chunk.text)
+    docs = ["\n\n".join(texts) for texts in by_doc.values()]
+    if not docs:
+        docs = ["00:00 Hello.\n\nSome transcript text. " * 2000]
+
+    files = []
+    for i in range(n_files):
+        path = target_dir / f"transcript_{i:05d}.txt"
+        path.write_text(docs[i % len(docs)], encoding="utf-8")
+        files.append(path)
+    return files
+
+
+def bench_ingest(n_files: int = 200, workers: int | None = None) -> list[dict]:
+    """Пропускная способность s01: последовательно против пула процессов."""
+    import os
+    from .pipeline.s01_ingest import iter_processed_files
+
+    workers = workers or os.cpu_count() or 1
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        files = _build_transcript_corpus(Path(tmp), n_files)
+        total_mb = sum(p.stat().st_size for p in files) / 1024 / 1024
+
+        for n_workers in sorted({1, workers}):
+            start = time.perf_counter()
+            n_chunks = sum(len(chunks) for _, _, chunks, _ in iter_processed_files(files, n_workers))
+            elapsed = time.perf_counter() - start
+            rows.append({
+                "workers": n_workers,
+                "files": len(files),
+                "chunks": n_chunks,
+                "seconds": elapsed,
+                "files_per_sec": len(files) / elapsed,
+                "mb_per_sec": total_mb / elapsed,
+            })
+
+    table = Table(title=f"s01 ingest throughput ({n_files} files, {total_mb:.0f} MB)")
+    for name in ["workers", "chunks", "seconds", "files/sec", "MB/sec"]:
+        table.add_column(name)
+    for row in rows:
+        table.add_row(
+            str(row["workers"]), str(row["chunks"]), f"{row['seconds']:.2f}",
+            f"{row['files_per_sec']:.1f}", f"{row['mb_per_sec']:.1f}",
+        )
+    console.print(table)
+    return rows
+
+
+def bench_quotes(repeat: int = 3) -> dict:
+    """
+    Проверка цитат на реальных nuggets: nuggets/sec и доля найденных цитат
+    для старой проверки (первые/последние 5 слов как подстрока) и quotes.align_quotes.
+    """
+    from collections import defaultdict
+    from .models import Chunk, Nugget
+    from .quotes import align_quotes
+    from .storage import iter_jsonl
+
+    chunk_texts = {c.chunk_id: c.text for c in iter_jsonl(PROCESSED_DIR / "chunks.jsonl", Chunk)}
+    by_chunk: dict[str, list[str]] = defaultdict(list)
+    n_nuggets = 0
+    for nugget in iter_jsonl(PROCESSED_DIR / "nuggets.jsonl", Nugget):
+        n_nuggets += 1
+        for ev in nugget.evidence:
+            if ev.chunk_id in chunk_texts:
+                by_chunk[ev.chunk_id].append(ev.quote)
+    batches = [(chunk_texts[cid], quotes) for cid, quotes in by_chunk.items()]
+    n_quotes = sum(len(q) for _, q in batches)
+    if not n_quotes:
+        console.print("[yellow]No nuggets with evidence found.[/yellow]")
+        return {}
+
+    def old_check():
+        found = 0
+        for text, quotes in batches:
+            lowered = text.lower()
+            for quote in quotes:
+                words = quote.strip().lower().split()
+                if " ".join(words[:5]) in lowered or " ".join(words[-5:]) in lowered:
+                    found += 1
+        return found
+
+    def new_check():
+        return [m for text, quotes in batches for m in align_quotes(text, quotes)]
+
+    matches = new_check()
+    row = {
+        "nuggets": n_nuggets,
+        "quotes": n_quotes,
+        "old_found": old_check() / n_quotes,
+        "exact": sum(1 for m in matches if m and m.exact) / n_quotes,
+        "fuzzy": sum(1 for m in matches if m and not m.exact) / n_quotes,
+        "old_ms": _timed(old_check, repeat),
+        "new_ms": _timed(new_check, repeat),
+    }
+
+    table = Table(title=f"Quote validation ({n_nuggets} nuggets, {n_quotes} quotes)")
+    for name in ["method", "found", "ms", "nuggets/sec"]:
+        table.add_column(name)
+    table.add_row("first/last 5 words", f"{row['old_found']:.1%}", f"{row['old_ms']:.0f}",
+                  f"{n_nuggets / row['old_ms'] * 1000:.0f}")
+    table.add_row(f"align (exact {row['exact']:.1%} + fuzzy {row['fuzzy']:.1%})",
+                  f"{row['exact'] + row['fuzzy']:.1%}", f"{row['new_ms']:.0f}",
+                  f"{n_nuggets / row['new_ms'] * 1000:.0f}")
+    console.print(table)
+    return row
+
+
+def _dense_duplicates(embeddings, threshold: float) -> dict[int, int]:
+    """Прежний алгоритм s05: полная float64-матрица cosine_similarity и двойной цикл."""
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    sim_matrix = cosine_similarity(np.asarray(embeddings, dtype=np.float64))
+    duplicates = {}
+    seen = set()
+    n = len(sim_matrix)
+    for i in range(n):
+        if i in seen:
+            continue
+        for j in range(i + 1, n):
+            if j in seen:
+                continue
+            if sim_matrix[i, j] >= threshold:
+                duplicates[j] = i
+                seen.add(j)
+    return duplicates
+
+
+def _synthetic_embeddings(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Группы перефразов: базовый вектор + шум, косинус внутри группы ~0.8–0.96."""
+    rng = np.random.default_rng(seed)
+    n_base = max(1, n // 3)
+    base = rng.normal(size=(n_base, dim)).astype(np.float32)
+    owners = rng.integers(0, n_base, size=n)
+    noise = rng.uniform(0.2, 0.5, size=(n, 1)).astype(np.float32)
+    return base[owners] + noise * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def bench_dedupe(sizes: list[int] = (1000, 5000, 20000), dim: int = 3072, dense_max: int = 5000) -> list[dict]:
+    """
+    s05 find_duplicates: прежняя полная матрица против блочного float32.
+    Проверяет совпадение результата на кеше эмбеддингов идей (idea_embeddings.npz,
+    если s05 уже запускался) и на синтетических данных; память — пик tracemalloc.
+    """
+    import tracemalloc
+    from .pipeline.s05_dedupe_cluster import EMBEDDING_CACHE_FILE, SIMILARITY_THRESHOLD
+    from .similarity import greedy_duplicates
+
+    datasets = []
+    if EMBEDDING_CACHE_FILE.exists():
+        datasets.append(("ideas (cache)", np.load(EMBEDDING_CACHE_FILE)["vectors"]))
+    for n in sizes:
+        datasets.append((f"synthetic {n}", _synthetic_embeddings(n, dim)))
+
+    def measure(func, vectors):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func(vectors, SIMILARITY_THRESHOLD)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, elapsed, peak / 1024 / 1024
+
+    rows = []
+    for name, vectors in datasets:
+        row = {"data": name, "n": len(vectors)}
+        new, row["blocked_s"], row["blocked_mb"] = measure(greedy_duplicates, vectors)
+        row["duplicates"] = len(new)
+        if len(vectors) <= dense_max:
+            old, row["dense_s"], row["dense_mb"] = measure(_dense_duplicates, vectors)
+            row["identical"] = old == new
+        rows.append(row)
+
+    table = Table(title=f"s05 duplicate detection (threshold {SIMILARITY_THRESHOLD})")
+    for col in ["data", "n", "duplicates", "dense s", "dense MB", "blocked s", "blocked MB", "identical"]:
+        table.add_column(col)
+    for row in rows:
+        table.add_row(
+            row["data"], str(row["n"]), str(row["duplicates"]),
+            f"{row['dense_s']:.2f}" if "dense_s" in row else "-",
+            f"{row['dense_mb']:.0f}" if "dense_mb" in row else "-",
+            f"{row['blocked_s']:.2f}", f"{row['blocked_mb']:.0f}",
+            str(row.get("identical", "-")),
+        )
+    console.print(table)
+    return rows
+
+
+def _synthetic_topics(n: int, dim: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Темы по ~50 идей (косинус внутри темы ~0.6) и 10% разрозненных идей (метка -1)."""
+    rng = np.random.default_rng(seed)
+    n_topics = max(2, n // 50)
+    centers = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    truth = rng.integers(0, n_topics, size=n)
+    truth[rng.random(n) < 0.1] = -1
+    vectors = 0.8 * rng.normal(size=(n, dim)).astype(np.float32)
+    clustered = truth >= 0
+    vectors[clustered] += centers[truth[clustered]]
+    vectors[~clustered] += rng.normal(size=(int((~clustered).sum()), dim)).astype(np.float32)
+    return vectors, truth
+
+
+def bench_cluster(
+    sizes: list[int] = (1000, 5000, 20000),
+    dim: int = 3072,
+    reducers: list[str] = ("none", "pca", "umap"),
+    dims: int | None = None,
+    raw_max: int = 5000,
+) -> list[dict]:
+    """
+    Кластеризация s05: время снижения размерности и HDBSCAN по методам
+    и качество кластеров. На синтетике — ARI с истинными темами, на кеше
+    эмбеддингов идей — ARI с кластеризацией исходных векторов (если она есть).
+    Силуэт (косинус по исходным векторам, без шума, выборка 2000) — для всех.
+    HDBSCAN без снижения размерности запускается только до raw_max векторов.
+    """
+    from sklearn.metrics import adjusted_rand_score, silhouette_score
+    from .config import settings
+    from .pipeline.s05_dedupe_cluster import EMBEDDING_CACHE_FILE, cluster_ideas
+
+    dims = dims or settings.cluster_dims
+    datasets = []
+    if EMBEDDING_CACHE_FILE.exists():
+        datasets.append(("ideas (cache)", np.load(EMBEDDING_CACHE_FILE)["vectors"], None))
+    for n in sizes:
+        datasets.append((f"synthetic {n}", *_synthetic_topics(n, dim)))
+
+    rows = []
+    for name, vectors, truth in datasets:
+        reference = truth
+        for method in reducers:
+            row = {"data": name, "n": len(vectors), "reducer": method}
+            if method == "none" and len(vectors) > raw_max:
+                row["skipped"] = f"n > {raw_max}"
+                rows.append(row)
+                continue
+            try:
+                start = time.perf_counter()
+                labels, _, _ = cluster_ideas(vectors, reducer_method=method, dims=dims)
+                row["total_s"] = time.perf_counter() - start
+            except RuntimeError as e:
+                row["skipped"] = str(e).split(":")[-1].strip()
+                rows.append(row)
+                continue
+            labels = np.asarray(labels)
+            row["clusters"] = len(set(labels.tolist()) - {-1})
+            row["noise"] = float(np.mean(labels == -1))
+            if reference is None and method == "none":
+                reference = labels
+            if reference is not None and not (truth is None and method == "none"):
+                row["ari"] = adjusted_rand_score(reference, labels)
+            clustered = labels >= 0
+            if row["clusters"] >= 2:
+                row["silhouette"] = silhouette_score(
+                    vectors[clustered], labels[clustered],
+                    metric="cosine", sample_size=min(2000, int(clustered.sum())), random_state=0,
+                )
+            rows.append(row)
+
+    table = Table(title=f"s05 clustering (HDBSCAN, reduced to {dims} dims)")
+    for col in ["data", "n", "reducer", "total s", "clusters", "noise", "ARI", "silhouette"]:
+        table.add_column(col)
+    for row in rows:
+        if "skipped" in row:
+            table.add_row(row["data"], str(row["n"]), row["reducer"], f"skipped: {row['skipped']}", "", "", "", "")
+            continue
+        table.add_row(
+            row["data"], str(row["n"]), row["reducer"], f"{row['total_s']:.2f}",
+            str(row["clusters"]), f"{row['noise']:.0%}",
+            f"{row['ari']:.3f}" if "ari" in row else "-",
+            f"{row['silhouette']:.3f}" if "silhouette" in row else "-",
+        )
+    console.print(table)
+    return rows
+
+
+def _simulate_tournament(strengths: np.ndarray, schedule: str, mode: str, seed: int) -> tuple[int, int, np.ndarray]:
+    """
+    Турнир s07 на синтетических идеях: исход матча ~ Брэдли–Терри с истинными
+    силами, ранжирование группы ~ Плакетт–Льюс (сортировка сил с гумбелевским
+    шумом). Участники упорядочены по зашумлённой силе, как s07 упорядочивает
+    их по оценке s06. Возвращает (число запросов к LLM, число матчей, оценённые силы).
+    """
+    from .config import settings
+    from .pipeline.s07_tournament import TournamentState, next_round, pair_key
+
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    ids = [f"idea_{i:05d}" for i in range(len(strengths))]
+    index = {id_: i for i, id_ in enumerate(ids)}
+    prescore = strengths + rng.normal(size=len(strengths))
+    state = TournamentState.start([ids[i] for i in np.argsort(-prescore)])
+    tried: set[tuple[str, str]] = set()
+    requests = 0
+
+    previous = settings.tournament_schedule, settings.tournament_mode
+    settings.tournament_schedule, settings.tournament_mode = schedule, mode
+    try:
+        while True:
+            matchups = next_round(state, tried)
+            if not matchups:
+                break
+            for match in matchups:
+                requests += 1
+                tried.update(pair_key(a, b) for a, b in combinations(match, 2))
+                noisy = strengths[[index[id_] for id_ in match]] + rng.gumbel(size=len(match))
+                ranked = [match[i] for i in np.argsort(-noisy)]
+                for winner, loser in combinations(ranked, 2):
+                    state.record(winner, loser, winner)
+    finally:
+        settings.tournament_schedule, settings.tournament_mode = previous
+    scores = dict(zip(*state.strengths(with_stderr=False)[:2]))
+    return requests, len(state.results), np.array([scores[id_] for id_ in ids])
+
+
+def bench_tournament(
+    n_ideas: int = 100,
+    top_k: int | None = None,
+    seeds: int = 5,
+    spread: float = 1.0,
+    group_size: int | None = None,
+) -> list[dict]:
+    """
+    Режимы и расписания s07 на симуляции: пары против ранжирования групп,
+    случайное, адаптивное и разреженное расписания. Качество — доля истинного top-K
+    в оценённом top-K (силы Брэдли–Терри по всем матчам) и ранговая корреляция
+    по всем идеям. spread — стандартное отклонение истинных сил (логиты).
+    Для пары Плакетт–Льюс совпадает с Брэдли–Терри, так что режимы сравнимы;
+    реальная LLM на группе из 6–8 карточек может ошибаться чаще.
+    """
+    from .config import settings
+
+    top_k = top_k or settings.tournament_top_k
+    previous_size = settings.tournament_group_size
+    if group_size:
+        settings.tournament_group_size = group_size
+    rows = []
+    try:
+        for mode in ("pairwise", "listwise"):
+            for schedule in ("random", "adaptive", "sparse"):
+                requests, matches, recall, rank_corr = [], [], [], []
+                for seed in range(seeds):
+                    strengths = np.random.default_rng(1000 + seed).normal(scale=spread, size=n_ideas)
+                    n_requests, n_matches, estimated = _simulate_tournament(strengths, schedule, mode, seed)
+                    true_top = set(np.argsort(-strengths)[:top_k].tolist())
+                    est_top = set(np.argsort(-estimated)[:top_k].tolist())
+                    requests.append(n_requests)
+                    matches.append(n_matches)
+                    recall.append(len(true_top & est_top) / top_k)
+                    ranks_true = np.argsort(np.argsort(strengths))
+                    ranks_est = np.argsort(np.argsort(estimated))
+                    rank_corr.append(float(np.corrcoef(ranks_true, ranks_est)[0, 1]))
+                rows.append({
+                    "mode": mode,
+                    "schedule": schedule,
+                    "requests": float(np.mean(requests)),
+                    "matches": float(np.mean(matches)),
+                    "top_k_recall": float(np.mean(recall)),
+                    "rank_corr": float(np.mean(rank_corr)),
+                })
+    finally:
+        settings.tournament_group_size = previous_size
+
+    baseline = rows[0]["requests"]
+    table = Table(
+        title=f"s07 tournament simulation: {n_ideas} ideas, top-{top_k}, "
+              f"groups of {group_size or settings.tournament_group_size}, {seeds} seeds"
+    )
+    for col in ["mode", "schedule", "LLM requests", "saved", "pairs", f"top-{top_k} recall", "rank corr"]:
+        table.add_column(col)
+    for row in rows:
+        table.add_row(
+            row["mode"], row["schedule"], f"{row['requests']:.0f}", f"{1 - row['requests'] / baseline:.0%}",
+            f"{row['matches']:.0f}", f"{row['top_k_recall']:.1%}", f"{row['rank_corr']:.3f}",
+        )
+    console.print(table)
+    return rows
+
+
+def bench_tournament_scale(sizes: list[int], degree: int | None = None, top_k: int | None = None, spread: float = 1.0) -> list[dict]:
+    """
+    Турнир sparse по всему пулу идей на симуляции: время построения раундов и
+    решения Брэдли–Терри (разреженного и плотного, до 2000 идей), число матчей
+    на идею и качество рейтинга.
+    """
+    from .config import settings
+    from .pipeline import s07_tournament
+    from .ranking import bradley_terry, win_matrix, fit_results
+
+    top_k = top_k or settings.tournament_top_k
+    previous_degree = settings.tournament_degree
+    if degree:
+        settings.tournament_degree = degree
+    rows = []
+    try:
+        for n in sizes:
+            strengths = np.random.default_rng(n).normal(scale=spread, size=n)
+            t0 = time.perf_counter()
+            _, n_matches, estimated = _simulate_tournament(strengths, "sparse", "pairwise", seed=0)
+            total_s = time.perf_counter() - t0
+
+            ids = [f"i{i}" for i in range(n)]
+            t0 = time.perf_counter()
+            graph = s07_tournament.sparse_graph(ids, {}, settings.tournament_degree)
+            graph_s = time.perf_counter() - t0
+            a_wins = np.random.default_rng(0).random(len(graph)) < 0.5
+            results = [(a, b) if won else (b, a) for (a, b), won in zip(graph, a_wins)]
+            t0 = time.perf_counter()
+            fit_results(ids, results)
+            sparse_s = time.perf_counter() - t0
+            dense_s = None
+            if n <= 2000:
+                t0 = time.perf_counter()
+                bradley_terry(win_matrix(ids, results))
+                dense_s = time.perf_counter() - t0
+
+            true_top = set(np.argsort(-strengths)[:top_k].tolist())
+            est_top = set(np.argsort(-estimated)[:top_k].tolist())
+            rows.append({
+                "n": n,
+                "matches": n_matches,
+                "total_s": total_s,
+                "graph_s": graph_s,
+                "sparse_fit_s": sparse_s,
+                "dense_fit_s": dense_s,
+                "top_k_recall": len(true_top & est_top) / top_k,
+                "rank_corr": float(np.corrcoef(
+                    np.argsort(np.argsort(strengths)), np.argsort(np.argsort(estimated))
+                )[0, 1]),
+            })
+    finally:
+        settings.tournament_degree = previous_degree
+
+    table = Table(title=f"s07 sparse tournament over the full pool: degree {degree or settings.tournament_degree}, top-{top_k}")
+    for col in ["ideas", "matches", "per idea", "simulation, s", "graph, s", "sparse fit, s", "dense fit, s",
+                f"top-{top_k} recall", "rank corr"]:
+        table.add_column(col)
+    for row in rows:
+        table.add_row(
+            str(row["n"]), str(row["matches"]), f"{2 * row['matches'] / row['n']:.1f}",
+            f"{row['total_s']:.1f}", f"{row['graph_s']:.3f}", f"{row['sparse_fit_s']:.2f}",
+            f"{row['dense_fit_s']:.2f}" if row["dense_fit_s"] is not None else "-",
+            f"{row['top_k_recall']:.0%}", f"{row['rank_corr']:.3f}",
+        )
+    console.print(table)
+    return rows
@@ -1,32 +1,65 @@
+import hashlib
 import re
-import uuid
+from functools import lru_cache
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 from .config import settings
 from .models import Chunk, Episode
 
 TIMECODE_RE = re.compile(r"(?<!\d)(?:\d{1,2}:)?\d{1,2}:\d{2}(?!\d)")
+TIMECODE_SPLIT_RE = re.compile(r"\n(?=(?:\d{1,2}:)?\d{1,2}:\d{2}\b)")
+TIMECODE_LINE_RE = re.compile(r"(?:\d{1,2}:)?\d{1,2}:\d{2}\b")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+SPACES_RE = re.compile(r"[ \t]+")
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """Токенизатор модели извлечения (tiktoken — опциональная зависимость)."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(settings.openai_model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов текста для модели извлечения."""
+    encoding = _get_encoding()
+    if encoding is None:
+        raise RuntimeError("Token counting requires tiktoken: pip install -e .[tokens]")
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _chunk_budget() -> tuple[int, Callable[[str], int]]:
+    """Целевой размер чанка и функция измерения: символы или токены модели."""
+    if settings.chunk_by_tokens:
+        return settings.chunk_target_tokens, count_tokens
+    return settings.chunk_target_chars, len
 
 
 def normalize_text(text: str) -> str:
     """Нормализует текст: убирает лишние пробелы и переносы."""
     text = text.replace("\r\n", "\n").replace("\r", "\n")
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    text = re.sub(r"[ \t]+", " ", text)
+    text = BLANK_LINES_RE.sub("\n\n", text)
+    text = SPACES_RE.sub(" ", text)
     return text.strip()
 
 
-def extract_metadata(text: str, filename: str) -> tuple[str, Episode]:
+def _parse_metadata(head_lines: list[str], filename: str) -> tuple[int, Episode]:
     """
-    Пытается извлечь метаданные из начала файла.
-    Возвращает (очищенный текст, Episode).
+    Разбирает метаданные в первых 20 строках.
+    Возвращает (число строк метаданных, Episode); doc_id заполняет вызывающий.
     """
-    lines = text.split("\n")
     title = filename.replace(".txt", "").replace(".md", "").replace("_", " ").strip()
     date = None
     guests = []
     
     metadata_end = 0
-    for i, line in enumerate(lines[:20]):
+    for i, line in enumerate(head_lines[:20]):
         line_lower = line.lower().strip()
         if line_lower.startswith("title:") or line_lower.startswith("название:"):
             title = line.split(":", 1)[1].strip()
@@ -42,11 +75,8 @@ def extract_metadata(text: str, filename: str) -> tuple[str, Episode]:
             metadata_end = i + 1
             break
     
-    cleaned_text = "\n".join(lines[metadata_end:]).strip()
-    
-    doc_id = f"doc_{uuid.uuid4().hex[:12]}"
     episode = Episode(
-        doc_id=doc_id,
+        doc_id="",
         title=title,
         filename=filename,
         date=date,
@@ -54,58 +84,118 @@ def extract_metadata(text: str, filename: str) -> tuple[str, Episode]:
         source_path=filename,
     )
     
+    return metadata_end, episode
+
+
+def _scan_lines(lines: Iterable[str]) -> tuple[str, bool]:
+    """
+    Один проход по строкам документа.
+    Возвращает (doc_id из хеша содержимого, есть ли таймкоды).
+    Хеш не зависит от пробелов, пустых строк и имени файла, поэтому
+    переименованный или переэкспортированный транскрипт получает тот же doc_id.
+    """
+    digest = hashlib.sha256()
+    has_timecode = False
+    for line in lines:
+        words = line.split()
+        if words:
+            digest.update(" ".join(words).encode("utf-8"))
+            digest.update(b"\n")
+            if not has_timecode and TIMECODE_RE.search(line):
+                has_timecode = True
+    return f"doc_{digest.hexdigest()[:12]}", has_timecode
+
+
+def extract_metadata(text: str, filename: str) -> tuple[str, Episode]:
+    """
+    Пытается извлечь метаданные из начала файла.
+    Возвращает (очищенный текст, Episode).
+    """
+    # Метаданные ищем только в первых 20 строках, остаток текста не режем на строки
+    lines = text.split("\n", 20)
+    metadata_end, episode = _parse_metadata(lines[:20], filename)
+    cleaned_text = "\n".join(lines[metadata_end:]).strip()
+    episode.doc_id, _ = _scan_lines(cleaned_text.split("\n"))
+    
     return cleaned_text, episode
 
 
 def split_by_timecodes_or_paragraphs(text: str) -> list[str]:
     """Разбивает текст по таймкодам или абзацам."""
     if TIMECODE_RE.search(text):
-        parts = re.split(r"\n(?=(?:\d{1,2}:)?\d{1,2}:\d{2}\b)", text)
-        return [p.strip() for p in parts if p.strip()]
-    return [p.strip() for p in text.split("\n\n") if p.strip()]
+        parts = TIMECODE_SPLIT_RE.split(text)
+    else:
+        parts = text.split("\n\n")
+    return [stripped for p in parts if (stripped := p.strip())]
 
 
-def pack_to_chunks(
-    parts: list[str],
-    target_chars: int,
-    overlap_chars: int
-) -> list[tuple[str, int, int]]:
+def iter_packed_chunks(
+    parts: Iterable[str],
+    target_size: int,
+    overlap_chars: int,
+    measure: Callable[[str], int] = len,
+) -> Iterator[tuple[str, int, int]]:
     """
-    Собирает части в чанки нужного размера.
-    Возвращает [(text, char_start, char_end), ...]
+    Собирает части в чанки нужного размера по мере поступления частей.
+    Размер считается функцией measure (символы или токены), позиции — в символах.
+    Буфер — список частей, склеиваемый один раз при выдаче чанка.
+    Возвращает (text, char_start, char_end).
     """
-    chunks = []
-    buf = ""
+    sep_size = measure("\n\n")
+    buf: list[str] = []
+    buf_len = 0
+    buf_size = 0
     buf_start = 0
     current_pos = 0
+    last_tail = None
     
     for p in parts:
         part_len = len(p)
+        part_size = measure(p)
         
-        if len(buf) + len(p) + 2 <= target_chars:
+        if buf_size + part_size + sep_size <= target_size:
             if buf:
-                buf = buf + "\n\n" + p
+                buf.append(p)
+                buf_len += 2 + part_len
+                buf_size += sep_size + part_size
             else:
-                buf = p
+                buf = [p]
+                buf_len = part_len
+                buf_size = part_size
                 buf_start = current_pos
         else:
             if buf:
-                chunks.append((buf, buf_start, buf_start + len(buf)))
+                text = "\n\n".join(buf)
+                yield text, buf_start, buf_start + buf_len
+                last_tail = text[-overlap_chars:] if overlap_chars else ""
             
-            if overlap_chars and chunks:
-                tail = chunks[-1][0][-overlap_chars:]
-                buf = tail + "\n\n" + p
-                buf_start = current_pos - len(tail)
+            if overlap_chars and last_tail is not None:
+                buf = [last_tail, p]
+                buf_len = len(last_tail) + 2 + part_len
+                buf_size = measure(last_tail) + sep_size + part_size
+                buf_start = current_pos - len(last_tail)
             else:
-                buf = p
+                buf = [p]
+                buf_len = part_len
+                buf_size = part_size
                 buf_start = current_pos
         
         current_pos += part_len + 2
     
     if buf:
-        chunks.append((buf, buf_start, buf_start + len(buf)))
-    
-    return chunks
+        yield "\n\n".join(buf), buf_start, buf_start + buf_len
+
+
+def pack_to_chunks(
+    parts: list[str],
+    target_chars: int,
+    overlap_chars: int
+) -> list[tuple[str, int, int]]:
+    """
+    Собирает части в чанки нужного размера.
+    Возвращает [(text, char_start, char_end), ...]
+    """
+    return list(iter_packed_chunks(parts, target_chars, overlap_chars))
 
 
 def extract_timecode(text: str) -> str | None:
@@ -121,28 +211,46 @@ def chunk_document(text: str, doc_id: str) -> list[Chunk]:
     """
     text = normalize_text(text)
     parts = split_by_timecodes_or_paragraphs(text)
-    packed = pack_to_chunks(
-        parts,
-        settings.chunk_target_chars,
-        settings.chunk_overlap_chars
-    )
-    
-    chunks = []
-    for i, (chunk_text, char_start, char_end) in enumerate(packed):
-        start_time = extract_timecode(chunk_text)
-        
-        chunk = Chunk(
-            chunk_id=f"{doc_id}_chunk_{i:04d}",
-            doc_id=doc_id,
-            order=i,
-            text=chunk_text,
-            char_start=char_start,
-            char_end=char_end,
-            start_time=start_time,
-        )
-        chunks.append(chunk)
+    target_size, measure = _chunk_budget()
+    packed = iter_packed_chunks(parts, target_size, settings.chunk_overlap_chars, measure)
     
-    return chunks
+    return [
+        _build_chunk(doc_id, i, chunk_text, char_start, char_end)
+        for i, (chunk_text, char_start, char_end) in enumerate(packed)
+    ]
+
+
+@lru_cache(maxsize=1)
+def _optional_encoding():
+    """Токенизатор или None, если tiktoken не установлен или не смог загрузить словарь (offline)."""
+    try:
+        return _get_encoding()
+    except Exception:
+        return None
+
+
+def _cached_token_count(text: str) -> int | None:
+    """
+    Число токенов для Chunk.token_count в обоих режимах чанкинга.
+    При чанкинге по символам без токенизатора — None, а не ошибка.
+    """
+    if settings.chunk_by_tokens:
+        return count_tokens(text)
+    encoding = _optional_encoding()
+    return len(encoding.encode(text, disallowed_special=())) if encoding is not None else None
+
+
+def _build_chunk(doc_id: str, order: int, text: str, char_start: int, char_end: int) -> Chunk:
+    return Chunk(
+        chunk_id=f"{doc_id}_chunk_{order:04d}",
+        doc_id=doc_id,
+        order=order,
+        text=text,
+        char_start=char_start,
+        char_end=char_end,
+        start_time=extract_timecode(text),
+        token_count=_cached_token_count(text),
+    )
 
 
 def process_transcript_file(filepath: Path) -> tuple[Episode, list[Chunk]]:
@@ -157,3 +265,77 @@ def process_transcript_file(filepath: Path) -> tuple[Episode, list[Chunk]]:
     chunks = chunk_document(cleaned_text, episode.doc_id)
     
     return episode, chunks
+
+
+def _read_lines(filepath: Path, skip: int = 0) -> Iterator[str]:
+    """Построчно читает файл (без '\\n'), пропуская первые skip строк."""
+    with open(filepath, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if i >= skip:
+                yield line[:-1] if line.endswith("\n") else line
+
+
+def _iter_normalized_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Построчная версия normalize_text (крайние пробелы снимаются на уровне частей)."""
+    blank_run = 0
+    for line in lines:
+        if line:
+            blank_run = 0
+            yield SPACES_RE.sub(" ", line)
+        else:
+            blank_run += 1
+            if blank_run == 1:
+                yield line
+
+
+def _iter_parts(lines: Iterable[str], by_timecode: bool) -> Iterator[str]:
+    """Потоковая версия split_by_timecodes_or_paragraphs."""
+    buf: list[str] = []
+    for line in lines:
+        if by_timecode:
+            is_boundary = bool(buf) and TIMECODE_LINE_RE.match(line)
+        else:
+            is_boundary = not line
+        
+        if is_boundary:
+            if part := "\n".join(buf).strip():
+                yield part
+            buf = [] if not line else [line]
+        else:
+            buf.append(line)
+    
+    if part := "\n".join(buf).strip():
+        yield part
+
+
+def iter_document_chunks(lines: Iterable[str], doc_id: str, by_timecode: bool) -> Iterator[Chunk]:
+    """
+    Потоково разбивает документ на чанки.
+    by_timecode — есть ли в документе таймкоды (см. _scan_lines).
+    Память — O(размер чанка), результат совпадает с chunk_document.
+    """
+    parts = _iter_parts(_iter_normalized_lines(lines), by_timecode)
+    target_size, measure = _chunk_budget()
+    packed = iter_packed_chunks(parts, target_size, settings.chunk_overlap_chars, measure)
+    for i, (chunk_text, char_start, char_end) in enumerate(packed):
+        yield _build_chunk(doc_id, i, chunk_text, char_start, char_end)
+
+
+def stream_transcript_file(filepath: Path) -> tuple[Episode, Iterator[Chunk]]:
+    """
+    Потоковый вариант process_transcript_file для очень больших файлов.
+    Первый проход считает хеш содержимого (doc_id) и ищет таймкоды,
+    второй — генератор Chunk, читающий файл по мере потребления.
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        head = []
+        for line in f:
+            head.append(line[:-1] if line.endswith("\n") else line)
+            if len(head) == 20:
+                break
+    metadata_end, episode = _parse_metadata(head, filepath.name)
+    episode.source_path = str(filepath)
+    episode.doc_id, by_timecode = _scan_lines(_read_lines(filepath, metadata_end))
+    
+    chunks = iter_document_chunks(_read_lines(filepath, metadata_end), episode.doc_id, by_timecode)
+    return episode, chunks
@@ -5,14 +5,18 @@ import typer
 from rich.console import Console
 
 app = typer.Typer(help="BioIdeas - Extract biotech startup ideas from podcast transcripts")
+bench_app = typer.Typer(help="Бенчмарки инфраструктуры (без вызовов LLM)")
+app.add_typer(bench_app, name="bench")
 console = Console()
 
 
 @app.command()
-def ingest():
+def ingest(
+    workers: int = typer.Option(0, help="Число процессов (0 = по настройкам/числу ядер)"),
+):
     """Step 01: Загрузить транскрипты и разбить на чанки."""
     from .pipeline.s01_ingest import main
-    main()
+    main(workers=workers or None)
 
 
 @app.command()
@@ -29,6 +33,37 @@ def extract():
     main()
 
 
+@app.command("validate-quotes")
+def validate_quotes():
+    """Перепроверить цитаты всех nuggets и сохранить их позиции в чанках."""
+    from .pipeline.s03_extract_nuggets import revalidate_quotes
+    stats = revalidate_quotes()
+    console.print(
+        f"[green]Quotes: {stats['quotes']}[/green] — exact {stats['exact']}, "
+        f"fuzzy {stats['fuzzy']}, not found {stats['not_found']}, missing chunk {stats['no_chunk']}"
+    )
+
+
+@app.command()
+def prefilter(
+    report: bool = typer.Option(False, "--report", help="Только отчёт recall/экономии по порогам"),
+):
+    """Обучить пре-фильтр чанков для step 03 на истории извлечения."""
+    from . import prefilter as pf
+    if report:
+        pf.report()
+    else:
+        pf.train()
+        console.print("Set BIOIDEAS_PREFILTER_THRESHOLD to enable it (see --report).")
+
+
+@app.command("dedupe-nuggets")
+def dedupe_nuggets():
+    """Step 03b: Схлопнуть почти одинаковые nuggets перед синтезом идей."""
+    from .pipeline.s03b_dedupe_nuggets import main
+    main()
+
+
 @app.command()
 def synthesize():
     """Step 04: Синтезировать Idea Cards."""
@@ -38,23 +73,44 @@ def synthesize():
 
 @app.command()
 def dedupe():
-    """Step 05: Дедупликация и кластеризация идей."""
+    """Step 05: Дедупликация и кластеризация новых идей (инкрементально)."""
     from .pipeline.s05_dedupe_cluster import main
     main()
 
 
 @app.command()
-def score():
+def recluster():
+    """Step 05 целиком: заново дедуплицировать и кластеризовать все идеи."""
+    from .pipeline.s05_dedupe_cluster import main
+    main(full=True)
+
+
+@app.command()
+def score(
+    cluster: list[int] = typer.Option(None, "--cluster", help="Оценивать только идеи этих кластеров (можно повторять)"),
+    per_cluster: int = typer.Option(0, help="Случайная выборка не более N новых идей на кластер (0 = все)"),
+):
     """Step 06: Оценить идеи по 5 критериям."""
     from .pipeline.s06_score import main
-    main()
+    main(cluster or None, per_cluster)
+
+
+@app.command("score-predictor")
+def score_predictor():
+    """Отчёт: согласие предсказанных по эмбеддингам оценок с LLM на отложенных идеях."""
+    from .score_predictor import report
+    report()
+    console.print("Set BIOIDEAS_SCORE_PREDICTOR=1 to let step 06 use it.")
 
 
 @app.command()
-def tournament():
+def tournament(
+    cluster: list[int] = typer.Option(None, "--cluster", help="Турнир только среди идей этих кластеров (можно повторять)"),
+    per_cluster: int = typer.Option(0, help="Не более N лучших по скору идей на кластер (0 = без ограничения)"),
+):
     """Step 07: Провести турнир попарных сравнений."""
     from .pipeline.s07_tournament import main
-    main()
+    main(cluster or None, per_cluster)
 
 
 @app.command()
@@ -64,12 +120,115 @@ def export():
     main()
 
 
+@app.command()
+def partition():
+    """Перенести chunks/nuggets/ideas в раскладку по шардам (doc_id)."""
+    from .config import PROCESSED_DIR
+    from .models import Chunk, Nugget, IdeaCard
+    from .storage import partition_jsonl
+    
+    for filename, model in [
+        ("chunks.jsonl", Chunk),
+        ("nuggets.jsonl", Nugget),
+        ("ideas.jsonl", IdeaCard),
+    ]:
+        n_shards = partition_jsonl(PROCESSED_DIR / filename, model)
+        console.print(f"  {filename}: {n_shards} shards")
+    console.print("Set BIOIDEAS_PARTITIONED=1 to keep writing shards.")
+
+
+@app.command()
+def compress():
+    """Сжать артефакты (JSONL и шарды) в zstd-фреймы с индексом."""
+    from .config import PROCESSED_DIR
+    from .storage import compress_artifact, MANIFEST_NAME
+    
+    # Общие файлы и артефакты, от которых после `bioideas partition` остались только шарды
+    artifacts = set(PROCESSED_DIR.glob("*.jsonl")) | {
+        directory.with_suffix(".jsonl")
+        for directory in PROCESSED_DIR.iterdir()
+        if (directory / MANIFEST_NAME).exists()
+    }
+    for filepath in sorted(artifacts):
+        n_records = compress_artifact(filepath)
+        if n_records:
+            console.print(f"  {filepath.name}: {n_records} records compressed")
+
+
+@bench_app.command("storage")
+def bench_storage():
+    """Размер и скорость чтения: обычный JSONL против zstd-фреймов."""
+    from .benchmarks import bench_storage
+    bench_storage()
+
+
+@bench_app.command("ingest")
+def bench_ingest(
+    files: int = typer.Option(200, help="Число синтетических транскриптов"),
+    workers: int = typer.Option(0, help="Число процессов (0 = число ядер)"),
+):
+    """Пропускная способность s01 (files/sec, MB/sec)."""
+    from .benchmarks import bench_ingest
+    bench_ingest(files, workers or None)
+
+
+@bench_app.command("quotes")
+def bench_quotes():
+    """Скорость проверки цитат: старая проверка по 5 словам против выравнивания."""
+    from .benchmarks import bench_quotes
+    bench_quotes()
+
+
+@bench_app.command("dedupe")
+def bench_dedupe(
+    sizes: str = typer.Option("1000,5000,20000", help="Размеры синтетических наборов"),
+    dim: int = typer.Option(3072, help="Размерность векторов"),
+):
+    """Поиск дубликатов s05: полная матрица против блочного float32."""
+    from .benchmarks import bench_dedupe
+    bench_dedupe([int(n) for n in sizes.split(",")], dim)
+
+
+@bench_app.command("tournament")
+def bench_tournament(
+    ideas: int = typer.Option(100, help="Число синтетических идей"),
+    seeds: int = typer.Option(5, help="Число повторов симуляции"),
+    spread: float = typer.Option(1.0, help="Разброс истинных сил (логиты)"),
+    group_size: int = typer.Option(None, help="Размер группы listwise-режима (по умолчанию из настроек)"),
+):
+    """Турнир s07 на симуляции: пары против групп, случайное расписание против адаптивного."""
+    from .benchmarks import bench_tournament
+    bench_tournament(ideas, seeds=seeds, spread=spread, group_size=group_size)
+
+
+@bench_app.command("tournament-scale")
+def bench_tournament_scale(
+    sizes: str = typer.Option("615,2000,5000", help="Размеры пула идей через запятую"),
+    degree: int = typer.Option(None, help="Степень графа сравнений (по умолчанию из настроек)"),
+):
+    """Турнир sparse по всему пулу: время раундов и разреженного решения, качество рейтинга."""
+    from .benchmarks import bench_tournament_scale
+    bench_tournament_scale([int(n) for n in sizes.split(",")], degree)
+
+
+@bench_app.command("cluster")
+def bench_cluster(
+    sizes: str = typer.Option("1000,5000,20000", help="Размеры синтетических наборов"),
+    dim: int = typer.Option(3072, help="Размерность векторов"),
+    reducers: str = typer.Option("none,pca,umap", help="Методы снижения размерности"),
+    dims: int = typer.Option(0, help="Целевая размерность (0 = settings.cluster_dims)"),
+):
+    """Кластеризация s05: время и качество HDBSCAN с PCA/UMAP и без."""
+    from .benchmarks import bench_cluster
+    bench_cluster([int(n) for n in sizes.split(",")], dim, reducers.split(","), dims or None)
+
+
 @app.command()
 def run_all():
     """Запустить весь пайплайн последовательно."""
     console.print("[bold blue]Running full pipeline...[/bold blue]\n")
     
-    from .pipeline import s01_ingest, s02_embed_chunks, s03_extract_nuggets
+    from .pipeline import s01_ingest, s02_embed_chunks, s03_extract_nuggets, s03b_dedupe_nuggets
     from .pipeline import s04_synthesize_ideas, s05_dedupe_cluster, s06_score
     from .pipeline import s07_tournament, s08_export_memos
     
@@ -77,6 +236,7 @@ def run_all():
         ("01. Ingest", s01_ingest.main),
         ("02. Embed Chunks", s02_embed_chunks.main),
         ("03. Extract Nuggets", s03_extract_nuggets.main),
+        ("03b. Dedupe Nuggets", s03b_dedupe_nuggets.main),
         ("04. Synthesize Ideas", s04_synthesize_ideas.main),
         ("05. Dedupe & Cluster", s05_dedupe_cluster.main),
         ("06. Score Ideas", s06_score.main),
@@ -94,6 +254,10 @@ def run_all():
             console.print(f"[red]Error in {name}: {e}[/red]")
             raise typer.Exit(1)
     
+    from .config import settings
+    if settings.compress_artifacts:
+        compress()
+    
     console.print("\n[bold green]Pipeline complete![/bold green]")
 
 
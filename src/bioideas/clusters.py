@@ -0,0 +1,139 @@
+"""
+Таблица кластеров идей, которую пишет s05.
+
+- idea_clusters.jsonl   — идея → cluster_id (-1 = шум), в том числе для дубликатов;
+- clusters.jsonl        — кластер: размер, медоида, уникальные идеи;
+- cluster_centroids.npz — центроиды кластеров в пространстве эмбеддингов;
+- duplicates.jsonl      — дубликат → каноническая идея.
+
+Кластеры считаются по уникальным идеям (ideas_deduped.jsonl): центроид —
+нормированное среднее их эмбеддингов, медоида — ближайшая к центроиду идея.
+s06, s07 и UI фильтруют и выбирают идеи по кластерам без повторной кластеризации.
+"""
+import random
+from collections import defaultdict
+
+import numpy as np
+
+from .config import PROCESSED_DIR
+from .models import IdeaCluster, ClusterAssignment, DuplicateLink
+from .similarity import normalize_rows
+from .storage import read_jsonl, write_jsonl
+
+IDEA_CLUSTERS_FILE = PROCESSED_DIR / "idea_clusters.jsonl"
+CLUSTERS_FILE = PROCESSED_DIR / "clusters.jsonl"
+CENTROIDS_FILE = PROCESSED_DIR / "cluster_centroids.npz"
+DUPLICATES_FILE = PROCESSED_DIR / "duplicates.jsonl"
+
+NOISE = -1
+
+
+def build_clusters(
+    idea_ids: list[str],
+    embeddings,
+    labels: dict[str, int],
+    duplicates: dict[str, str],
+) -> tuple[list[IdeaCluster], np.ndarray]:
+    """
+    Кластеры по уникальным идеям: состав, размер, медоида и центроиды.
+    Возвращает (кластеры по возрастанию cluster_id, матрица центроидов в том же порядке).
+    """
+    matrix = normalize_rows(embeddings)
+    members: dict[int, list[int]] = defaultdict(list)
+    seen = set()
+    for i, idea_id in enumerate(idea_ids):
+        label = labels.get(idea_id, NOISE)
+        if label != NOISE and idea_id not in duplicates and idea_id not in seen:
+            members[label].append(i)
+        seen.add(idea_id)
+
+    clusters = []
+    centroids = []
+    for cluster_id in sorted(members):
+        idx = members[cluster_id]
+        centroid = normalize_rows(matrix[idx].mean(axis=0, keepdims=True))[0]
+        medoid = idx[int(np.argmax(matrix[idx] @ centroid))]
+        clusters.append(IdeaCluster(
+            cluster_id=cluster_id,
+            size=len(idx),
+            medoid_idea_id=idea_ids[medoid],
+            idea_ids=[idea_ids[i] for i in idx],
+        ))
+        centroids.append(centroid)
+
+    dim = matrix.shape[1] if matrix.ndim == 2 else 0
+    return clusters, np.array(centroids, dtype=np.float32).reshape(len(centroids), dim)
+
+
+def save_cluster_table(
+    labels: dict[str, int],
+    duplicates: dict[str, str],
+    clusters: list[IdeaCluster],
+    centroids: np.ndarray,
+) -> None:
+    write_jsonl(
+        IDEA_CLUSTERS_FILE,
+        [ClusterAssignment(idea_id=idea_id, cluster_id=label) for idea_id, label in labels.items()],
+    )
+    write_jsonl(
+        DUPLICATES_FILE,
+        [DuplicateLink(duplicate_id=dup, canonical_id=canon) for dup, canon in duplicates.items()],
+    )
+    write_jsonl(CLUSTERS_FILE, clusters)
+    np.savez(
+        CENTROIDS_FILE,
+        cluster_ids=np.array([c.cluster_id for c in clusters], dtype=np.int64),
+        vectors=centroids,
+    )
+
+
+def load_cluster_map() -> dict[str, int]:
+    """idea_id → cluster_id (пусто, если s05 ещё не запускался)."""
+    return {a.idea_id: a.cluster_id for a in read_jsonl(IDEA_CLUSTERS_FILE, ClusterAssignment)}
+
+
+def load_clusters() -> list[IdeaCluster]:
+    return read_jsonl(CLUSTERS_FILE, IdeaCluster)
+
+
+def load_duplicates() -> dict[str, str]:
+    """duplicate_id → canonical_id."""
+    return {d.duplicate_id: d.canonical_id for d in read_jsonl(DUPLICATES_FILE, DuplicateLink)}
+
+
+def load_centroids() -> dict[int, np.ndarray]:
+    if not CENTROIDS_FILE.exists():
+        return {}
+    data = np.load(CENTROIDS_FILE)
+    return dict(zip(data["cluster_ids"].tolist(), data["vectors"]))
+
+
+def filter_by_clusters(idea_ids: list[str], cluster_map: dict[str, int], clusters: set[int]) -> list[str]:
+    """Идеи из выбранных кластеров (порядок сохраняется)."""
+    return [i for i in idea_ids if cluster_map.get(i, NOISE) in clusters]
+
+
+def sample_by_cluster(
+    idea_ids: list[str],
+    cluster_map: dict[str, int],
+    per_cluster: int,
+    rng: random.Random | None = None,
+) -> list[str]:
+    """
+    Не более per_cluster идей из каждого кластера: первые по порядку idea_ids
+    или случайные, если передан rng. Шум и идеи без кластера не ограничиваются —
+    каждая из них сама себе кластер. Порядок результата — порядок idea_ids.
+    """
+    candidates = list(idea_ids)
+    if rng is not None:
+        rng.shuffle(candidates)
+    taken: dict[int, int] = defaultdict(int)
+    chosen = set()
+    for idea_id in candidates:
+        cluster_id = cluster_map.get(idea_id, NOISE)
+        if cluster_id == NOISE:
+            chosen.add(idea_id)
+        elif taken[cluster_id] < per_cluster:
+            taken[cluster_id] += 1
+            chosen.add(idea_id)
+    return [i for i in idea_ids if i in chosen]
@@ -0,0 +1,188 @@
+"""Сжатое хранение JSONL артефактов и memo в zstd.
+
+`<name>.jsonl.zst` — последовательность независимых zstd-фреймов
+(по `settings.zstd_records_per_frame` строк), рядом индекс
+`<name>.jsonl.zst.idx` со смещениями фреймов. Чтение идёт фрейм за фреймом,
+а произвольная запись достаётся распаковкой одного фрейма.
+
+Новые записи по-прежнему дописываются в обычный `<name>.jsonl`;
+`compress_jsonl` переносит этот «хвост» в новые фреймы.
+"""
+import bisect
+import json
+import os
+from pathlib import Path
+from typing import Iterator
+
+from .config import settings
+
+ZSTD_SUFFIX = ".zst"
+INDEX_SUFFIX = ".idx"
+
+
+def _zstd():
+    """Лениво импортирует zstandard (опциональная зависимость)."""
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError(
+            "zstd storage requires the 'zstandard' package: pip install -e .[zstd]"
+        ) from e
+    return zstandard
+
+
+def compressed_path(path: Path) -> Path:
+    """nuggets.jsonl -> nuggets.jsonl.zst"""
+    return path.with_name(path.name + ZSTD_SUFFIX)
+
+
+def index_path(path: Path) -> Path:
+    """nuggets.jsonl -> nuggets.jsonl.zst.idx"""
+    return path.with_name(path.name + ZSTD_SUFFIX + INDEX_SUFFIX)
+
+
+def load_frame_index(path: Path) -> list[dict]:
+    """Возвращает индекс фреймов [{offset, length, first, records}, ...]."""
+    idx = index_path(path)
+    if not idx.exists():
+        return []
+    return json.loads(idx.read_text(encoding="utf-8"))["frames"]
+
+
+def _write_frame_index(path: Path, frames: list[dict]) -> None:
+    idx = index_path(path)
+    tmp = idx.with_name(idx.name + ".tmp")
+    records = frames[-1]["first"] + frames[-1]["records"] if frames else 0
+    tmp.write_text(json.dumps({"records": records, "frames": frames}), encoding="utf-8")
+    os.replace(tmp, idx)
+
+
+def append_frames(
+    path: Path,
+    lines: list[bytes],
+    records_per_frame: int | None = None,
+    level: int | None = None,
+) -> int:
+    """
+    Дописывает строки (с '\\n' на конце) новыми независимыми фреймами.
+    Возвращает число добавленных фреймов.
+    """
+    if not lines:
+        return 0
+    zstd = _zstd()
+    records_per_frame = records_per_frame or settings.zstd_records_per_frame
+    cctx = zstd.ZstdCompressor(level=level or settings.zstd_level, write_content_size=True)
+
+    zpath = compressed_path(path)
+    frames = load_frame_index(path)
+    offset = zpath.stat().st_size if zpath.exists() else 0
+    first = frames[-1]["first"] + frames[-1]["records"] if frames else 0
+
+    added = 0
+    with open(zpath, "ab") as f:
+        for i in range(0, len(lines), records_per_frame):
+            block = lines[i:i + records_per_frame]
+            data = cctx.compress(b"".join(block))
+            f.write(data)
+            frames.append({
+                "offset": offset,
+                "length": len(data),
+                "first": first,
+                "records": len(block),
+            })
+            offset += len(data)
+            first += len(block)
+            added += 1
+
+    _write_frame_index(path, frames)
+    return added
+
+
+def _decode_lines(data: bytes) -> list[str]:
+    # split("\n"), а не splitlines(): в JSON могут быть U+2028 и т.п.
+    return [line for line in data.decode("utf-8").split("\n") if line.strip()]
+
+
+def iter_compressed_lines(path: Path) -> Iterator[str]:
+    """Потоково читает строки из `<path>.zst`, не распаковывая файл целиком."""
+    zpath = compressed_path(path)
+    if not zpath.exists():
+        return
+    dctx = _zstd().ZstdDecompressor()
+    frames = load_frame_index(path)
+
+    with open(zpath, "rb") as f:
+        if not frames:
+            # Индекса нет (например, файл скопирован отдельно) — читаем потоком
+            reader = dctx.stream_reader(f, read_across_frames=True)
+            tail = b""
+            while chunk := reader.read(1 << 20):
+                *complete, tail = (tail + chunk).split(b"\n")
+                for line in complete:
+                    if line.strip():
+                        yield line.decode("utf-8")
+            if tail.strip():
+                yield tail.decode("utf-8")
+            return
+
+        for frame in frames:
+            f.seek(frame["offset"])
+            yield from _decode_lines(dctx.decompress(f.read(frame["length"])))
+
+
+def read_compressed_lines(path: Path, start: int, count: int = 1) -> list[str]:
+    """Читает строки [start, start+count), распаковывая только нужные фреймы."""
+    frames = load_frame_index(path)
+    if not frames or count <= 0:
+        return []
+    dctx = _zstd().ZstdDecompressor()
+    firsts = [fr["first"] for fr in frames]
+    pos = max(bisect.bisect_right(firsts, start) - 1, 0)
+
+    result = []
+    with open(compressed_path(path), "rb") as f:
+        while pos < len(frames) and len(result) < count:
+            frame = frames[pos]
+            f.seek(frame["offset"])
+            lines = _decode_lines(dctx.decompress(f.read(frame["length"])))
+            skip = max(start - frame["first"], 0)
+            result.extend(lines[skip:skip + count - len(result)])
+            pos += 1
+    return result
+
+
+def drop_compressed(path: Path) -> None:
+    """Удаляет сжатую копию и индекс (когда артефакт перезаписывается целиком)."""
+    for p in (compressed_path(path), index_path(path)):
+        if p.exists():
+            p.unlink()
+
+
+def compress_jsonl(path: Path) -> int:
+    """
+    Переносит несжатый хвост `<path>` во фреймы `<path>.zst`.
+    Не вызывать одновременно с процессом, который дописывает в тот же файл.
+    Возвращает число перенесённых записей.
+    """
+    if not path.exists():
+        return 0
+    with open(path, "rb") as f:
+        lines = [line if line.endswith(b"\n") else line + b"\n" for line in f if line.strip()]
+    append_frames(path, lines)
+    path.unlink()
+    return len(lines)
+
+
+def write_text_compressed(path: Path, text: str) -> Path:
+    """Записывает текст (memo) одним zstd-фреймом в `<path>.zst`."""
+    zpath = compressed_path(path)
+    cctx = _zstd().ZstdCompressor(level=settings.zstd_level, write_content_size=True)
+    zpath.write_bytes(cctx.compress(text.encode("utf-8")))
+    return zpath
+
+
+def read_text_any(path: Path) -> str:
+    """Читает текстовый файл, сжатый (`.zst`) или обычный."""
+    if path.name.endswith(ZSTD_SUFFIX):
+        return _zstd().ZstdDecompressor().decompress(path.read_bytes()).decode("utf-8")
+    return path.read_text(encoding="utf-8")
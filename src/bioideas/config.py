@@ -20,20 +20,83 @@ class Settings(BaseModel):
 
     chunk_target_chars: int = 4500
     chunk_overlap_chars: int = 300
+    # Альтернатива: размер чанка в токенах модели извлечения (нужен tiktoken)
+    chunk_by_tokens: bool = os.getenv("BIOIDEAS_CHUNK_BY_TOKENS", "0") == "1"
+    chunk_target_tokens: int = 1500
+
+    # Число процессов для s01 (0 = по числу ядер)
+    ingest_workers: int = int(os.getenv("BIOIDEAS_INGEST_WORKERS", "0"))
+    # Файлы крупнее порога режутся потоково, без загрузки в память целиком
+    stream_chunking_min_bytes: int = 16 * 1024 * 1024
 
     max_nuggets_per_chunk: int = 3
+    # Косинусная близость text_en, при которой nuggets одного kind схлопываются (s03b)
+    nugget_dedupe_threshold: float = 0.9
     max_ideas_per_episode: int = 12
 
+    # Режим s04: episode — батчи nuggets каждого эпизода, cluster — темы по всем эпизодам,
+    # mapreduce — черновики по окнам эпизода, затем не более max_ideas_per_episode идей
+    synthesis_mode: str = os.getenv("BIOIDEAS_SYNTHESIS_MODE", "episode")
+    # Режим cluster: целевой размер темы и сколько соседей из других эпизодов подтягивать
+    synthesis_cluster_size: int = 12
+    synthesis_cluster_neighbours: int = 5
+
+    # s05: снижение размерности перед HDBSCAN (pca, umap — нужен umap-learn, none)
+    cluster_reducer: str = os.getenv("BIOIDEAS_CLUSTER_REDUCER", "pca")
+    cluster_dims: int = int(os.getenv("BIOIDEAS_CLUSTER_DIMS", "32"))
+    # Потоки для расчёта core distances в HDBSCAN (-1 = все ядра)
+    cluster_n_jobs: int = int(os.getenv("BIOIDEAS_CLUSTER_N_JOBS", "-1"))
+
     max_output_tokens_extract: int = 800
     max_output_tokens_idea: int = 8000
+    max_output_tokens_candidates: int = 1500
     max_output_tokens_score: int = 800
+    # Сколько идей s06 оценивает одним запросом (1 = по одной)
+    score_batch_size: int = int(os.getenv("BIOIDEAS_SCORE_BATCH_SIZE", "8"))
+    # s06: предсказывать оценки по похожим уже оценённым идеям (score_predictor.py);
+    # в LLM уходят только неуверенные предсказания и идеи у порогов
+    score_predictor: bool = os.getenv("BIOIDEAS_SCORE_PREDICTOR", "0") == "1"
+    score_predictor_max_std: float = 2.5
+    score_predictor_min_similarity: float = 0.5
+    score_predictor_margin: float = 2.0
+
+    # s07: расписание турнира — adaptive (швейцарские пары по силе Брэдли–Терри,
+    # пока состав top-K не определён с уровнем z), random (прежнее) или sparse
+    # (весь пул идей: разреженный граф степени tournament_degree, затем adaptive)
+    tournament_schedule: str = os.getenv("BIOIDEAS_TOURNAMENT_SCHEDULE", "adaptive")
+    tournament_degree: int = int(os.getenv("BIOIDEAS_TOURNAMENT_DEGREE", "6"))
+    tournament_top_k: int = 10
+    tournament_confidence_z: float = 1.64
+    # s07: pairwise (пара идей на запрос) или listwise (ранжирование группы
+    # из tournament_group_size идей на запрос, раскладывается на пары)
+    tournament_mode: str = os.getenv("BIOIDEAS_TOURNAMENT_MODE", "pairwise")
+    tournament_group_size: int = int(os.getenv("BIOIDEAS_TOURNAMENT_GROUP_SIZE", "6"))
+    # s07: порядок идей в промпте — fixed (как в расписании), random или
+    # alternate (первой идёт идея, которую реже показывали первой);
+    # смещение первой позиции оценивается и вычитается из рейтинга
+    tournament_order: str = os.getenv("BIOIDEAS_TOURNAMENT_ORDER", "random")
+    tournament_position_correction: bool = os.getenv("BIOIDEAS_TOURNAMENT_POSITION_CORRECTION", "1") == "1"
 
     embed_batch_size: int = 100
+    # Число одновременных запросов к LLM (s04)
+    llm_concurrency: int = int(os.getenv("BIOIDEAS_LLM_CONCURRENCY", "4"))
     llm_retry_attempts: int = 3
     llm_retry_delay: float = 2.0
+    # Сколько раз s03 повторяет чанк, извлечение из которого упало
+    extract_max_attempts: int = 3
+    # Порог пре-фильтра чанков перед s03 (0 = выключен, см. prefilter.py)
+    prefilter_threshold: float = float(os.getenv("BIOIDEAS_PREFILTER_THRESHOLD", "0"))
 
     store_responses: bool = False
 
+    # Раскладка артефактов по шардам data/processed/<artifact>/<doc_id>.jsonl
+    partitioned_storage: bool = os.getenv("BIOIDEAS_PARTITIONED", "0") == "1"
+
+    # Сжатие артефактов и memo в zstd (независимые фреймы + индекс)
+    compress_artifacts: bool = os.getenv("BIOIDEAS_COMPRESS", "0") == "1"
+    zstd_level: int = 10
+    zstd_records_per_frame: int = 64
+
     qdrant_chunks_collection: str = "bioideas_chunks"
     qdrant_ideas_collection: str = "bioideas_ideas"
 
@@ -1,4 +1,8 @@
+import hashlib
 import time
+from pathlib import Path
+
+import numpy as np
 from openai import OpenAI
 from .config import settings
 
@@ -43,3 +47,40 @@ def embed_single(text: str) -> list[float]:
     """Создаёт эмбеддинг для одного текста."""
     result = embed_texts([text])
     return result[0] if result else []
+
+
+def _text_key(text: str) -> str:
+    return hashlib.sha256(f"{settings.openai_embed_model}\n{text}".encode("utf-8")).hexdigest()[:24]
+
+
+def embed_texts_cached(texts: list[str], cache_file: Path) -> np.ndarray:
+    """
+    Эмбеддинги с дисковым кешем (npz: ключ = хеш модели и текста).
+    В API уходят только тексты, которых ещё нет в кеше.
+    Возвращает матрицу float32 (len(texts) × dim).
+    """
+    cached: dict[str, np.ndarray] = {}
+    if cache_file.exists():
+        data = np.load(cache_file)
+        cached = dict(zip(data["keys"].tolist(), data["vectors"]))
+    
+    keys = [_text_key(t) for t in texts]
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+    
+    if missing:
+        vectors = embed_texts(list(missing.values()))
+        for key, vector in zip(missing, vectors):
+            cached[key] = np.asarray(vector, dtype=np.float32)
+        all_keys = list(cached)
+        np.savez(
+            cache_file,
+            keys=np.array(all_keys),
+            vectors=np.stack([cached[k] for k in all_keys]).astype(np.float32),
+        )
+    
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([cached[k] for k in keys]).astype(np.float32, copy=False)
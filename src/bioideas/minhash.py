@@ -0,0 +1,98 @@
+"""
+MinHash + LSH для поиска почти одинаковых чанков.
+
+Чанк → множество 5-словных шинглов → MinHash-подпись из NUM_PERM значений.
+LSH режет подпись на BANDS полос по ROWS значений: чанки с общей полосой —
+кандидаты, которые затем проверяются по оценке Jaccard.
+"""
+import re
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 5
+JACCARD_THRESHOLD = 0.8
+
+_WORD_RE = re.compile(r"\w+")
+
+# Multiply-shift хеширование в uint64: h(x) = (a*x + b) >> 32, a — нечётное
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, 2**63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2**63, size=NUM_PERM, dtype=np.uint64)
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """32-битные хеши 5-словных шинглов текста."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        words = words + [""] * (SHINGLE_WORDS - len(words))
+    shingles = {
+        " ".join(words[i:i + SHINGLE_WORDS])
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+    return np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+def signature(text: str) -> np.ndarray:
+    """MinHash-подпись текста (NUM_PERM значений uint32)."""
+    x = shingle_hashes(text)
+    with np.errstate(over="ignore"):
+        hashed = (_PERM_A[:, None] * x[None, :] + _PERM_B[:, None]) >> np.uint64(32)
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def estimated_jaccard(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """Оценка Jaccard по доле совпавших значений подписей."""
+    return float(np.mean(sig_a == sig_b))
+
+
+class MinHashLSH:
+    """LSH-индекс подписей: ключ → подпись, поиск кандидатов по полосам."""
+
+    def __init__(self, threshold: float = JACCARD_THRESHOLD):
+        self.threshold = threshold
+        self.signatures: dict[str, np.ndarray] = {}
+        self._buckets: list[dict[bytes, list[str]]] = [{} for _ in range(BANDS)]
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def insert(self, key: str, sig: np.ndarray) -> None:
+        self.signatures[key] = sig
+        for band, bucket in enumerate(self._buckets):
+            bucket.setdefault(sig[band * ROWS:(band + 1) * ROWS].tobytes(), []).append(key)
+
+    def query(self, sig: np.ndarray) -> list[tuple[str, float]]:
+        """Возвращает [(key, jaccard)] для найденных дубликатов, по убыванию сходства."""
+        candidates = set()
+        for band, bucket in enumerate(self._buckets):
+            candidates.update(bucket.get(sig[band * ROWS:(band + 1) * ROWS].tobytes(), ()))
+
+        matches = []
+        for key in candidates:
+            jaccard = estimated_jaccard(sig, self.signatures[key])
+            if jaccard >= self.threshold:
+                matches.append((key, jaccard))
+        return sorted(matches, key=lambda m: (-m[1], m[0]))
+
+    def save(self, filepath: Path) -> None:
+        keys = list(self.signatures)
+        matrix = np.stack([self.signatures[k] for k in keys]) if keys else np.zeros((0, NUM_PERM))
+        np.savez_compressed(filepath, keys=np.array(keys, dtype=str), signatures=matrix)
+
+    @classmethod
+    def load(cls, filepath: Path, threshold: float = JACCARD_THRESHOLD) -> "MinHashLSH":
+        index = cls(threshold)
+        if filepath.exists():
+            data = np.load(filepath)
+            for key, sig in zip(data["keys"], data["signatures"].astype(np.uint32)):
+                index.insert(str(key), sig)
+        return index
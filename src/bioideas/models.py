@@ -1,5 +1,6 @@
 from __future__ import annotations
 from pydantic import BaseModel, Field
+from pydantic.json_schema import SkipJsonSchema
 from typing import Literal
 from datetime import datetime
 
@@ -25,12 +26,19 @@ class Chunk(BaseModel):
     char_end: int
     start_time: str | None = None
     end_time: str | None = None
+    token_count: int | None = None  # токены модели извлечения (None без tiktoken)
+    duplicate_of: str | None = None  # chunk_id почти совпадающего чанка (MinHash)
 
 
 class Evidence(BaseModel):
     """Доказательство — цитата из чанка."""
     chunk_id: str
     quote: str = Field(description="Verbatim quote from that chunk (<= 25 words).")
+    # Позиция цитаты в Chunk.text и степень совпадения (1.0 — точное), см. quotes.py.
+    # Заполняются после ответа LLM, поэтому скрыты из JSON Schema.
+    char_start: SkipJsonSchema[int | None] = None
+    char_end: SkipJsonSchema[int | None] = None
+    match_score: SkipJsonSchema[float | None] = None
 
 
 class Nugget(BaseModel):
@@ -42,6 +50,32 @@ class Nugget(BaseModel):
     text_en: str = Field(description="Brief description in English")
     evidence: list[Evidence] = Field(default_factory=list)
     confidence: Literal["low", "medium", "high"]
+    # ID nuggets, схлопнутых в этот при дедупликации (s03b); скрыто из JSON Schema
+    merged_nugget_ids: SkipJsonSchema[list[str]] = Field(default_factory=list)
+
+
+class ExtractionStatus(BaseModel):
+    """Запись журнала s03: чем закончилось извлечение nuggets из чанка."""
+    chunk_id: str
+    status: Literal["ok", "empty", "failed", "skipped"]
+    attempts: int = 1
+    nuggets: int = 0
+    last_error: str | None = None
+    prefilter_score: float | None = None
+    prompt_version: str
+    updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+
+
+class SynthesisBatch(BaseModel):
+    """Запись журнала s04: батч nuggets, для которого синтезированы идеи."""
+    doc_id: str
+    batch_num: int
+    batch_hash: str
+    status: Literal["ok", "failed"]
+    nugget_ids: list[str] = Field(default_factory=list)
+    idea_ids: list[str] = Field(default_factory=list)
+    last_error: str | None = None
+    updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
 
 
 class NuggetList(BaseModel):
@@ -80,6 +114,41 @@ class IdeaCardList(BaseModel):
     ideas: list[IdeaCard] = Field(default_factory=list)
 
 
+class IdeaCandidate(BaseModel):
+    """Черновик идеи из одного окна nuggets (map-шаг s04 в режиме mapreduce)."""
+    title_ru: str = Field(description="Рабочее название идеи")
+    pitch_ru: str = Field(description="Два-три предложения: проблема и что строим")
+    source_nugget_ids: list[str] = Field(description="ID nuggets, на которых основана идея")
+    # Эпизод и окно, из которых получен кандидат; скрыты из JSON Schema
+    doc_id: SkipJsonSchema[str | None] = None
+    batch_hash: SkipJsonSchema[str | None] = None
+
+
+class IdeaCandidateList(BaseModel):
+    """Черновики идей из одного окна nuggets."""
+    candidates: list[IdeaCandidate] = Field(default_factory=list)
+
+
+class IdeaCluster(BaseModel):
+    """Кластер уникальных идей (s05): размер, медоида и состав."""
+    cluster_id: int
+    size: int
+    medoid_idea_id: str
+    idea_ids: list[str] = Field(default_factory=list)
+
+
+class ClusterAssignment(BaseModel):
+    """Кластер идеи по HDBSCAN (-1 = шум); есть и для дубликатов."""
+    idea_id: str
+    cluster_id: int
+
+
+class DuplicateLink(BaseModel):
+    """Идея-дубликат и каноническая идея, в которую она схлопнута (s05)."""
+    duplicate_id: str
+    canonical_id: str
+
+
 class ScoreCard(BaseModel):
     """Оценка идеи по 5 критериям."""
     idea_id: str
@@ -98,6 +167,13 @@ class ScoreCard(BaseModel):
 
     rationale_ru: str = Field(description="Краткая аргументация оценок")
     dealbreakers_ru: list[str] = Field(default_factory=list, description="Стоп-факторы")
+    # Оценка предсказана по похожим идеям (score_predictor.py), а не LLM
+    predicted: SkipJsonSchema[bool] = False
+
+
+class ScoreCardList(BaseModel):
+    """Оценки нескольких идей одним запросом (по одной на idea_id)."""
+    scores: list[ScoreCard] = Field(default_factory=list)
 
 
 class Comparison(BaseModel):
@@ -107,13 +183,23 @@ class Comparison(BaseModel):
     idea_b_id: str
     winner_id: str
     reasoning_ru: str
+    # listwise-режим s07: id ранжирования группы, из которого выведена пара
+    group_id: str | None = None
+    # Идея, показанная в промпте первой. None — порядок неизвестен (listwise)
+    # или запись старше поля: тогда первой всегда показывалась idea_a_id
+    first_id: str | None = None
+    # Ключ кеша суждений: пара/группа, содержимое карточек, версия промпта и модель
+    judgment_key: str | None = None
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
 
 
 class EloRating(BaseModel):
-    """Elo-рейтинг идеи после турнира."""
+    """Рейтинг идеи после турнира в шкале Elo."""
     idea_id: str
     elo: float = 1500.0
+    # 95% бутстрэп-интервал рейтинга (модель Брэдли–Терри по всем сравнениям)
+    elo_low: float | None = None
+    elo_high: float | None = None
     wins: int = 0
     losses: int = 0
     comparisons: int = 0
@@ -5,20 +5,36 @@ Step 01: Ingest transcripts and split into chunks.
 сохраняет episodes.jsonl и chunks.jsonl.
 
 Поддерживает инкрементальную загрузку — уже обработанные файлы пропускаются.
+Файлы разбираются в пуле процессов, результаты пишутся в порядке файлов.
+Очень большие файлы режутся потоково в основном процессе.
+
+doc_id — хеш содержимого, поэтому переименованный транскрипт не загружается
+повторно. Почти одинаковые чанки (MinHash/LSH) помечаются duplicate_of
+и в s03 не отправляются в LLM.
 """
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator
 from tqdm import tqdm
 from rich.console import Console
 
-from ..config import RAW_DIR, PROCESSED_DIR
-from ..chunking import process_transcript_file
+from ..config import RAW_DIR, PROCESSED_DIR, settings
+from ..chunking import process_transcript_file, stream_transcript_file
 from ..models import Episode, Chunk
-from ..storage import append_jsonl, read_jsonl, load_processed_ids
+from ..minhash import MinHashLSH, signature
+from ..storage import (
+    append_jsonl, append_jsonl_batch, read_jsonl, iter_jsonl, load_processed_ids, write_shard, update_manifest
+)
 
 console = Console()
 
 EPISODES_FILE = PROCESSED_DIR / "episodes.jsonl"
+# Файлы с тем же содержимым, что у уже загруженного эпизода (doc_id канонического)
+DUPLICATE_EPISODES_FILE = PROCESSED_DIR / "duplicate_episodes.jsonl"
 CHUNKS_FILE = PROCESSED_DIR / "chunks.jsonl"
+MINHASH_FILE = PROCESSED_DIR / "chunk_minhash.npz"
 
 
 def get_transcript_files() -> list[Path]:
@@ -29,10 +45,104 @@ def get_transcript_files() -> list[Path]:
     return sorted(files)
 
 
-def main():
+def _process_file_safe(filepath: Path) -> tuple[Episode | None, list[Chunk], str | None]:
+    """Обёртка для воркера: ошибки возвращаются, а не роняют пул."""
+    try:
+        episode, chunks = process_transcript_file(filepath)
+        return episode, chunks, None
+    except Exception as e:
+        return None, [], str(e)
+
+
+def iter_processed_files(
+    files: list[Path],
+    workers: int | None = None,
+) -> Iterator[tuple[Path, Episode | None, Iterable[Chunk], str | None]]:
+    """
+    Обрабатывает файлы в пуле процессов.
+    Результаты отдаются в порядке `files`, независимо от порядка завершения.
+    Для файлов крупнее settings.stream_chunking_min_bytes чанки отдаются
+    генератором, который читает файл по мере записи.
+    """
+    large = {f for f in files if f.stat().st_size >= settings.stream_chunking_min_bytes}
+    small = [f for f in files if f not in large]
+    
+    workers = workers or settings.ingest_workers or os.cpu_count() or 1
+    workers = min(workers, len(small))
+    
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if pool:
+            chunksize = max(1, len(small) // (workers * 4))
+            small_results = pool.map(_process_file_safe, small, chunksize=chunksize)
+        else:
+            small_results = map(_process_file_safe, small)
+        
+        for filepath in files:
+            if filepath in large:
+                try:
+                    episode, chunks = stream_transcript_file(filepath)
+                    yield filepath, episode, chunks, None
+                except Exception as e:
+                    yield filepath, None, [], str(e)
+            else:
+                yield filepath, *next(small_results)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+
+def _dedupe_body(chunk: Chunk, prev_end: int | None) -> str:
+    """Текст чанка без перекрытия с предыдущим чанком того же документа."""
+    overlap = prev_end - chunk.char_start if prev_end is not None else 0
+    return chunk.text[max(overlap, 0):]
+
+
+def load_chunk_index() -> MinHashLSH:
+    """LSH-индекс канонических чанков; недостающие в кэше подписи досчитываются."""
+    index = MinHashLSH.load(MINHASH_FILE)
+    prev_end: dict[str, int] = {}
+    for chunk in iter_jsonl(CHUNKS_FILE, Chunk):
+        if chunk.duplicate_of is None and chunk.chunk_id not in index.signatures:
+            index.insert(chunk.chunk_id, signature(_dedupe_body(chunk, prev_end.get(chunk.doc_id))))
+        prev_end[chunk.doc_id] = chunk.char_end
+    return index
+
+
+def mark_near_duplicates(
+    chunks: Iterable[Chunk],
+    index: MinHashLSH,
+    stats: Counter,
+    staged: MinHashLSH,
+) -> Iterator[Chunk]:
+    """
+    Помечает чанки, почти совпадающие с уже известными (Jaccard >= порога).
+    Перекрытие с предыдущим чанком (chunk_overlap_chars) в сравнении не участвует.
+    Новые канонические чанки попадают в staged; в индекс их переносит main
+    после успешной записи документа. Совпадение с собственной подписью
+    (остаток прерванного запуска) дубликатом не считается.
+    """
+    prev_end = None
+    for chunk in chunks:
+        sig = signature(_dedupe_body(chunk, prev_end))
+        prev_end = chunk.char_end
+        matches = sorted(
+            (m for m in index.query(sig) + staged.query(sig) if m[0] != chunk.chunk_id),
+            key=lambda m: (-m[1], m[0]),
+        )
+        if matches:
+            chunk.duplicate_of = matches[0][0]
+            stats["near_duplicate_chunks"] += 1
+        else:
+            staged.insert(chunk.chunk_id, sig)
+        yield chunk
+
+
+def main(workers: int | None = None):
     console.print("[bold blue]Step 01: Ingest Transcripts[/bold blue]")
     
     processed_files = load_processed_ids(EPISODES_FILE, "filename")
+    processed_files |= load_processed_ids(DUPLICATE_EPISODES_FILE, "filename")
     transcript_files = get_transcript_files()
     
     if not transcript_files:
@@ -54,25 +164,54 @@ def main():
     
     total_episodes = 0
     total_chunks = 0
+    stats = Counter()
+    known_doc_ids = load_processed_ids(EPISODES_FILE, "doc_id")
+    index = load_chunk_index()
     
-    for filepath in tqdm(new_files, desc="Processing transcripts"):
+    results = iter_processed_files(new_files, workers)
+    for filepath, episode, chunks, error in tqdm(results, total=len(new_files), desc="Processing transcripts"):
+        if error:
+            console.print(f"[red]Error processing {filepath.name}: {error}[/red]")
+            continue
+        
+        if episode.doc_id in known_doc_ids:
+            console.print(f"[yellow]Skipping {filepath.name}: same content as {episode.doc_id}[/yellow]")
+            stats["duplicate_files"] += 1
+            stats["duplicate_file_chunks"] += sum(1 for _ in chunks)
+            # Запоминаем имя файла, чтобы не читать и не хешировать его при каждом запуске
+            append_jsonl(DUPLICATE_EPISODES_FILE, episode)
+            continue
+        
+        staged = MinHashLSH(index.threshold)
+        chunks = mark_near_duplicates(chunks, index, stats, staged)
         try:
-            episode, chunks = process_transcript_file(filepath)
-            
-            append_jsonl(EPISODES_FILE, episode)
-            for chunk in chunks:
-                append_jsonl(CHUNKS_FILE, chunk)
-            
-            total_episodes += 1
-            total_chunks += len(chunks)
-            
+            if settings.partitioned_storage:
+                n_chunks = write_shard(CHUNKS_FILE, episode.doc_id, chunks)
+            else:
+                # Чанки попадают в chunks.jsonl, только если поток дочитан до конца
+                n_chunks = append_jsonl_batch(CHUNKS_FILE, chunks)
         except Exception as e:
             console.print(f"[red]Error processing {filepath.name}: {e}[/red]")
             continue
+        
+        for chunk_id, sig in staged.signatures.items():
+            index.insert(chunk_id, sig)
+        append_jsonl(EPISODES_FILE, episode)
+        known_doc_ids.add(episode.doc_id)
+        total_episodes += 1
+        total_chunks += n_chunks
+    
+    index.save(MINHASH_FILE)
+    if settings.partitioned_storage:
+        update_manifest(CHUNKS_FILE)
     
     console.print(f"[green]Done![/green]")
     console.print(f"  New episodes: {total_episodes}")
     console.print(f"  New chunks: {total_chunks}")
+    console.print(f"  Duplicate transcripts skipped: {stats['duplicate_files']}")
+    console.print(f"  Near-duplicate chunks: {stats['near_duplicate_chunks']}")
+    avoided = stats["duplicate_file_chunks"] + stats["near_duplicate_chunks"]
+    console.print(f"  s03 LLM calls avoided: {avoided}")
     
     all_episodes = read_jsonl(EPISODES_FILE, Episode)
     all_chunks = read_jsonl(CHUNKS_FILE, Chunk)
@@ -3,20 +3,37 @@ Step 03: Extract nuggets from chunks.
 
 Для каждого чанка извлекает 0-3 "зерна" (pain/trend/opportunity/constraint/buyer_signal)
 с обязательными цитатами. Валидирует, что цитаты есть в исходном тексте.
+
+Почти-дубликаты чанков (Chunk.duplicate_of, см. s01) в LLM не отправляются —
+им копируются nuggets канонического чанка.
+
+Итог по каждому чанку (ok/empty/failed) пишется в extraction_ledger.jsonl:
+завершённые чанки не отправляются повторно, упавшие повторяются не более
+settings.extract_max_attempts раз. При settings.prefilter_threshold > 0 чанки
+с низким скором пре-фильтра (prefilter.py) в LLM не отправляются ("skipped"),
+остальные обрабатываются в порядке убывания скора.
 """
+import hashlib
 import uuid
+from collections import defaultdict
 from tqdm import tqdm
 from rich.console import Console
 
 from ..config import PROCESSED_DIR, settings
-from ..models import Chunk, Nugget, NuggetList, Evidence
-from ..storage import read_jsonl, append_jsonl, load_processed_ids
+from ..models import Chunk, Nugget, NuggetList, Evidence, ExtractionStatus
+from ..storage import (
+    read_jsonl, iter_jsonl, iter_partitions, append_jsonl, append_shard,
+    write_jsonl, write_shard, update_manifest, drop_flat, drop_shards,
+)
 from ..llm import parse_structured
+from ..prefilter import score_chunks
+from ..quotes import MIN_QUOTE_WORDS, NormalizedText, align_quotes, quote_words
 
 console = Console()
 
 CHUNKS_FILE = PROCESSED_DIR / "chunks.jsonl"
 NUGGETS_FILE = PROCESSED_DIR / "nuggets.jsonl"
+LEDGER_FILE = PROCESSED_DIR / "extraction_ledger.jsonl"
 
 SYSTEM_PROMPT = """Ты аналитик венчурных возможностей в biotech.
 Задача: извлечь из текста только то, что реально сказано, без добавления фактов.
@@ -35,38 +52,43 @@ SYSTEM_PROMPT = """Ты аналитик венчурных возможност
 4. Максимум 3 nuggets на чанк. Лучше меньше, но точнее.
 5. chunk_id в evidence должен совпадать с ID анализируемого чанка."""
 
+PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:8]
+
 
 def validate_quotes(chunk_text: str, nuggets: NuggetList) -> list[str]:
-    """Проверяет, что цитаты действительно есть в тексте."""
+    """
+    Проверяет, что цитаты действительно есть в тексте, и записывает
+    их позиции в Evidence (char_start/char_end/match_score).
+    """
+    return attach_quote_spans(chunk_text, nuggets.nuggets)
+
+
+def attach_quote_spans(chunk_text: str, nuggets: list[Nugget]) -> list[str]:
+    """Выравнивает все цитаты nuggets на текст одного чанка; возвращает ошибки."""
     errors = []
-    lowered = chunk_text.lower()
-    
-    for n in nuggets.nuggets:
+    evidence = []
+    for n in nuggets:
         if not n.evidence:
             errors.append(f"{n.nugget_id}: no evidence provided")
+        evidence.extend((n, ev) for ev in n.evidence)
+    
+    matches = align_quotes(chunk_text, [ev.quote for _, ev in evidence])
+    for (n, ev), match in zip(evidence, matches):
+        if match is not None:
+            ev.char_start, ev.char_end, ev.match_score = match.char_start, match.char_end, match.score
             continue
-        
-        for ev in n.evidence:
-            quote = ev.quote.strip().lower()
-            if not quote:
-                errors.append(f"{n.nugget_id}: empty quote")
-                continue
-            
-            words = quote.split()
-            if len(words) < 3:
-                continue
-            
-            key_phrase = " ".join(words[:5])
-            if key_phrase not in lowered:
-                alt_phrase = " ".join(words[-5:])
-                if alt_phrase not in lowered:
-                    errors.append(f"{n.nugget_id}: quote not found in chunk")
+        ev.char_start = ev.char_end = ev.match_score = None
+        words = quote_words(ev.quote)
+        if not words:
+            errors.append(f"{n.nugget_id}: empty quote")
+        elif len(words) >= MIN_QUOTE_WORDS:
+            errors.append(f"{n.nugget_id}: quote not found in chunk")
     
     return errors
 
 
 def extract_nuggets_from_chunk(chunk: Chunk) -> list[Nugget]:
-    """Извлекает nuggets из одного чанка."""
+    """Извлекает nuggets из одного чанка. Ошибки LLM пробрасываются вызывающему."""
     user_prompt = f"""CHUNK_ID: {chunk.chunk_id}
 DOC_ID: {chunk.doc_id}
 
@@ -77,31 +99,172 @@ TEXT:
 
 Извлеки 0-3 nuggets. Для каждого укажи chunk_id="{chunk.chunk_id}" в evidence."""
 
-    try:
-        result: NuggetList = parse_structured(
-            system=SYSTEM_PROMPT,
-            user=user_prompt,
-            schema=NuggetList,
-            max_output_tokens=settings.max_output_tokens_extract,
-        )
+    result: NuggetList = parse_structured(
+        system=SYSTEM_PROMPT,
+        user=user_prompt,
+        schema=NuggetList,
+        max_output_tokens=settings.max_output_tokens_extract,
+    )
+    
+    for n in result.nuggets:
+        if not n.nugget_id:
+            n.nugget_id = f"n_{uuid.uuid4().hex[:10]}"
+        n.doc_id = chunk.doc_id
         
-        for n in result.nuggets:
-            if not n.nugget_id:
-                n.nugget_id = f"n_{uuid.uuid4().hex[:10]}"
-            n.doc_id = chunk.doc_id
-            
+        for ev in n.evidence:
+            ev.chunk_id = chunk.chunk_id
+    
+    errors = validate_quotes(chunk.text, result)
+    if errors:
+        console.print(f"[yellow]Validation warnings for {chunk.chunk_id}: {errors}[/yellow]")
+    
+    return result.nuggets
+
+
+def save_nugget(nugget: Nugget) -> None:
+    """Сохраняет nugget в общий файл или в шард эпизода."""
+    if settings.partitioned_storage:
+        append_shard(NUGGETS_FILE, nugget.doc_id, nugget)
+    else:
+        append_jsonl(NUGGETS_FILE, nugget)
+
+
+def revalidate_quotes() -> dict[str, int]:
+    """
+    Заново выравнивает цитаты всех nuggets на тексты чанков и перезаписывает
+    nuggets.jsonl (или его шарды) с актуальными позициями. Без вызовов LLM.
+    Если часть nuggets лежит в общем файле, а часть в шардах, всё пишется в
+    раскладку settings.partitioned_storage, а другая удаляется.
+    """
+    chunk_texts = {c.chunk_id: c.text for c in iter_jsonl(CHUNKS_FILE, Chunk)}
+    stats = {"quotes": 0, "exact": 0, "fuzzy": 0, "not_found": 0, "no_chunk": 0}
+    flat = []
+    
+    for doc_id, nuggets in tqdm(iter_partitions(NUGGETS_FILE, Nugget), desc="Validating quotes"):
+        by_chunk = defaultdict(list)
+        for n in nuggets:
             for ev in n.evidence:
-                ev.chunk_id = chunk.chunk_id
-        
-        errors = validate_quotes(chunk.text, result)
-        if errors:
-            console.print(f"[yellow]Validation warnings for {chunk.chunk_id}: {errors}[/yellow]")
+                by_chunk[ev.chunk_id].append(ev)
         
-        return result.nuggets
+        for chunk_id, evidence in by_chunk.items():
+            stats["quotes"] += len(evidence)
+            if chunk_id not in chunk_texts:
+                stats["no_chunk"] += len(evidence)
+                continue
+            matches = align_quotes(NormalizedText(chunk_texts[chunk_id]), [ev.quote for ev in evidence])
+            for ev, match in zip(evidence, matches):
+                if match is None:
+                    ev.char_start = ev.char_end = ev.match_score = None
+                    stats["not_found"] += 1
+                else:
+                    ev.char_start, ev.char_end, ev.match_score = match.char_start, match.char_end, match.score
+                    stats["exact" if match.exact else "fuzzy"] += 1
         
-    except Exception as e:
-        console.print(f"[red]Error extracting from {chunk.chunk_id}: {e}[/red]")
-        return []
+        if settings.partitioned_storage:
+            write_shard(NUGGETS_FILE, doc_id, nuggets)
+        else:
+            flat.extend(nuggets)
+    
+    if settings.partitioned_storage:
+        drop_flat(NUGGETS_FILE)
+        update_manifest(NUGGETS_FILE)
+    else:
+        write_jsonl(NUGGETS_FILE, flat)
+        drop_shards(NUGGETS_FILE)
+    return stats
+
+
+def load_ledger() -> dict[str, ExtractionStatus]:
+    """Последняя запись журнала по каждому чанку."""
+    return {entry.chunk_id: entry for entry in read_jsonl(LEDGER_FILE, ExtractionStatus)}
+
+
+def record_status(
+    ledger: dict[str, ExtractionStatus],
+    chunk_id: str,
+    n_nuggets: int,
+    error: str | None = None,
+    prefilter_score: float | None = None,
+) -> ExtractionStatus:
+    """
+    Добавляет запись в журнал и обновляет его копию в памяти.
+    С prefilter_score ниже порога чанк помечается "skipped" (не попытка извлечения).
+    """
+    previous = ledger.get(chunk_id)
+    attempts = previous.attempts if previous else 0
+    if prefilter_score is not None and prefilter_score < settings.prefilter_threshold:
+        status = "skipped"
+    else:
+        status = "failed" if error else ("ok" if n_nuggets else "empty")
+        attempts += 1
+    entry = ExtractionStatus(
+        chunk_id=chunk_id,
+        status=status,
+        attempts=attempts,
+        nuggets=n_nuggets,
+        last_error=error,
+        prefilter_score=prefilter_score,
+        prompt_version=PROMPT_VERSION,
+    )
+    append_jsonl(LEDGER_FILE, entry)
+    ledger[chunk_id] = entry
+    return entry
+
+
+def is_finished(chunk_id: str, ledger: dict[str, ExtractionStatus], legacy_done: set[str]) -> bool:
+    """
+    Чанк завершён (ok/empty) или исчерпал попытки; без записи — если у него уже есть nuggets.
+    Пропущенный пре-фильтром чанк снова в очереди, если порог снизили или выключили.
+    """
+    entry = ledger.get(chunk_id)
+    if entry is None:
+        return chunk_id in legacy_done
+    if entry.status == "skipped":
+        return entry.prefilter_score < settings.prefilter_threshold
+    return entry.status != "failed" or entry.attempts >= settings.extract_max_attempts
+
+
+def reuse_nuggets_for_duplicate(chunk: Chunk, by_chunk: dict[str, list[Nugget]]) -> int:
+    """Копирует nuggets канонического чанка в его почти-дубликат без вызова LLM."""
+    copies = []
+    for k, source in enumerate(by_chunk.get(chunk.duplicate_of, []), 1):
+        nugget = source.model_copy(deep=True)
+        nugget.nugget_id = f"{chunk.chunk_id}_r{k}"
+        nugget.doc_id = chunk.doc_id
+        for ev in nugget.evidence:
+            if ev.chunk_id == chunk.duplicate_of:
+                ev.chunk_id = chunk.chunk_id
+        copies.append(nugget)
+    # Позиции цитат в дубликате отличаются от канонического чанка
+    attach_quote_spans(chunk.text, copies)
+    for nugget in copies:
+        save_nugget(nugget)
+    return len(copies)
+
+
+def apply_prefilter(chunks: list[Chunk], ledger: dict[str, ExtractionStatus]) -> list[Chunk]:
+    """
+    Помечает чанки ниже порога пре-фильтра как "skipped", остальные
+    сортирует по убыванию скора. Чанки без скора (нет модели или вектора) идут последними.
+    """
+    scores = score_chunks([c.chunk_id for c in chunks])
+    if not scores:
+        console.print("[yellow]Prefilter enabled but no model/vectors found, processing all chunks.[/yellow]")
+        return chunks
+    
+    kept = []
+    for chunk in chunks:
+        score = scores.get(chunk.chunk_id)
+        if score is not None and score < settings.prefilter_threshold:
+            record_status(ledger, chunk.chunk_id, 0, prefilter_score=score)
+        else:
+            kept.append(chunk)
+    kept.sort(key=lambda c: scores.get(c.chunk_id, -1.0), reverse=True)
+    console.print(
+        f"  Prefilter (threshold {settings.prefilter_threshold}): "
+        f"skipped {len(chunks) - len(kept)} of {len(chunks)} chunks"
+    )
+    return kept
 
 
 def main():
@@ -112,30 +275,76 @@ def main():
         console.print("[yellow]No chunks found. Run step 01 first.[/yellow]")
         return
     
-    processed_chunks = load_processed_ids(NUGGETS_FILE, "nugget_id")
     existing_nuggets = read_jsonl(NUGGETS_FILE, Nugget)
     processed_chunk_ids = {n.evidence[0].chunk_id for n in existing_nuggets if n.evidence}
+    ledger = load_ledger()
     
-    new_chunks = [c for c in chunks if c.chunk_id not in processed_chunk_ids]
+    pending = [c for c in chunks if not is_finished(c.chunk_id, ledger, processed_chunk_ids)]
+    new_chunks = [c for c in pending if not c.duplicate_of]
+    duplicate_chunks = [c for c in pending if c.duplicate_of]
     
-    if not new_chunks:
+    exhausted = sum(
+        1 for e in ledger.values()
+        if e.status == "failed" and e.attempts >= settings.extract_max_attempts
+    )
+    if exhausted:
+        console.print(f"[yellow]Chunks failed {settings.extract_max_attempts} times, skipped: {exhausted}[/yellow]")
+    
+    if not new_chunks and not duplicate_chunks:
         console.print(f"[green]All chunks processed. Total nuggets: {len(existing_nuggets)}[/green]")
         return
     
-    console.print(f"Processing {len(new_chunks)} new chunks...")
+    if settings.prefilter_threshold > 0 and new_chunks:
+        new_chunks = apply_prefilter(new_chunks, ledger)
+    
+    retries = sum(1 for c in new_chunks if c.chunk_id in ledger and ledger[c.chunk_id].status == "failed")
+    console.print(f"Processing {len(new_chunks)} new chunks ({retries} retries of failed)...")
+    chunk_tokens = [c.token_count for c in new_chunks if c.token_count is not None]
+    if chunk_tokens:
+        console.print(f"  Chunk tokens: {sum(chunk_tokens)} total, max {max(chunk_tokens)} per call")
     
     total_nuggets = 0
+    failed = 0
     
     for chunk in tqdm(new_chunks, desc="Extracting nuggets"):
-        nuggets = extract_nuggets_from_chunk(chunk)
+        try:
+            nuggets = extract_nuggets_from_chunk(chunk)
+        except Exception as e:
+            console.print(f"[red]Error extracting from {chunk.chunk_id}: {e}[/red]")
+            record_status(ledger, chunk.chunk_id, 0, error=str(e))
+            failed += 1
+            continue
         
         for nugget in nuggets:
-            append_jsonl(NUGGETS_FILE, nugget)
+            save_nugget(nugget)
             total_nuggets += 1
+        record_status(ledger, chunk.chunk_id, len(nuggets))
+    
+    reused = 0
+    if duplicate_chunks:
+        by_chunk = defaultdict(list)
+        for n in read_jsonl(NUGGETS_FILE, Nugget):
+            if n.evidence:
+                by_chunk[n.evidence[0].chunk_id].append(n)
+        for chunk in duplicate_chunks:
+            # Канонический чанк должен быть завершён, иначе ждём следующего запуска
+            source = ledger.get(chunk.duplicate_of)
+            if source is None and chunk.duplicate_of not in by_chunk:
+                continue
+            if source is not None and source.status in ("failed", "skipped"):
+                continue
+            n_reused = reuse_nuggets_for_duplicate(chunk, by_chunk)
+            record_status(ledger, chunk.chunk_id, n_reused)
+            reused += n_reused
+    
+    if settings.partitioned_storage:
+        update_manifest(NUGGETS_FILE)
     
     all_nuggets = read_jsonl(NUGGETS_FILE, Nugget)
     console.print(f"[green]Done![/green]")
     console.print(f"  New nuggets: {total_nuggets}")
+    console.print(f"  Reused nuggets: {reused}")
+    console.print(f"  Failed chunks: {failed}")
     console.print(f"  Total nuggets: {len(all_nuggets)}")
     
     by_kind = {}
@@ -0,0 +1,104 @@
+"""
+Step 03b: Deduplicate nuggets before idea synthesis.
+
+Перекрытие чанков (chunk_overlap_chars) и повторяющиеся темы разных эпизодов
+дают почти одинаковые nuggets. Шаг эмбеддит text_en (с кешем), схлопывает
+nuggets одного kind с косинусной близостью ≥ settings.nugget_dedupe_threshold
+в канонический — первый по порядку в nuggets.jsonl — и переносит в него
+evidence дубликатов. ID дубликатов сохраняются в merged_nugget_ids.
+
+Результат — nuggets_deduped.jsonl; s04 читает его вместо nuggets.jsonl.
+"""
+from collections import defaultdict
+from rich.console import Console
+
+from ..config import PROCESSED_DIR, settings
+from ..models import Nugget
+from ..storage import read_jsonl, write_jsonl, write_shard, update_manifest
+from ..embeddings import embed_texts_cached
+from ..similarity import greedy_duplicates
+
+console = Console()
+
+NUGGETS_FILE = PROCESSED_DIR / "nuggets.jsonl"
+NUGGETS_DEDUPED_FILE = PROCESSED_DIR / "nuggets_deduped.jsonl"
+EMBEDDING_CACHE_FILE = PROCESSED_DIR / "nugget_embeddings.npz"
+
+CONFIDENCE_ORDER = {"low": 0, "medium": 1, "high": 2}
+
+
+def merge_nuggets(canonical: Nugget, duplicates: list[Nugget]) -> Nugget:
+    """
+    Канонический nugget с evidence всех дубликатов (без повторов цитат)
+    и максимальной confidence.
+    """
+    merged = canonical.model_copy(deep=True)
+    seen_quotes = {(ev.chunk_id, ev.quote) for ev in merged.evidence}
+    for dup in duplicates:
+        merged.merged_nugget_ids.append(dup.nugget_id)
+        merged.merged_nugget_ids.extend(dup.merged_nugget_ids)
+        for ev in dup.evidence:
+            if (ev.chunk_id, ev.quote) not in seen_quotes:
+                seen_quotes.add((ev.chunk_id, ev.quote))
+                merged.evidence.append(ev.model_copy())
+        if CONFIDENCE_ORDER[dup.confidence] > CONFIDENCE_ORDER[merged.confidence]:
+            merged.confidence = dup.confidence
+    return merged
+
+
+def dedupe_nuggets(nuggets: list[Nugget], embeddings) -> list[Nugget]:
+    """Схлопывает дубликаты; порядок канонических nuggets сохраняется."""
+    duplicates = greedy_duplicates(
+        embeddings,
+        settings.nugget_dedupe_threshold,
+        groups=[n.kind for n in nuggets],
+    )
+    by_canonical: dict[int, list[Nugget]] = defaultdict(list)
+    for dup_idx, canonical_idx in duplicates.items():
+        by_canonical[canonical_idx].append(nuggets[dup_idx])
+    
+    return [
+        merge_nuggets(n, by_canonical[i]) if i in by_canonical else n
+        for i, n in enumerate(nuggets)
+        if i not in duplicates
+    ]
+
+
+def main():
+    console.print("[bold blue]Step 03b: Dedupe Nuggets[/bold blue]")
+    
+    nuggets = read_jsonl(NUGGETS_FILE, Nugget)
+    if not nuggets:
+        console.print("[yellow]No nuggets found. Run step 03 first.[/yellow]")
+        return
+    
+    console.print(f"Found {len(nuggets)} nuggets")
+    console.print("Creating embeddings (cached)...")
+    embeddings = embed_texts_cached([n.text_en for n in nuggets], EMBEDDING_CACHE_FILE)
+    
+    deduped = dedupe_nuggets(nuggets, embeddings)
+    
+    if settings.partitioned_storage:
+        by_doc = defaultdict(list)
+        for n in deduped:
+            by_doc[n.doc_id].append(n)
+        for doc_id, doc_nuggets in by_doc.items():
+            write_shard(NUGGETS_DEDUPED_FILE, doc_id, doc_nuggets)
+        update_manifest(NUGGETS_DEDUPED_FILE)
+    else:
+        write_jsonl(NUGGETS_DEDUPED_FILE, deduped)
+    
+    merged = [n for n in deduped if n.merged_nugget_ids]
+    console.print("[green]Done![/green]")
+    console.print(f"  Original nuggets: {len(nuggets)}")
+    console.print(f"  Canonical nuggets: {len(deduped)}")
+    console.print(f"  Merged groups: {len(merged)}")
+    
+    docs_before = {n.doc_id for n in nuggets}
+    docs_after = {n.doc_id for n in deduped}
+    if docs_before - docs_after:
+        console.print(f"  Episodes fully merged into others: {len(docs_before - docs_after)}")
+
+
+if __name__ == "__main__":
+    main()
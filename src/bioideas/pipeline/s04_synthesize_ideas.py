@@ -3,21 +3,57 @@ Step 04: Synthesize Idea Cards from nuggets.
 
 Группирует nuggets по doc_id (эпизодам) и синтезирует Idea Cards.
 Каждая идея ссылается на source_nugget_ids — без выдумывания новых фактов.
+Если есть nuggets_deduped.jsonl (step 03b), используются канонические nuggets.
+
+Режим settings.synthesis_mode = "cluster": вместо батчей по эпизодам nuggets
+всех эпизодов кластеризуются по эмбеддингам (MiniBatchKMeans) в темы, к теме
+подтягиваются ближайшие nuggets других тем/эпизодов, и идеи синтезируются
+один раз на тему.
+
+Режим "mapreduce": окна по BATCH_SIZE nuggets эпизода дают дешёвые черновики
+идей (map, idea_candidates.jsonl), затем один reduce-вызов на эпизод
+объединяет их в Idea Cards так, чтобы у эпизода всего было не более
+settings.max_ideas_per_episode идей (с учётом уже записанных).
+
+Батчи синтезируются параллельно (settings.llm_concurrency запросов).
+Каждый завершённый батч пишется в synthesis_ledger.jsonl вместе с покрытыми
+nugget_id. В режиме по эпизодам окна строятся только из ещё не покрытых nuggets,
+поэтому после сбоя, дозаписи nuggets или перехода на nuggets_deduped.jsonl
+догоняются ровно недостающие nuggets, а не сдвинувшиеся окна.
 """
+import hashlib
 import uuid
-from collections import defaultdict
+from collections import Counter
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
 from tqdm import tqdm
 from rich.console import Console
 
 from ..config import PROCESSED_DIR, settings
-from ..models import Nugget, IdeaCard, IdeaCardList
-from ..storage import read_jsonl, append_jsonl, load_processed_ids
+from ..models import (
+    Nugget, IdeaCard, IdeaCardList, IdeaCandidate, IdeaCandidateList, SynthesisBatch
+)
+from ..storage import (
+    read_jsonl, append_jsonl, append_shard, iter_partitions, list_shards, update_manifest, jsonl_exists
+)
 from ..llm import parse_structured
+from ..embeddings import embed_texts_cached
+from ..similarity import normalize_rows
+from .s03b_dedupe_nuggets import EMBEDDING_CACHE_FILE
 
 console = Console()
 
 NUGGETS_FILE = PROCESSED_DIR / "nuggets.jsonl"
+NUGGETS_DEDUPED_FILE = PROCESSED_DIR / "nuggets_deduped.jsonl"
 IDEAS_FILE = PROCESSED_DIR / "ideas.jsonl"
+LEDGER_FILE = PROCESSED_DIR / "synthesis_ledger.jsonl"
+CANDIDATES_FILE = PROCESSED_DIR / "idea_candidates.jsonl"
+
+BATCH_SIZE = 15  # nuggets на батч — достаточно для контекста, но не переполняет токены
+MIN_BATCH_NUGGETS = 3  # меньше — промпт (2-6 source_nugget_ids на идею) невыполним
+THEME_DOC_ID = "cluster"  # doc_id записей журнала для батчей-тем
+MAP_PREFIX, REDUCE_PREFIX = "map_", "reduce_"  # префиксы ключей журнала режима mapreduce
 
 SYSTEM_PROMPT = """Ты продукт-аналитик и основатель стартапов в biotech.
 Твоя задача — создать проектные идеи (Idea Cards) из списка nuggets.
@@ -46,15 +82,38 @@ SYSTEM_PROMPT = """Ты продукт-аналитик и основатель
 Пиши на русском, термины можно оставлять на английском."""
 
 
+def format_nugget(n: Nugget) -> str:
+    """Строка nugget для промпта; у канонических nuggets (s03b) — число повторов."""
+    repeats = f", повторяется ×{1 + len(n.merged_nugget_ids)}" if n.merged_nugget_ids else ""
+    return f"- [{n.nugget_id}] ({n.kind}, {n.confidence}{repeats}) {n.text_ru}"
+
+
+def dominant_doc_id(idea: IdeaCard, nuggets: list[Nugget]) -> str | None:
+    """Эпизод, из которого больше всего source nuggets идеи."""
+    by_id = {n.nugget_id: n.doc_id for n in nuggets}
+    docs = [by_id[nid] for nid in idea.source_nugget_ids if nid in by_id] or list(by_id.values())
+    return Counter(docs).most_common(1)[0][0] if docs else None
+
+
 def synthesize_ideas_for_batch(doc_id: str, nuggets: list[Nugget], batch_num: int) -> list[IdeaCard]:
-    """Синтезирует идеи из одного батча nuggets."""
+    """
+    Синтезирует идеи из одного батча nuggets. Ошибки LLM пробрасываются вызывающему.
+    Для темы (doc_id == THEME_DOC_ID) идеи привязываются к эпизоду своих source nuggets.
+    """
     
-    nuggets_text = "\n".join(
-        f"- [{n.nugget_id}] ({n.kind}, {n.confidence}) {n.text_ru}"
-        for n in nuggets
-    )
+    nuggets_text = "\n".join(format_nugget(n) for n in nuggets)
     
-    user_prompt = f"""DOC_ID: {doc_id}
+    if doc_id == THEME_DOC_ID:
+        n_docs = len({n.doc_id for n in nuggets})
+        user_prompt = f"""THEME: {batch_num}
+
+NUGGETS ({len(nuggets)} штук из {n_docs} эпизодов, одна тема):
+{nuggets_text}
+
+Сгенерируй 1-3 Idea Cards, опирающиеся на свидетельства из разных эпизодов.
+Для каждой идеи укажи source_nugget_ids — ID nuggets, на которых она основана."""
+    else:
+        user_prompt = f"""DOC_ID: {doc_id}
 BATCH: {batch_num}
 
 NUGGETS ({len(nuggets)} штук):
@@ -63,85 +122,482 @@ NUGGETS ({len(nuggets)} штук):
 Сгенерируй 3-5 Idea Cards на основе этих nuggets.
 Для каждой идеи укажи source_nugget_ids — ID nuggets, на которых она основана."""
 
-    try:
-        result: IdeaCardList = parse_structured(
-            system=SYSTEM_PROMPT,
-            user=user_prompt,
-            schema=IdeaCardList,
-            max_output_tokens=settings.max_output_tokens_idea,
-        )
-        
-        for idea in result.ideas:
-            if not idea.idea_id:
-                idea.idea_id = f"idea_{uuid.uuid4().hex[:10]}"
-            idea.doc_id = doc_id
-        
-        return result.ideas
-        
-    except Exception as e:
-        console.print(f"[red]Error synthesizing batch {batch_num} for {doc_id}: {e}[/red]")
+    result: IdeaCardList = parse_structured(
+        system=SYSTEM_PROMPT,
+        user=user_prompt,
+        schema=IdeaCardList,
+        max_output_tokens=settings.max_output_tokens_idea,
+    )
+    
+    for idea in result.ideas:
+        if not idea.idea_id:
+            idea.idea_id = f"idea_{uuid.uuid4().hex[:10]}"
+        idea.doc_id = dominant_doc_id(idea, nuggets) if doc_id == THEME_DOC_ID else doc_id
+    
+    return result.ideas
+
+
+def batch_hash(nuggets: list[Nugget]) -> str:
+    """Хеш состава батча: тот же набор nuggets — тот же батч."""
+    ids = "\n".join(sorted(n.nugget_id for n in nuggets))
+    return hashlib.sha256(ids.encode("utf-8")).hexdigest()[:12]
+
+
+def split_batches(nuggets: list[Nugget]) -> list[tuple[int, list[Nugget]]]:
+    """
+    Разбивает nuggets документа на батчи: [(batch_num, nuggets), ...].
+    Хвост короче MIN_BATCH_NUGGETS вливается в предыдущий батч.
+    """
+    batches = [nuggets[i:i + BATCH_SIZE] for i in range(0, len(nuggets), BATCH_SIZE)]
+    if len(batches) > 1 and len(batches[-1]) < MIN_BATCH_NUGGETS:
+        tail = batches.pop()
+        batches[-1] = batches[-1] + tail
+    return [(num, batch) for num, batch in enumerate(batches, 1)]
+
+
+def load_done_batches() -> set[tuple[str, str]]:
+    """(doc_id, batch_hash) батчей, успешно синтезированных ранее."""
+    done = set()
+    for entry in read_jsonl(LEDGER_FILE, SynthesisBatch):
+        key = (entry.doc_id, entry.batch_hash)
+        if entry.status == "ok":
+            done.add(key)
+        else:
+            done.discard(key)
+    return done
+
+
+def save_ideas(ideas: list[IdeaCard]) -> None:
+    """Дописывает идеи батча в общий файл или в шард эпизода."""
+    for idea in ideas:
+        if settings.partitioned_storage:
+            append_shard(IDEAS_FILE, idea.doc_id, idea)
+        else:
+            append_jsonl(IDEAS_FILE, idea)
+
+
+def nuggets_source():
+    """nuggets_deduped.jsonl после step 03b, иначе исходный nuggets.jsonl."""
+    for filepath in (NUGGETS_DEDUPED_FILE, NUGGETS_FILE):
+        if jsonl_exists(filepath) or list_shards(filepath):
+            return filepath
+    return None
+
+
+@dataclass
+class PendingBatch:
+    """Батч, который ещё нужно синтезировать."""
+    doc_id: str
+    batch_num: int
+    key: str
+    nuggets: list[Nugget]
+    # Nuggets, которые батч покрывает (для темы — все её члены, не только показанные LLM)
+    covered_ids: list[str] = field(default_factory=list)
+    # ideas — обычный синтез, map/reduce — шаги режима mapreduce
+    kind: str = "ideas"
+    candidates: list[IdeaCandidate] = field(default_factory=list)
+    # Для map: ключи всех окон эпизода и все его nuggets (для reduce)
+    window_keys: list[str] = field(default_factory=list)
+    episode: list[Nugget] = field(default_factory=list)
+    # Сколько идей эпизод ещё может получить (режим mapreduce)
+    cap: int = 0
+
+
+def is_episode_entry(entry: SynthesisBatch) -> bool:
+    """Запись журнала обычного режима по эпизодам (не тема и не шаг mapreduce)."""
+    return entry.doc_id != THEME_DOC_ID and not entry.batch_hash.startswith((MAP_PREFIX, REDUCE_PREFIX))
+
+
+def load_episode_nuggets() -> set[str]:
+    """Nuggets, уже покрытые успешно синтезированными батчами эпизодов."""
+    used = set()
+    for entry in read_jsonl(LEDGER_FILE, SynthesisBatch):
+        if entry.status == "ok" and is_episode_entry(entry):
+            used.update(entry.nugget_ids)
+    return used
+
+
+def is_covered(nugget: Nugget, used: set[str]) -> bool:
+    """Nugget покрыт сам или через один из слитых в него (s03b) nuggets."""
+    return nugget.nugget_id in used or any(nid in used for nid in nugget.merged_nugget_ids)
+
+
+def iter_pending_batches(source, done: set[tuple[str, str]], legacy_docs: set[str], stats: dict):
+    """
+    Батчи эпизодов из nuggets, ещё не покрытых журналом.
+    Эпизоды с идеями, но без записей в журнале (запуски до журнала), считаются готовыми.
+    """
+    done_docs = {doc_id for doc_id, key in done if not key.startswith((MAP_PREFIX, REDUCE_PREFIX))}
+    used = load_episode_nuggets()
+    for doc_id, doc_nuggets in iter_partitions(source, Nugget):
+        stats["nuggets"] += len(doc_nuggets)
+        if doc_id in legacy_docs and doc_id not in done_docs:
+            continue
+        if len(doc_nuggets) < MIN_BATCH_NUGGETS:
+            console.print(f"[yellow]Skipping {doc_id}: only {len(doc_nuggets)} nuggets[/yellow]")
+            continue
+        # Меньше MIN_BATCH_NUGGETS непокрытых nuggets ждут, пока эпизод не пополнится
+        remaining = [n for n in doc_nuggets if not is_covered(n, used)]
+        if len(remaining) < MIN_BATCH_NUGGETS:
+            continue
+        for batch_num, batch in split_batches(remaining):
+            yield PendingBatch(doc_id, batch_num, batch_hash(batch), batch)
+
+
+def load_theme_nuggets() -> set[str]:
+    """Nuggets, уже покрытые успешно синтезированными темами (режим cluster)."""
+    used = set()
+    for entry in read_jsonl(LEDGER_FILE, SynthesisBatch):
+        if entry.doc_id == THEME_DOC_ID and entry.status == "ok":
+            used.update(entry.nugget_ids)
+    return used
+
+
+def build_theme_batches(
+    nuggets: list[Nugget],
+    embeddings,
+    candidates: list[int],
+) -> list[tuple[list[Nugget], list[int]]]:
+    """
+    Кластеризует nuggets candidates в темы (~settings.synthesis_cluster_size штук).
+    Темы меньше 3 nuggets вливаются в ближайшую полноценную тему.
+    Батч темы: до BATCH_SIZE ближайших к центру членов плюс до
+    settings.synthesis_cluster_neighbours ближайших к центру nuggets других
+    эпизодов (среди всех nuggets), не дальше самого далёкого члена батча.
+    Возвращает [(батч, индексы всех членов темы)].
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    
+    if len(candidates) < 3:
         return []
+    X = normalize_rows(embeddings)
+    cand = X[candidates]
+    k = max(1, round(len(candidates) / settings.synthesis_cluster_size))
+    km = MiniBatchKMeans(n_clusters=k, random_state=0, n_init=3, batch_size=1024).fit(cand)
+    centroids = normalize_rows(km.cluster_centers_)
+    
+    labels = km.labels_.copy()
+    sizes = np.bincount(labels, minlength=k)
+    themes = np.flatnonzero(sizes >= 3)
+    if not len(themes):
+        themes = np.array([int(sizes.argmax())])
+        labels[:] = themes[0]
+    small = np.flatnonzero(~np.isin(labels, themes))
+    if len(small):
+        labels[small] = themes[(cand[small] @ centroids[themes].T).argmax(axis=1)]
+    
+    batches = []
+    for c in themes:
+        members = [candidates[i] for i in np.flatnonzero(labels == c)]
+        sims = X @ centroids[c]
+        core = sorted(members, key=lambda i: -sims[i])[:BATCH_SIZE]
+        floor = sims[core[-1]]
+        core_set = set(core)
+        core_docs = {nuggets[i].doc_id for i in core}
+        neighbours = []
+        for i in sims.argsort()[::-1]:
+            if len(neighbours) >= settings.synthesis_cluster_neighbours or sims[i] < floor:
+                break
+            if i not in core_set and nuggets[i].doc_id not in core_docs:
+                neighbours.append(int(i))
+        batches.append(([nuggets[i] for i in core + neighbours], members))
+    return batches
 
 
-def synthesize_ideas_for_doc(doc_id: str, nuggets: list[Nugget]) -> list[IdeaCard]:
-    """Синтезирует идеи из nuggets одного документа, разбивая на батчи."""
+def iter_theme_batches(source, done: set[tuple[str, str]], stats: dict):
+    """
+    Батчи-темы по всем эпизодам (режим cluster) для nuggets, ещё не покрытых
+    ни темами, ни батчами эпизодов (включение режима на готовом корпусе).
+    """
+    nuggets = read_jsonl(source, Nugget)
+    stats["nuggets"] += len(nuggets)
+    used = load_theme_nuggets() | load_episode_nuggets()
+    candidates = [i for i, n in enumerate(nuggets) if not is_covered(n, used)]
+    if len(candidates) < 3:
+        return
+    console.print(f"Clustering {len(candidates)} nuggets into themes...")
+    embeddings = embed_texts_cached([n.text_en for n in nuggets], EMBEDDING_CACHE_FILE)
+    batches = build_theme_batches(nuggets, embeddings, candidates)
     
-    BATCH_SIZE = 15  # nuggets на батч — достаточно для контекста, но не переполняет токены
+    episode_batches = sum(
+        -(-count // BATCH_SIZE)
+        for count in Counter(nuggets[i].doc_id for i in candidates).values()
+    )
+    console.print(f"  {len(batches)} themes (episode mode would need {episode_batches} batches)")
+    for num, (batch, members) in enumerate(batches, 1):
+        key = batch_hash(batch)
+        if (THEME_DOC_ID, key) not in done:
+            covered = [nuggets[i].nugget_id for i in members]
+            yield PendingBatch(THEME_DOC_ID, num, key, batch, covered)
+
+
+def map_candidates_for_batch(doc_id: str, nuggets: list[Nugget], batch_num: int) -> list[IdeaCandidate]:
+    """Map-шаг: 2-4 коротких черновика идей из одного окна nuggets."""
+    nuggets_text = "\n".join(format_nugget(n) for n in nuggets)
+    user_prompt = f"""DOC_ID: {doc_id}
+WINDOW: {batch_num}
+
+NUGGETS ({len(nuggets)} штук):
+{nuggets_text}
+
+Предложи 2-4 черновика идей: название и 2-3 предложения (проблема и что строим).
+Для каждого укажи source_nugget_ids. Полные Idea Cards не нужны."""
+
+    result: IdeaCandidateList = parse_structured(
+        system=SYSTEM_PROMPT,
+        user=user_prompt,
+        schema=IdeaCandidateList,
+        max_output_tokens=settings.max_output_tokens_candidates,
+    )
+    return result.candidates
+
+
+def reduce_candidates(
+    doc_id: str,
+    nuggets: list[Nugget],
+    candidates: list[IdeaCandidate],
+    cap: int,
+) -> list[IdeaCard]:
+    """Reduce-шаг: объединяет черновики эпизода в не более cap Idea Cards."""
+    nuggets_text = "\n".join(format_nugget(n) for n in nuggets)
+    candidates_text = "\n".join(
+        f"- {c.title_ru}: {c.pitch_ru} [{', '.join(c.source_nugget_ids)}]"
+        for c in candidates
+    )
+    user_prompt = f"""DOC_ID: {doc_id}
+
+NUGGETS ({len(nuggets)} штук):
+{nuggets_text}
+
+ЧЕРНОВИКИ ИДЕЙ ({len(candidates)} штук, из разных частей эпизода):
+{candidates_text}
+
+Объедини повторяющиеся черновики и выбери не более {cap} самых сильных идей.
+Оформи их как Idea Cards. source_nugget_ids — только ID из списка NUGGETS."""
+
+    result: IdeaCardList = parse_structured(
+        system=SYSTEM_PROMPT,
+        user=user_prompt,
+        schema=IdeaCardList,
+        max_output_tokens=settings.max_output_tokens_idea,
+    )
     
-    all_ideas = []
+    for idea in result.ideas:
+        if not idea.idea_id:
+            idea.idea_id = f"idea_{uuid.uuid4().hex[:10]}"
+        idea.doc_id = doc_id
     
-    # Разбиваем nuggets на батчи
-    for i in range(0, len(nuggets), BATCH_SIZE):
-        batch = nuggets[i:i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
+    return result.ideas[:cap]
+
+
+def load_candidates() -> dict[str, list[IdeaCandidate]]:
+    """Черновики idea_candidates.jsonl, сгруппированные по doc_id (читаются один раз)."""
+    by_doc: dict[str, list[IdeaCandidate]] = {}
+    for candidate in read_jsonl(CANDIDATES_FILE, IdeaCandidate):
+        by_doc.setdefault(candidate.doc_id, []).append(candidate)
+    return by_doc
+
+
+def reduce_batch(
+    doc_id: str,
+    nuggets: list[Nugget],
+    window_keys: list[str],
+    candidates_by_doc: dict[str, list[IdeaCandidate]],
+    cap: int,
+) -> PendingBatch:
+    """Reduce-батч эпизода по черновикам его окон (load_candidates)."""
+    wanted = set(window_keys)
+    candidates = [c for c in candidates_by_doc.get(doc_id, []) if c.batch_hash in wanted]
+    return PendingBatch(
+        doc_id, 0, REDUCE_PREFIX + batch_hash(nuggets), nuggets,
+        kind="reduce", candidates=candidates, window_keys=window_keys, cap=cap,
+    )
+
+
+def load_mapreduce_coverage() -> tuple[dict[str, set[str]], dict[str, dict[str, list[str]]]]:
+    """
+    По doc_id: nuggets, уже покрытые идеями режима mapreduce (reduce и эпизоды
+    из одного окна), и готовые map-окна {ключ журнала: nugget_ids}.
+    """
+    reduced: dict[str, set[str]] = {}
+    drafted: dict[str, dict[str, list[str]]] = {}
+    for entry in read_jsonl(LEDGER_FILE, SynthesisBatch):
+        if entry.status != "ok":
+            continue
+        # Ранние эпизоды из одного окна писались с map-ключом, но с идеями
+        if entry.batch_hash.startswith(REDUCE_PREFIX) or (entry.batch_hash.startswith(MAP_PREFIX) and entry.idea_ids):
+            reduced.setdefault(entry.doc_id, set()).update(entry.nugget_ids)
+        elif entry.batch_hash.startswith(MAP_PREFIX):
+            drafted.setdefault(entry.doc_id, {})[entry.batch_hash] = entry.nugget_ids
+    return reduced, drafted
+
+
+def iter_mapreduce_batches(
+    source,
+    done: set[tuple[str, str]],
+    legacy_docs: set[str],
+    candidates_by_doc: dict[str, list[IdeaCandidate]],
+    ideas_per_doc: Counter,
+    stats: dict,
+):
+    """
+    Режим mapreduce по nuggets эпизода, ещё не покрытым его идеями. Эпизод, уже
+    набравший max_ideas_per_episode идей, пропускается; остальные получают не
+    больше оставшегося лимита. Из одного окна идеи синтезируются сразу, иначе —
+    map-окна для ещё не покрытых черновиками nuggets, а если таких нет, сразу
+    reduce. Reduce после свежих map-окон запускает main.
+    """
+    done_docs = {doc_id for doc_id, key in done if key.startswith((MAP_PREFIX, REDUCE_PREFIX))}
+    reduced, drafted = load_mapreduce_coverage()
+    for doc_id, doc_nuggets in iter_partitions(source, Nugget):
+        stats["nuggets"] += len(doc_nuggets)
+        if doc_id in legacy_docs and doc_id not in done_docs:
+            continue
+        if len(doc_nuggets) < MIN_BATCH_NUGGETS:
+            console.print(f"[yellow]Skipping {doc_id}: only {len(doc_nuggets)} nuggets[/yellow]")
+            continue
+        cap = settings.max_ideas_per_episode - ideas_per_doc[doc_id]
+        remaining = [n for n in doc_nuggets if not is_covered(n, reduced.get(doc_id, set()))]
+        if cap <= 0 or len(remaining) < MIN_BATCH_NUGGETS:
+            continue
         
-        ideas = synthesize_ideas_for_batch(doc_id, batch, batch_num)
-        all_ideas.extend(ideas)
-    
-    return all_ideas
+        windows = split_batches(remaining)
+        if len(windows) == 1:
+            yield PendingBatch(doc_id, 1, REDUCE_PREFIX + batch_hash(remaining), remaining, cap=cap)
+            continue
+        
+        # Черновики прошлых запусков по непокрытым nuggets идут в reduce как есть
+        remaining_ids = {n.nugget_id for n in remaining}
+        ready = {
+            key: set(ids) for key, ids in drafted.get(doc_id, {}).items()
+            if remaining_ids.intersection(ids)
+        }
+        drafted_ids = set().union(*ready.values())
+        undrafted = [n for n in remaining if not is_covered(n, drafted_ids)]
+        windows = split_batches(undrafted) if len(undrafted) >= MIN_BATCH_NUGGETS else []
+        keys = list(ready) + [MAP_PREFIX + batch_hash(batch) for _, batch in windows]
+        if windows:
+            for (batch_num, batch), key in zip(windows, keys[len(ready):]):
+                yield PendingBatch(
+                    doc_id, batch_num, key, batch,
+                    kind="map", window_keys=keys, episode=remaining, cap=cap,
+                )
+        else:
+            yield reduce_batch(doc_id, remaining, keys, candidates_by_doc, cap)
+
+
+def run_batch(batch: PendingBatch) -> list:
+    if batch.kind == "map":
+        return map_candidates_for_batch(batch.doc_id, batch.nuggets, batch.batch_num)
+    if batch.kind == "reduce":
+        return reduce_candidates(batch.doc_id, batch.nuggets, batch.candidates, batch.cap)
+    ideas = synthesize_ideas_for_batch(batch.doc_id, batch.nuggets, batch.batch_num)
+    if batch.key.startswith(REDUCE_PREFIX):
+        ideas = ideas[:batch.cap]
+    return ideas
+
+
+def run_batches(pending, on_done) -> None:
+    """
+    Синтезирует батчи в пуле потоков (settings.llm_concurrency запросов в полёте).
+    Результаты обрабатываются в основном потоке: on_done(batch, results, error)
+    может вернуть новые батчи (reduce после последнего map-окна эпизода).
+    """
+    workers = max(1, settings.llm_concurrency)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        
+        def drain(return_when):
+            finished, _ = wait(in_flight, return_when=return_when)
+            for future in finished:
+                batch = in_flight.pop(future)
+                error = future.exception()
+                for follow_up in on_done(batch, [] if error else future.result(), error) or []:
+                    in_flight[pool.submit(run_batch, follow_up)] = follow_up
+        
+        for batch in pending:
+            in_flight[pool.submit(run_batch, batch)] = batch
+            if len(in_flight) >= 2 * workers:
+                drain(FIRST_COMPLETED)
+        while in_flight:
+            drain(FIRST_COMPLETED)
 
 
 def main():
     console.print("[bold blue]Step 04: Synthesize Ideas[/bold blue]")
     
-    nuggets = read_jsonl(NUGGETS_FILE, Nugget)
-    if not nuggets:
+    source = nuggets_source()
+    if source is None:
         console.print("[yellow]No nuggets found. Run step 03 first.[/yellow]")
         return
-    
-    by_doc = defaultdict(list)
-    for n in nuggets:
-        by_doc[n.doc_id].append(n)
-    
-    console.print(f"Found {len(nuggets)} nuggets from {len(by_doc)} documents")
+    console.print(f"Reading {source.name}")
     
     existing_ideas = read_jsonl(IDEAS_FILE, IdeaCard)
-    processed_docs = {idea.doc_id for idea in existing_ideas if idea.doc_id}
+    legacy_docs = {idea.doc_id for idea in existing_ideas if idea.doc_id}
+    done = load_done_batches()
+    candidates_by_doc = load_candidates() if settings.synthesis_mode == "mapreduce" else {}
     
-    new_docs = {doc_id: nug for doc_id, nug in by_doc.items() if doc_id not in processed_docs}
+    stats = {"nuggets": 0, "batches": 0, "failed": 0, "ideas": 0, "candidates": 0}
+    progress = tqdm(desc="Synthesizing batches", unit="batch")
     
-    if not new_docs:
-        console.print(f"[green]All documents processed. Total ideas: {len(existing_ideas)}[/green]")
-        return
+    def on_done(batch: PendingBatch, results: list, error: Exception | None) -> list[PendingBatch]:
+        progress.update(1)
+        stats["batches"] += 1
+        follow_ups = []
+        ideas = [] if batch.kind == "map" else results
+        if error is not None:
+            console.print(f"[red]Error synthesizing batch {batch.batch_num} for {batch.doc_id}: {error}[/red]")
+            stats["failed"] += 1
+        elif batch.kind == "map":
+            for candidate in results:
+                candidate.doc_id, candidate.batch_hash = batch.doc_id, batch.key
+                append_jsonl(CANDIDATES_FILE, candidate)
+                candidates_by_doc.setdefault(batch.doc_id, []).append(candidate)
+            stats["candidates"] += len(results)
+            done.add((batch.doc_id, batch.key))
+            if all((batch.doc_id, key) in done for key in batch.window_keys):
+                follow_ups.append(reduce_batch(
+                    batch.doc_id, batch.episode, batch.window_keys, candidates_by_doc, batch.cap
+                ))
+        else:
+            save_ideas(ideas)
+            stats["ideas"] += len(ideas)
+        append_jsonl(LEDGER_FILE, SynthesisBatch(
+            doc_id=batch.doc_id,
+            batch_num=batch.batch_num,
+            batch_hash=batch.key,
+            status="failed" if error is not None else "ok",
+            nugget_ids=batch.covered_ids or [n.nugget_id for n in batch.nuggets],
+            idea_ids=[idea.idea_id for idea in ideas],
+            last_error=str(error) if error is not None else None,
+        ))
+        return follow_ups
     
-    console.print(f"Processing {len(new_docs)} new documents...")
+    if settings.synthesis_mode == "cluster":
+        pending = iter_theme_batches(source, done, stats)
+    elif settings.synthesis_mode == "mapreduce":
+        ideas_per_doc = Counter(idea.doc_id for idea in existing_ideas)
+        pending = iter_mapreduce_batches(source, done, legacy_docs, candidates_by_doc, ideas_per_doc, stats)
+    else:
+        # Эпизоды читаются по одному (при шардированной раскладке — шард за шардом)
+        pending = iter_pending_batches(source, done, legacy_docs, stats)
+    run_batches(pending, on_done)
+    progress.close()
     
-    total_ideas = 0
+    if settings.partitioned_storage and stats["batches"]:
+        update_manifest(IDEAS_FILE)
     
-    for doc_id, doc_nuggets in tqdm(new_docs.items(), desc="Synthesizing ideas"):
-        if len(doc_nuggets) < 3:
-            console.print(f"[yellow]Skipping {doc_id}: only {len(doc_nuggets)} nuggets[/yellow]")
-            continue
-        
-        ideas = synthesize_ideas_for_doc(doc_id, doc_nuggets)
-        
-        for idea in ideas:
-            append_jsonl(IDEAS_FILE, idea)
-            total_ideas += 1
+    console.print(f"Read {stats['nuggets']} nuggets, {stats['batches']} new batches")
+    if not stats["batches"]:
+        console.print(f"[green]All batches processed. Total ideas: {len(existing_ideas)}[/green]")
+        return
     
     all_ideas = read_jsonl(IDEAS_FILE, IdeaCard)
     console.print(f"[green]Done![/green]")
-    console.print(f"  New ideas: {total_ideas}")
+    console.print(f"  New ideas: {stats['ideas']}")
+    if stats["candidates"]:
+        console.print(f"  Draft candidates (map): {stats['candidates']}")
+    console.print(f"  Failed batches: {stats['failed']} (retried on next run)")
     console.print(f"  Total ideas: {len(all_ideas)}")
     
     by_category = {}
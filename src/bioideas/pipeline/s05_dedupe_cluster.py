@@ -3,17 +3,33 @@ Step 05: Deduplicate and cluster ideas.
 
 Создаёт эмбеддинги идей, находит похожие через Qdrant,
 кластеризует с помощью HDBSCAN, помечает дубликаты.
+
+Результат — ideas_deduped.jsonl и таблица кластеров и дубликатов (clusters.py).
+
+Инкрементальный режим (по умолчанию): обрабатываются только идеи, которых нет
+в dedupe_state.json. Они эмбеддятся, ищутся в индексе Qdrant среди канонических
+идей, получают кластер от сохранённых редуктора и модели HDBSCAN (approximate_predict)
+и дописываются в ideas_deduped.jsonl. Полная пересборка — `bioideas recluster`
+(или автоматически, если состояния нет или ideas.jsonl переписан).
 """
+import json
+
+import joblib
 import numpy as np
 from tqdm import tqdm
 from rich.console import Console
-from sklearn.metrics.pairwise import cosine_similarity
 import hdbscan
 
 from ..config import PROCESSED_DIR, settings
 from ..models import IdeaCard
-from ..storage import read_jsonl, write_jsonl
-from ..embeddings import embed_texts
+from ..clusters import (
+    build_clusters, save_cluster_table, load_cluster_map, load_duplicates, NOISE,
+    DUPLICATES_FILE, IDEA_CLUSTERS_FILE,
+)
+from ..storage import read_jsonl, write_jsonl, append_jsonl, jsonl_exists
+from ..embeddings import embed_texts_cached
+from ..similarity import greedy_duplicates, normalize_rows
+from ..reduction import fit_reduce, reduce
 from ..vectorstore import (
     get_client, ensure_collection, upsert_vectors,
     search_similar, VECTOR_SIZE_LARGE
@@ -23,8 +39,14 @@ console = Console()
 
 IDEAS_FILE = PROCESSED_DIR / "ideas.jsonl"
 IDEAS_DEDUPED_FILE = PROCESSED_DIR / "ideas_deduped.jsonl"
+EMBEDDING_CACHE_FILE = PROCESSED_DIR / "idea_embeddings.npz"
+STATE_FILE = PROCESSED_DIR / "dedupe_state.json"
+CLUSTER_MODEL_FILE = PROCESSED_DIR / "hdbscan_model.joblib"
+REDUCER_FILE = PROCESSED_DIR / "cluster_reducer.joblib"
 
 SIMILARITY_THRESHOLD = 0.85
+# Сколько ближайших идей из индекса проверяется для каждой новой
+DUPLICATE_SEARCH_LIMIT = 100
 
 
 def create_idea_embedding_text(idea: IdeaCard) -> str:
@@ -36,78 +58,147 @@ def find_duplicates(ideas: list[IdeaCard], embeddings: list[list[float]]) -> dic
     """
     Находит дубликаты по косинусной близости.
     Возвращает {duplicate_id: canonical_id}.
+    Жадный проход в порядке идей; сходство считается блоками float32 (similarity.py),
+    поэтому память не растёт квадратично.
     """
     if len(ideas) < 2:
         return {}
     
-    emb_matrix = np.array(embeddings)
-    sim_matrix = cosine_similarity(emb_matrix)
-    
-    duplicates = {}
-    seen = set()
-    
-    for i in range(len(ideas)):
-        if ideas[i].idea_id in seen:
-            continue
-        
-        for j in range(i + 1, len(ideas)):
-            if ideas[j].idea_id in seen:
-                continue
-            
-            if sim_matrix[i, j] >= SIMILARITY_THRESHOLD:
-                duplicates[ideas[j].idea_id] = ideas[i].idea_id
-                seen.add(ideas[j].idea_id)
-    
-    return duplicates
+    duplicates = greedy_duplicates(embeddings, SIMILARITY_THRESHOLD)
+    return {ideas[j].idea_id: ideas[i].idea_id for j, i in duplicates.items()}
 
 
-def cluster_ideas(embeddings: list[list[float]], min_cluster_size: int = 3) -> list[int]:
+def cluster_ideas(
+    embeddings: list[list[float]],
+    min_cluster_size: int = 3,
+    reducer_method: str | None = None,
+    dims: int | None = None,
+) -> tuple[list[int], hdbscan.HDBSCAN | None, object | None]:
     """
-    Кластеризует идеи с помощью HDBSCAN.
-    Возвращает список cluster_id для каждой идеи (-1 = шум).
+    Кластеризует идеи с помощью HDBSCAN после снижения размерности (reduction.py,
+    по умолчанию settings.cluster_reducer / settings.cluster_dims).
+    Возвращает список cluster_id для каждой идеи (-1 = шум), обученную модель
+    (с prediction_data для approximate_predict; None, если идей слишком мало)
+    и обученный редуктор (None — кластеризация на исходных векторах).
     """
     if len(embeddings) < min_cluster_size:
-        return [-1] * len(embeddings)
+        return [-1] * len(embeddings), None, None
     
-    emb_matrix = np.array(embeddings)
+    reducer, emb_matrix = fit_reduce(
+        embeddings,
+        reducer_method or settings.cluster_reducer,
+        dims or settings.cluster_dims,
+    )
     
     clusterer = hdbscan.HDBSCAN(
         min_cluster_size=min_cluster_size,
         metric='euclidean',
-        cluster_selection_method='eom'
+        cluster_selection_method='eom',
+        prediction_data=True,
+        core_dist_n_jobs=settings.cluster_n_jobs,
     )
     
     cluster_labels = clusterer.fit_predict(emb_matrix)
-    return cluster_labels.tolist()
+    return cluster_labels.tolist(), clusterer, reducer
 
 
-def main():
-    console.print("[bold blue]Step 05: Dedupe & Cluster Ideas[/bold blue]")
+def load_state() -> dict | None:
+    """
+    Состояние последнего прогона: порядок обработанных идей (dedupe_state.json),
+    дубликаты и кластеры (из таблицы кластеров). Если таблицы ещё нет
+    (состояние старого формата), берутся дубликаты и метки из самого JSON.
+    """
+    if not STATE_FILE.exists() or not CLUSTER_MODEL_FILE.exists():
+        return None
+    state = json.loads(STATE_FILE.read_text(encoding="utf-8"))
+    if jsonl_exists(DUPLICATES_FILE) or "duplicates" not in state:
+        state["duplicates"] = load_duplicates()
+    if jsonl_exists(IDEA_CLUSTERS_FILE) or "labels" not in state:
+        state["labels"] = load_cluster_map()
+    return state
+
+
+def save_state(state: dict, ideas: list[IdeaCard]) -> list:
+    """Сохраняет порядок идей и пересобирает таблицу кластеров. Возвращает кластеры."""
+    texts = [create_idea_embedding_text(idea) for idea in ideas]
+    # Все эмбеддинги уже в кеше — запросов к API нет
+    embeddings = embed_texts_cached(texts, EMBEDDING_CACHE_FILE)
+    clusters, centroids = build_clusters(
+        [idea.idea_id for idea in ideas], embeddings, state["labels"], state["duplicates"]
+    )
+    save_cluster_table(state["labels"], state["duplicates"], clusters, centroids)
     
-    ideas = read_jsonl(IDEAS_FILE, IdeaCard)
-    if not ideas:
-        console.print("[yellow]No ideas found. Run step 04 first.[/yellow]")
-        return
+    tmp_path = STATE_FILE.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps({"idea_ids": state["idea_ids"]}, ensure_ascii=False), encoding="utf-8")
+    tmp_path.replace(STATE_FILE)
+    return clusters
+
+
+def idea_payload(idea: IdeaCard) -> dict:
+    return {
+        "idea_id": idea.idea_id,
+        "title": idea.title_ru,
+        "category": idea.category,
+        "doc_id": idea.doc_id,
+    }
+
+
+def find_new_duplicates(
+    client,
+    new_ideas: list[IdeaCard],
+    new_embeddings: np.ndarray,
+    canonical_order: dict[str, int],
+) -> dict[str, str]:
+    """
+    Дубликаты для новых идей в том же жадном порядке, что и find_duplicates:
+    новая идея — дубликат самой ранней канонической идеи с близостью ≥ порога.
+    Сначала ищутся уже проиндексированные канонические идеи (Qdrant),
+    затем — более ранние новые идеи этого же прогона.
+    """
+    duplicates: dict[str, str] = {}
+    matrix = normalize_rows(new_embeddings)
+    new_canonical: list[int] = []
     
-    console.print(f"Found {len(ideas)} ideas")
+    for j, idea in enumerate(tqdm(new_ideas, desc="Searching duplicates")):
+        hits = search_similar(
+            client,
+            settings.qdrant_ideas_collection,
+            new_embeddings[j].tolist(),
+            limit=DUPLICATE_SEARCH_LIMIT,
+            score_threshold=SIMILARITY_THRESHOLD,
+        )
+        matched = [h["id"] for h in hits if h["id"] in canonical_order]
+        if matched:
+            duplicates[idea.idea_id] = min(matched, key=canonical_order.get)
+            continue
+        
+        if new_canonical:
+            sims = matrix[new_canonical] @ matrix[j]
+            close = np.flatnonzero(sims >= SIMILARITY_THRESHOLD)
+            if len(close):
+                duplicates[idea.idea_id] = new_ideas[new_canonical[close[0]]].idea_id
+                continue
+        new_canonical.append(j)
     
+    return duplicates
+
+
+def print_cluster_sizes(clusters) -> None:
+    if clusters:
+        console.print(f"  Clusters: {len(clusters)}, sizes: {sorted((c.size for c in clusters), reverse=True)[:10]}")
+
+
+def run_full(ideas: list[IdeaCard]) -> None:
+    """Полная пересборка: все идеи заново индексируются, дедуплицируются и кластеризуются."""
     console.print("Creating embeddings for ideas...")
     texts = [create_idea_embedding_text(idea) for idea in ideas]
-    embeddings = embed_texts(texts)
+    embeddings = embed_texts_cached(texts, EMBEDDING_CACHE_FILE).tolist()
     
     client = get_client()
     ensure_collection(client, settings.qdrant_ideas_collection, VECTOR_SIZE_LARGE)
     
     ids = [idea.idea_id for idea in ideas]
-    payloads = [
-        {
-            "idea_id": idea.idea_id,
-            "title": idea.title_ru,
-            "category": idea.category,
-            "doc_id": idea.doc_id,
-        }
-        for idea in ideas
-    ]
+    payloads = [idea_payload(idea) for idea in ideas]
     upsert_vectors(client, settings.qdrant_ideas_collection, ids, embeddings, payloads)
     
     console.print("Finding duplicates...")
@@ -115,31 +206,109 @@ def main():
     console.print(f"  Found {len(duplicates)} duplicates")
     
     console.print("Clustering ideas...")
-    cluster_labels = cluster_ideas(embeddings)
+    cluster_labels, model, reducer = cluster_ideas(embeddings)
     n_clusters = len(set(cluster_labels)) - (1 if -1 in cluster_labels else 0)
     console.print(f"  Found {n_clusters} clusters")
     
-    unique_ideas = []
-    for i, idea in enumerate(ideas):
-        if idea.idea_id not in duplicates:
-            idea_dict = idea.model_dump()
-            idea_dict["cluster_id"] = cluster_labels[i]
-            idea_dict["is_duplicate"] = False
-            unique_ideas.append(IdeaCard.model_validate(idea_dict))
-    
+    unique_ideas = [idea for idea in ideas if idea.idea_id not in duplicates]
     write_jsonl(IDEAS_DEDUPED_FILE, unique_ideas)
+    for path, obj in ((CLUSTER_MODEL_FILE, model), (REDUCER_FILE, reducer)):
+        if obj is not None:
+            joblib.dump(obj, path)
+        elif path.exists():
+            path.unlink()
+    clusters = save_state(
+        {
+            "idea_ids": ids,
+            "duplicates": duplicates,
+            "labels": dict(zip(ids, cluster_labels)),
+        },
+        ideas,
+    )
     
     console.print(f"[green]Done![/green]")
     console.print(f"  Original ideas: {len(ideas)}")
     console.print(f"  Unique ideas: {len(unique_ideas)}")
     console.print(f"  Removed duplicates: {len(duplicates)}")
+    print_cluster_sizes(clusters)
+
+
+def run_incremental(state: dict, ideas: list[IdeaCard], new_ideas: list[IdeaCard]) -> None:
+    """Дозапись новых идей в индекс, набор уникальных идей и существующие кластеры."""
+    console.print(f"New ideas: {len(new_ideas)} (already processed: {len(state['idea_ids'])})")
+    texts = [create_idea_embedding_text(idea) for idea in new_ideas]
+    embeddings = embed_texts_cached(texts, EMBEDDING_CACHE_FILE)
+    
+    client = get_client()
+    ensure_collection(client, settings.qdrant_ideas_collection, VECTOR_SIZE_LARGE)
+    
+    canonical_order = {
+        idea_id: i for i, idea_id in enumerate(state["idea_ids"])
+        if idea_id not in state["duplicates"]
+    }
+    duplicates = find_new_duplicates(client, new_ideas, embeddings, canonical_order)
+    console.print(f"  Found {len(duplicates)} duplicates")
+    
+    ids = [idea.idea_id for idea in new_ideas]
+    upsert_vectors(
+        client,
+        settings.qdrant_ideas_collection,
+        ids,
+        embeddings.tolist(),
+        [idea_payload(idea) for idea in new_ideas],
+        start_id=len(state["idea_ids"]),
+    )
+    
+    model = joblib.load(CLUSTER_MODEL_FILE)
+    reducer = joblib.load(REDUCER_FILE) if REDUCER_FILE.exists() else None
+    labels, _ = hdbscan.approximate_predict(model, reduce(reducer, embeddings))
+    labels = labels.tolist()
+    
+    n_unique = 0
+    for idea in new_ideas:
+        if idea.idea_id not in duplicates:
+            append_jsonl(IDEAS_DEDUPED_FILE, idea)
+            n_unique += 1
+    
+    state["idea_ids"].extend(ids)
+    state["duplicates"].update(duplicates)
+    state["labels"].update(zip(ids, labels))
+    clusters = save_state(state, ideas)
+    
+    console.print("[green]Done![/green]")
+    console.print(f"  Appended unique ideas: {n_unique}")
+    console.print(f"  Removed duplicates: {len(duplicates)}")
+    console.print(f"  Assigned to clusters: {sum(1 for label in labels if label != NOISE)}/{len(labels)}")
+    print_cluster_sizes(clusters)
+
+
+def main(full: bool = False):
+    console.print("[bold blue]Step 05: Dedupe & Cluster Ideas[/bold blue]")
+    
+    ideas = read_jsonl(IDEAS_FILE, IdeaCard)
+    if not ideas:
+        console.print("[yellow]No ideas found. Run step 04 first.[/yellow]")
+        return
+    
+    console.print(f"Found {len(ideas)} ideas")
     
-    cluster_counts = {}
-    for label in cluster_labels:
-        if label >= 0:
-            cluster_counts[label] = cluster_counts.get(label, 0) + 1
-    if cluster_counts:
-        console.print(f"  Cluster sizes: {sorted(cluster_counts.values(), reverse=True)[:10]}")
+    state = None if full else load_state()
+    if state is not None:
+        current_ids = {idea.idea_id for idea in ideas}
+        if not set(state["idea_ids"]) <= current_ids:
+            console.print("[yellow]ideas.jsonl was rewritten since the last run, reclustering from scratch[/yellow]")
+            state = None
+    
+    if state is None:
+        run_full(ideas)
+        return
+    
+    processed = set(state["idea_ids"])
+    new_ideas = [idea for idea in ideas if idea.idea_id not in processed]
+    if not new_ideas:
+        console.print("[green]No new ideas, nothing to do.[/green] Use `bioideas recluster` for a full rebuild.")
+        return
+    run_incremental(state, ideas, new_ideas)
 
 
 if __name__ == "__main__":
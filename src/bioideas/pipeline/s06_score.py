@@ -4,13 +4,17 @@ Step 06: Score ideas by 5 criteria.
 Оценивает каждую идею по 5 критериям (1-10) + риски.
 Применяет "нокаут-фильтры" для отсева слабых идей.
 """
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from tqdm import tqdm
 from rich.console import Console
 
 from ..config import PROCESSED_DIR, settings
-from ..models import IdeaCard, ScoreCard
-from ..storage import read_jsonl, append_jsonl, write_jsonl, load_processed_ids
+from ..models import IdeaCard, ScoreCard, ScoreCardList
+from ..storage import read_jsonl, append_jsonl, write_jsonl, load_processed_ids, jsonl_exists
 from ..llm import parse_structured
+from ..clusters import load_cluster_map, filter_by_clusters, sample_by_cluster
 
 console = Console()
 
@@ -59,10 +63,17 @@ SYSTEM_PROMPT = """Ты венчурный аналитик, специализ
 - В dealbreakers_ru укажи стоп-факторы, если есть."""
 
 
-def score_idea(idea: IdeaCard) -> ScoreCard | None:
-    """Оценивает одну идею."""
-    
-    idea_text = f"""IDEA CARD:
+BATCH_RULES = """
+
+ПАКЕТНАЯ ОЦЕНКА:
+- Тебе дано несколько IdeaCard. Оцени КАЖДУЮ независимо от остальных, не сравнивай их между собой.
+- Верни ровно одну оценку на каждую идею, idea_id копируй из заголовка карточки без изменений."""
+
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + BATCH_RULES
+
+
+def format_idea(idea: IdeaCard) -> str:
+    return f"""IDEA CARD:
 - Title: {idea.title_ru}
 - One-liner: {idea.one_liner_ru}
 - Category: {idea.category}
@@ -77,30 +88,85 @@ def score_idea(idea: IdeaCard) -> ScoreCard | None:
 - Acquirer Types: {', '.join(idea.acquirer_types_ru)}
 - Key Risks: {', '.join(idea.key_risks_ru)}"""
 
+
+def finalize_score(score: ScoreCard, idea_id: str) -> ScoreCard:
+    score.idea_id = idea_id
+    score.total_score = (
+        score.score_horizon +
+        score.score_blue_ocean +
+        score.score_solo_start +
+        score.score_community_6m +
+        score.score_exit_2_3y
+    )
+    return score
+
+
+def score_idea(idea: IdeaCard) -> ScoreCard | None:
+    """Оценивает одну идею."""
     try:
         score: ScoreCard = parse_structured(
             system=SYSTEM_PROMPT,
-            user=idea_text,
+            user=format_idea(idea),
             schema=ScoreCard,
             max_output_tokens=settings.max_output_tokens_score,
         )
-        
-        score.idea_id = idea.idea_id
-        score.total_score = (
-            score.score_horizon +
-            score.score_blue_ocean +
-            score.score_solo_start +
-            score.score_community_6m +
-            score.score_exit_2_3y
-        )
-        
-        return score
+        return finalize_score(score, idea.idea_id)
         
     except Exception as e:
         console.print(f"[red]Error scoring {idea.idea_id}: {e}[/red]")
         return None
 
 
+def score_ideas_batch(ideas: list[IdeaCard]) -> dict[str, ScoreCard]:
+    """
+    Оценивает несколько идей одним запросом (рубрика отправляется один раз).
+    Возвращает {idea_id: ScoreCard} только для идей, получивших ровно одну оценку;
+    лишние и повторные оценки отбрасываются. Ошибка LLM пробрасывается.
+    """
+    user_prompt = "\n\n".join(
+        f"=== idea_id: {idea.idea_id} ===\n{format_idea(idea)}" for idea in ideas
+    )
+    result: ScoreCardList = parse_structured(
+        system=BATCH_SYSTEM_PROMPT,
+        user=user_prompt,
+        schema=ScoreCardList,
+        max_output_tokens=settings.max_output_tokens_score * len(ideas),
+    )
+    
+    expected = {idea.idea_id for idea in ideas}
+    by_id: dict[str, list[ScoreCard]] = {}
+    for score in result.scores:
+        if score.idea_id in expected:
+            by_id.setdefault(score.idea_id, []).append(score)
+    
+    return {
+        idea_id: finalize_score(scores[0], idea_id)
+        for idea_id, scores in by_id.items()
+        if len(scores) == 1
+    }
+
+
+def score_batch(ideas: list[IdeaCard]) -> tuple[list[ScoreCard], int]:
+    """
+    Пакетная оценка с добором: идеи без ровно одной оценки (или весь пакет,
+    если запрос упал) оцениваются по одной. Возвращает (оценки, сколько идей добиралось).
+    """
+    scored: dict[str, ScoreCard] = {}
+    if len(ideas) > 1:
+        try:
+            scored = score_ideas_batch(ideas)
+        except Exception as e:
+            console.print(f"[red]Error scoring batch of {len(ideas)}: {e}[/red]")
+    
+    missing = [idea for idea in ideas if idea.idea_id not in scored]
+    for idea in missing:
+        score = score_idea(idea)
+        if score:
+            scored[idea.idea_id] = score
+    
+    return [scored[idea.idea_id] for idea in ideas if idea.idea_id in scored], len(missing) if len(ideas) > 1 else 0
+
+
 def apply_knockout_filters(scores: list[ScoreCard]) -> tuple[list[ScoreCard], list[ScoreCard]]:
     """
     Применяет нокаут-фильтры.
@@ -122,10 +188,80 @@ def apply_knockout_filters(scores: list[ScoreCard]) -> tuple[list[ScoreCard], li
     return passed, knocked_out
 
 
-def main():
+def score_with_llm(new_ideas: list[IdeaCard]) -> None:
+    """Оценивает идеи пакетами по settings.score_batch_size и дописывает в scores.jsonl."""
+    batch_size = max(1, settings.score_batch_size)
+    batches = [new_ideas[i:i + batch_size] for i in range(0, len(new_ideas), batch_size)]
+    console.print(f"Scoring {len(new_ideas)} new ideas in {len(batches)} requests of up to {batch_size}...")
+    
+    retried = 0
+    with ThreadPoolExecutor(max_workers=max(1, settings.llm_concurrency)) as pool:
+        futures = {pool.submit(score_batch, batch): batch for batch in batches}
+        with tqdm(total=len(new_ideas), desc="Scoring", unit="idea") as progress:
+            for future in as_completed(futures):
+                scores, n_retried = future.result()
+                for score in scores:
+                    append_jsonl(SCORES_FILE, score)
+                retried += n_retried
+                progress.update(len(futures[future]))
+    
+    if retried:
+        console.print(f"  Re-scored individually: {retried}")
+
+
+def prescore_ideas(ideas: list[IdeaCard], new_ideas: list[IdeaCard]) -> list[IdeaCard]:
+    """
+    Предсказывает оценки новых идей по похожим оценённым (score_predictor.py),
+    уверенные предсказания сразу пишет в scores.jsonl (predicted=True).
+    Возвращает идеи, которые всё равно нужно оценить LLM.
+    """
+    from ..score_predictor import load_predictor, idea_embeddings, needs_llm
+    
+    predictor = load_predictor(ideas)
+    if predictor is None:
+        console.print("[yellow]Not enough LLM-scored ideas for the score predictor, scoring all with LLM.[/yellow]")
+        return new_ideas
+    
+    predictions = predictor.predict([i.idea_id for i in new_ideas], idea_embeddings(new_ideas))
+    to_llm = []
+    reasons: dict[str, int] = {}
+    for idea, prediction in zip(new_ideas, predictions):
+        reason = needs_llm(prediction)
+        if reason is None:
+            append_jsonl(SCORES_FILE, prediction.card)
+        else:
+            to_llm.append(idea)
+            reasons[reason] = reasons.get(reason, 0) + 1
+    
+    console.print(f"  Predicted: {len(new_ideas) - len(to_llm)}, sent to LLM: {len(to_llm)}")
+    for reason, count in sorted(reasons.items(), key=lambda x: -x[1]):
+        console.print(f"    {reason}: {count}")
+    return to_llm
+
+
+def select_by_clusters(ideas: list[IdeaCard], clusters: list[int] | None, per_cluster: int) -> list[IdeaCard]:
+    """
+    Идеи из выбранных кластеров и/или случайная выборка не более per_cluster
+    идей на кластер (таблица кластеров s05, шум не ограничивается).
+    """
+    cluster_map = load_cluster_map()
+    if not cluster_map:
+        console.print("[yellow]No cluster table found, run step 05 first. Scoring all ideas.[/yellow]")
+        return ideas
+    
+    ids = [i.idea_id for i in ideas]
+    if clusters:
+        ids = filter_by_clusters(ids, cluster_map, set(clusters))
+    if per_cluster > 0:
+        ids = sample_by_cluster(ids, cluster_map, per_cluster, random.Random(42))
+    selected = set(ids)
+    return [i for i in ideas if i.idea_id in selected]
+
+
+def main(clusters: list[int] | None = None, per_cluster: int = 0):
     console.print("[bold blue]Step 06: Score Ideas[/bold blue]")
     
-    ideas_file = IDEAS_DEDUPED_FILE if IDEAS_DEDUPED_FILE.exists() else IDEAS_FILE
+    ideas_file = IDEAS_DEDUPED_FILE if jsonl_exists(IDEAS_DEDUPED_FILE) else IDEAS_FILE
     ideas = read_jsonl(ideas_file, IdeaCard)
     
     if not ideas:
@@ -136,6 +272,8 @@ def main():
     
     processed_ids = load_processed_ids(SCORES_FILE, "idea_id")
     new_ideas = [i for i in ideas if i.idea_id not in processed_ids]
+    if clusters or per_cluster > 0:
+        new_ideas = select_by_clusters(new_ideas, clusters, per_cluster)
     
     if not new_ideas:
         existing_scores = read_jsonl(SCORES_FILE, ScoreCard)
@@ -144,12 +282,13 @@ def main():
         console.print(f"  Total: {len(existing_scores)}, Passed filters: {len(passed)}, Knocked out: {len(knocked)}")
         return
     
-    console.print(f"Scoring {len(new_ideas)} new ideas...")
+    # Одна оценка на idea_id: повторные id в пакете неотличимы
+    new_ideas = list({i.idea_id: i for i in reversed(new_ideas)}.values())[::-1]
     
-    for idea in tqdm(new_ideas, desc="Scoring"):
-        score = score_idea(idea)
-        if score:
-            append_jsonl(SCORES_FILE, score)
+    if settings.score_predictor:
+        new_ideas = prescore_ideas(ideas, new_ideas)
+    if new_ideas:
+        score_with_llm(new_ideas)
     
     all_scores = read_jsonl(SCORES_FILE, ScoreCard)
     passed, knocked = apply_knockout_filters(all_scores)
@@ -2,19 +2,63 @@
 Step 07: Pairwise tournament with Elo rating.
 
 Проводит попарные сравнения топ-идей для более точного ранжирования.
-Использует Elo-рейтинг для финального ранга.
+Финальный рейтинг — модель Брэдли–Терри по всем сравнениям (ranking.py)
+в шкале Elo, с 95% бутстрэп-интервалом. В отличие от последовательного
+Elo, он не зависит от порядка матчей, поэтому матчи раунда идут
+параллельно (settings.llm_concurrency потоков), а рейтинг воспроизводим.
+
+Турнир возобновляемый: рейтинги восстанавливаются из comparisons.jsonl,
+в LLM уходят только недостающие матчи (например, для новых участников),
+сыгранные пары не повторяются, рейтинги сохраняются после каждого раунда.
+
+Расписание (settings.tournament_schedule):
+- adaptive — сначала каждая идея играет MIN_MATCHES_PER_IDEA матчей, дальше
+  играют только идеи, чья принадлежность к top-K ещё не определена
+  (ranking.py, Брэдли–Терри), в паре с ближайшим по силе соперником
+  (швейцарская система: такие матчи самые информативные). Турнир
+  заканчивается, когда состав top-K определён или у неопределённых идей
+  кончился лимит COMPARISONS_PER_IDEA;
+- random — случайные пары, пока у каждой идеи не будет COMPARISONS_PER_IDEA матчей;
+- sparse — весь пул оценённых идей без порога MIN_TOTAL_SCORE и лимита
+  TOP_N_FOR_TOURNAMENT: сначала разреженный связный граф сравнений степени
+  settings.tournament_degree (циклы по s06-оценке, по кластерам и случайные —
+  экспандер), затем adaptive-добор для top-K. Рейтинг решается в разреженной
+  форме (ranking.bradley_terry_sparse), раунды строятся за O(n·degree).
+
+Режим (settings.tournament_mode):
+- pairwise — один запрос к LLM сравнивает две идеи;
+- listwise — один запрос ранжирует группу из settings.tournament_group_size
+  идей (4–8). Ранжирование раскладывается на все следующие из него пары
+  (победитель — идея выше), они пишутся в comparisons.jsonl с общим group_id
+  и идут в ту же модель Брэдли–Терри. Группы подбираются по тому же
+  расписанию, лимит — LISTWISE_GROUPS_PER_IDEA ранжирований на идею.
+
+Суждения LLM кешируются в judgment_cache.jsonl по ключу: неупорядоченная
+пара (или группа), хеш обеих карточек, версия промпта и модель, поэтому
+повторное сравнение тех же карточек бесплатно в любом турнире и расписании.
+Порядок идей в промпте задаёт settings.tournament_order и записывается в
+Comparison.first_id; смещение первой позиции оценивается вместе с силами
+и в рейтинг не попадает (settings.tournament_position_correction).
 """
+import hashlib
 import random
 import uuid
+from datetime import datetime
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from dataclasses import dataclass
 from tqdm import tqdm
 from rich.console import Console
 from pydantic import BaseModel, Field
 
-from ..config import PROCESSED_DIR
+from ..config import PROCESSED_DIR, settings
 from ..models import IdeaCard, ScoreCard, Comparison, EloRating
-from ..storage import read_jsonl, write_jsonl, append_jsonl
+from ..storage import read_jsonl, write_jsonl, append_jsonl, iter_jsonl, jsonl_exists
 from ..llm import parse_structured
+from ..ranking import ELO_SCALE, fit_results, undecided_for_top_k, bootstrap_intervals, to_elo
+from ..clusters import NOISE, load_cluster_map, filter_by_clusters, sample_by_cluster
 
 console = Console()
 
@@ -23,11 +67,16 @@ IDEAS_FILE = PROCESSED_DIR / "ideas.jsonl"
 IDEAS_DEDUPED_FILE = PROCESSED_DIR / "ideas_deduped.jsonl"
 COMPARISONS_FILE = PROCESSED_DIR / "comparisons.jsonl"
 ELO_FILE = PROCESSED_DIR / "elo_ratings.jsonl"
+JUDGMENT_CACHE_FILE = PROCESSED_DIR / "judgment_cache.jsonl"
 
-K_FACTOR = 32
-INITIAL_ELO = 1500
+INITIAL_ELO = 1500            # центр шкалы: средняя идея
+BOOTSTRAP_SAMPLES = 200
+MIN_TOTAL_SCORE = 25
 TOP_N_FOR_TOURNAMENT = 100  # Расширено: было 25
 COMPARISONS_PER_IDEA = 8     # Расширено: было 4
+MIN_MATCHES_PER_IDEA = 3     # adaptive: столько матчей до первой оценки неопределённости
+LISTWISE_GROUPS_PER_IDEA = 3  # listwise: столько ранжирований на идею
+SPARSE_SEED = 0              # sparse: seed случайных циклов графа (граф воспроизводим)
 
 
 class ComparisonResult(BaseModel):
@@ -50,23 +99,50 @@ SYSTEM_PROMPT = """Ты венчурный аналитик. Сравни две
 - winner_id должен быть либо idea_a_id, либо idea_b_id
 - В reasoning_ru объясни ключевое преимущество победителя"""
 
+PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:8]
+
+
+class GroupRanking(BaseModel):
+    """Ранжирование группы идей."""
+    ranked_ids: list[str] = Field(description="ID всех идей группы от лучшей к худшей, каждый ровно один раз")
+    reasoning_ru: str = Field(description="Краткое обоснование порядка (2-3 предложения)")
+
+
+LISTWISE_SYSTEM_PROMPT = """Ты венчурный аналитик. Упорядочи идеи от самой перспективной к наименее перспективной.
+
+КРИТЕРИИ СРАВНЕНИЯ (в порядке важности):
+1. Возможность стартовать одному из дома (software-first)
+2. Быстрый интерес сообщества (3-6 месяцев)
+3. Потенциал голубого океана
+4. Понятный путь к продаже через 2-3 года
+5. Перспективность на горизонте 1-10 лет
+
+ПРАВИЛА:
+- В ranked_ids перечисли ВСЕ id идей, каждый ровно один раз, лучшая — первой
+- Не добавляй id, которых нет среди идей
+- В reasoning_ru объясни, чем лучшие идеи сильнее остальных"""
+
+LISTWISE_PROMPT_VERSION = hashlib.sha256(LISTWISE_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:8]
+
+
+def format_idea(label: str, idea: IdeaCard) -> str:
+    return f"""IDEA {label} (id: {idea.idea_id}):
+- Title: {idea.title_ru}
+- Problem: {idea.problem_ru}
+- Solution: {idea.solution_ru}
+- Wedge: {idea.wedge_ru}
+- Community Hook: {idea.community_hook_ru}"""
+
 
 def compare_ideas(idea_a: IdeaCard, idea_b: IdeaCard) -> ComparisonResult | None:
-    """Сравнивает две идеи."""
-    
-    user_prompt = f"""IDEA A (id: {idea_a.idea_id}):
-- Title: {idea_a.title_ru}
-- Problem: {idea_a.problem_ru}
-- Solution: {idea_a.solution_ru}
-- Wedge: {idea_a.wedge_ru}
-- Community Hook: {idea_a.community_hook_ru}
-
-IDEA B (id: {idea_b.idea_id}):
-- Title: {idea_b.title_ru}
-- Problem: {idea_b.problem_ru}
-- Solution: {idea_b.solution_ru}
-- Wedge: {idea_b.wedge_ru}
-- Community Hook: {idea_b.community_hook_ru}
+    """
+    Сравнивает две идеи. Ответ с чужим winner_id отбрасывается (None), а не
+    засчитывается первой идее — иначе он исказил бы оценку смещения позиции.
+    """
+    
+    user_prompt = f"""{format_idea("A", idea_a)}
+
+{format_idea("B", idea_b)}
 
 Какая идея лучше? Ответь winner_id = "{idea_a.idea_id}" или winner_id = "{idea_b.idea_id}"."""
 
@@ -79,7 +155,8 @@ IDEA B (id: {idea_b.idea_id}):
         )
         
         if result.winner_id not in [idea_a.idea_id, idea_b.idea_id]:
-            result.winner_id = idea_a.idea_id
+            console.print(f"[yellow]Invalid winner_id {result.winner_id!r}, comparison skipped[/yellow]")
+            return None
         
         return result
         
@@ -88,43 +165,462 @@ IDEA B (id: {idea_b.idea_id}):
         return None
 
 
-def update_elo(ratings: dict[str, float], winner_id: str, loser_id: str) -> None:
-    """Обновляет Elo-рейтинги после матча."""
-    winner_elo = ratings.get(winner_id, INITIAL_ELO)
-    loser_elo = ratings.get(loser_id, INITIAL_ELO)
+def rank_ideas(ideas: list[IdeaCard]) -> GroupRanking | None:
+    """
+    Ранжирует группу идей одним запросом. Чужие и повторные id отбрасываются;
+    если модель пропустила идеи, используется порядок остальных (нужно хотя бы две).
+    """
+    user_prompt = "\n\n".join(format_idea(chr(ord("A") + i), idea) for i, idea in enumerate(ideas))
+    user_prompt += f"\n\nУпорядочи {len(ideas)} идей от лучшей к худшей: ranked_ids — список их id."
     
-    expected_winner = 1 / (1 + 10 ** ((loser_elo - winner_elo) / 400))
-    expected_loser = 1 - expected_winner
+    try:
+        result: GroupRanking = parse_structured(
+            system=LISTWISE_SYSTEM_PROMPT,
+            user=user_prompt,
+            schema=GroupRanking,
+            max_output_tokens=200 + 100 * len(ideas),
+        )
+    except Exception as e:
+        console.print(f"[red]Error ranking: {e}[/red]")
+        return None
     
-    ratings[winner_id] = winner_elo + K_FACTOR * (1 - expected_winner)
-    ratings[loser_id] = loser_elo + K_FACTOR * (0 - expected_loser)
+    known = {idea.idea_id for idea in ideas}
+    result.ranked_ids = [id_ for id_ in dict.fromkeys(result.ranked_ids) if id_ in known]
+    if len(result.ranked_ids) < 2:
+        return None
+    return result
 
 
-def generate_matchups(idea_ids: list[str], comparisons_per_idea: int) -> list[tuple[str, str]]:
-    """Генерирует пары для сравнения (швейцарская система)."""
-    matchups = []
-    match_counts = {id_: 0 for id_ in idea_ids}
+def pair_key(id_a: str, id_b: str) -> tuple[str, str]:
+    return (id_a, id_b) if id_a < id_b else (id_b, id_a)
+
+
+@dataclass
+class TournamentState:
+    """Участники и результаты матчей, восстановленные из сравнений."""
+    idea_ids: list[str]
+    wins: dict[str, int]
+    losses: dict[str, int]
+    played_pairs: set[tuple[str, str]]
+    # (победитель, проигравший) в порядке матчей
+    results: list[tuple[str, str]]
+    # идея, показанная первой в каждом матче (None — неизвестно)
+    firsts: list[str | None]
+    shown_first: dict[str, int]
     
-    shuffled = idea_ids.copy()
-    random.shuffle(shuffled)
+    @classmethod
+    def start(cls, idea_ids: list[str]) -> "TournamentState":
+        return cls(
+            idea_ids=list(idea_ids),
+            wins={id_: 0 for id_ in idea_ids},
+            losses={id_: 0 for id_ in idea_ids},
+            played_pairs=set(),
+            results=[],
+            firsts=[],
+            shown_first={id_: 0 for id_ in idea_ids},
+        )
+    
+    def matches(self, idea_id: str) -> int:
+        return self.wins[idea_id] + self.losses[idea_id]
+    
+    def record(self, id_a: str, id_b: str, winner_id: str, first_id: str | None = None) -> None:
+        loser_id = id_b if winner_id == id_a else id_a
+        self.wins[winner_id] += 1
+        self.losses[loser_id] += 1
+        self.played_pairs.add(pair_key(id_a, id_b))
+        self.results.append((winner_id, loser_id))
+        self.firsts.append(first_id)
+        if first_id is not None:
+            self.shown_first[first_id] += 1
+    
+    def fit(self, with_stderr: bool = True) -> tuple[np.ndarray, np.ndarray | None, float]:
+        """Силы, стандартные ошибки и смещение первой позиции (ranking.fit_results)."""
+        firsts = self.firsts if settings.tournament_position_correction else None
+        return fit_results(self.idea_ids, self.results, firsts, with_stderr=with_stderr)
+    
+    def strengths(self, with_stderr: bool = True) -> tuple[list[str], np.ndarray, np.ndarray | None]:
+        """
+        Силы Брэдли–Терри и их стандартные ошибки по всем сыгранным матчам.
+        with_stderr=False — только силы (ошибки нужны лишь undecided_for_top_k).
+        """
+        scores, stderr, _ = self.fit(with_stderr)
+        return self.idea_ids, scores, stderr
+
+
+def replay_comparisons(idea_ids: list[str]) -> tuple[TournamentState, int]:
+    """
+    Восстанавливает состояние по сохранённым сравнениям между текущими
+    участниками. Возвращает (состояние, число учтённых сравнений).
+    """
+    state = TournamentState.start(idea_ids)
+    replayed = 0
+    for comparison in iter_jsonl(COMPARISONS_FILE, Comparison):
+        id_a, id_b = comparison.idea_a_id, comparison.idea_b_id
+        if id_a not in state.wins or id_b not in state.wins:
+            continue
+        if comparison.winner_id not in (id_a, id_b):
+            continue
+        first_id = comparison.first_id
+        if first_id is None and comparison.group_id is None:
+            first_id = id_a
+        state.record(id_a, id_b, comparison.winner_id, first_id)
+        replayed += 1
+    return state, replayed
+
+
+def generate_round(state: TournamentState, comparisons_per_idea: int, tried: set[tuple[str, str]]) -> list[tuple[str, str]]:
+    """
+    Раунд случайных пар для идей, которым ещё не хватает comparisons_per_idea
+    матчей: каждая идея играет не больше одного матча, сыгранные и опробованные
+    в этом запуске пары не повторяются. Соперник ищется сначала среди таких же
+    идей, затем среди остальных участников (им достаётся лишний матч).
+    """
+    needing = [id_ for id_ in state.idea_ids if state.matches(id_) < comparisons_per_idea]
+    others = [id_ for id_ in state.idea_ids if state.matches(id_) >= comparisons_per_idea]
+    random.shuffle(needing)
+    random.shuffle(others)
+    pool = needing + others
     
-    for _ in range(len(idea_ids) * comparisons_per_idea // 2):
-        available = [id_ for id_ in shuffled if match_counts[id_] < comparisons_per_idea]
-        if len(available) < 2:
+    matchups = []
+    busy: set[str] = set()
+    # Занятые идеи копятся в начале pool (needing идёт в том же порядке),
+    # поэтому поиск начинается с первой свободной — раунд почти линейный
+    first_free = 0
+    for id_a in needing:
+        if id_a in busy:
+            continue
+        busy.add(id_a)
+        while first_free < len(pool) and pool[first_free] in busy:
+            first_free += 1
+        for id_b in pool[first_free:]:
+            key = pair_key(id_a, id_b)
+            if id_b in busy or key in state.played_pairs or key in tried:
+                continue
+            matchups.append((id_a, id_b))
+            busy.add(id_b)
             break
-        
-        id_a = random.choice(available)
-        available.remove(id_a)
-        id_b = random.choice(available)
-        
-        matchups.append((id_a, id_b))
-        match_counts[id_a] += 1
-        match_counts[id_b] += 1
+    return matchups
+
+
+def adaptive_candidates(
+    state: TournamentState,
+    ids: list[str],
+    scores: np.ndarray,
+    max_matches: int,
+) -> list[str]:
+    """
+    Идеи, которым нужны матчи, по убыванию силы. Пока не у всех идей есть
+    MIN_MATCHES_PER_IDEA матчей, это они; затем — только идеи, чья
+    принадлежность к top-K не определена, не больше max_matches матчей
+    (только здесь считаются стандартные ошибки).
+    """
+    strength = dict(zip(ids, scores.tolist()))
+    by_strength = sorted(ids, key=strength.get, reverse=True)
+    
+    active = [id_ for id_ in by_strength if state.matches(id_) < MIN_MATCHES_PER_IDEA]
+    if active:
+        return active
+    _, _, stderr = state.strengths()
+    undecided = {
+        ids[i] for i in undecided_for_top_k(
+            scores, stderr, settings.tournament_top_k, settings.tournament_confidence_z
+        )
+    }
+    return [id_ for id_ in by_strength if id_ in undecided and state.matches(id_) < max_matches]
+
+
+def generate_adaptive_round(state: TournamentState, comparisons_per_idea: int, tried: set[tuple[str, str]]) -> list[tuple[str, str]]:
+    """
+    Швейцарский раунд по силе Брэдли–Терри среди adaptive_candidates.
+    Соперник — ближайший по силе участник без матча в этом раунде.
+    """
+    ids, scores, _ = state.strengths(with_stderr=False)
+    active = adaptive_candidates(state, ids, scores, comparisons_per_idea)
+    # Участники по убыванию силы; соперник ищется шагом от позиции идеи
+    # в обе стороны, а не сортировкой всех участников для каждой идеи
+    ranked = [ids[i] for i in np.argsort(-scores, kind="stable")]
+    position = {id_: rank for rank, id_ in enumerate(ranked)}
+    strength = dict(zip(ids, scores.tolist()))
     
+    matchups = []
+    busy: set[str] = set()
+    
+    def available(id_a: str, id_b: str) -> bool:
+        key = pair_key(id_a, id_b)
+        return id_b not in busy and key not in state.played_pairs and key not in tried
+    
+    for id_a in active:
+        if id_a in busy:
+            continue
+        busy.add(id_a)
+        lo, hi = position[id_a] - 1, position[id_a] + 1
+        while lo >= 0 and not available(id_a, ranked[lo]):
+            lo -= 1
+        while hi < len(ranked) and not available(id_a, ranked[hi]):
+            hi += 1
+        opponents = [ranked[r] for r in (lo, hi) if 0 <= r < len(ranked)]
+        if opponents:
+            id_b = min(opponents, key=lambda id_b: abs(strength[id_b] - strength[id_a]))
+            matchups.append((id_a, id_b))
+            busy.add(id_b)
+    return matchups
+
+
+def sparse_orders(idea_ids: list[str], cluster_map: dict[str, int], count: int) -> list[list[str]]:
+    """
+    count порядков обхода всех идей для разреженного расписания: по s06-оценке
+    (idea_ids уже отсортированы по total_score), по кластерам (внутри кластера —
+    по оценке) и случайные перестановки с фиксированным seed. Соседи по первым
+    двум сравниваются содержательно, случайные связывают далёкие идеи.
+    """
+    rng = random.Random(SPARSE_SEED)
+    orders = [list(idea_ids)]
+    if cluster_map:
+        orders.append(sorted(idea_ids, key=lambda id_: cluster_map.get(id_, NOISE)))
+    while len(orders) < count:
+        order = list(idea_ids)
+        rng.shuffle(order)
+        orders.append(order)
+    return orders[:max(count, 1)]
+
+
+def sparse_graph(idea_ids: list[str], cluster_map: dict[str, int], degree: int) -> list[tuple[str, str]]:
+    """
+    Разреженный граф сравнений степени ≈ degree: объединение degree // 2
+    циклов по sparse_orders. Цикл по оценке делает граф связным, случайные
+    циклы — экспандером (любые две идеи связаны короткой цепочкой сравнений),
+    поэтому общий рейтинг определён по O(n·degree) матчам вместо O(n²).
+    """
+    edges: dict[tuple[str, str], tuple[str, str]] = {}
+    for order in sparse_orders(idea_ids, cluster_map, degree // 2):
+        for id_a, id_b in zip(order, order[1:] + order[:1]):
+            if id_a != id_b:
+                edges.setdefault(pair_key(id_a, id_b), (id_a, id_b))
+    return list(edges.values())
+
+
+def generate_sparse_round(
+    state: TournamentState,
+    degree: int,
+    tried: set[tuple[str, str]],
+    cluster_map: dict[str, int],
+) -> list[tuple[str, str]]:
+    """
+    Раунд рёбер sparse_graph, которые ещё не сыграны и не опробованы: каждая
+    идея играет не больше одного матча, ребро пропускается, если у обеих идей
+    уже есть degree матчей (например, после возобновления с новыми участниками).
+    """
+    matchups = []
+    busy: set[str] = set()
+    for id_a, id_b in sparse_graph(state.idea_ids, cluster_map, degree):
+        key = pair_key(id_a, id_b)
+        if id_a in busy or id_b in busy or key in state.played_pairs or key in tried:
+            continue
+        if state.matches(id_a) >= degree and state.matches(id_b) >= degree:
+            continue
+        matchups.append((id_a, id_b))
+        busy.update(key)
     return matchups
 
 
-def main():
+def generate_groups(state: TournamentState, group_size: int, tried: set[tuple[str, str]]) -> list[tuple[str, ...]]:
+    """
+    Раунд групп для listwise-режима. Кандидаты — как в парном расписании
+    (random — перемешанные, adaptive — по убыванию силы, так что в группу
+    попадают соседи по силе), лимит — LISTWISE_GROUPS_PER_IDEA ранжирований.
+    Кандидаты режутся на группы по group_size, неполная последняя группа
+    добирается ближайшими по силе участниками. Группа, все пары которой уже
+    сыграны или опробованы, пропускается — так турнир конечен.
+    
+    sparse — сначала группы подряд идущих идей каждого из sparse_orders
+    (по одному порядку за раунд), так что граф сравнений связен, затем adaptive.
+    """
+    def is_new(group) -> bool:
+        return not all(
+            pair_key(a, b) in state.played_pairs or pair_key(a, b) in tried
+            for a, b in combinations(group, 2)
+        )
+    
+    if settings.tournament_schedule == "sparse":
+        for order in sparse_orders(state.idea_ids, load_cluster_map(), LISTWISE_GROUPS_PER_IDEA):
+            groups = [
+                tuple(order[start:start + group_size])
+                for start in range(0, len(order), group_size)
+            ]
+            groups = [g for g in groups if len(g) >= 2 and is_new(g)]
+            if groups:
+                return groups
+    
+    ids, scores, _ = state.strengths(with_stderr=False)
+    strength = dict(zip(ids, scores.tolist()))
+    max_matches = LISTWISE_GROUPS_PER_IDEA * (group_size - 1)
+    if settings.tournament_schedule == "random":
+        candidates = [id_ for id_ in ids if state.matches(id_) < max_matches]
+        random.shuffle(candidates)
+    else:
+        candidates = adaptive_candidates(state, ids, scores, max_matches)
+    
+    groups = []
+    busy: set[str] = set()
+    for start in range(0, len(candidates), group_size):
+        group = candidates[start:start + group_size]
+        if len(group) < group_size:
+            center = np.mean([strength[id_] for id_ in group])
+            fillers = sorted(
+                (id_ for id_ in ids if id_ not in busy and id_ not in group),
+                key=lambda id_: abs(strength[id_] - center),
+            )
+            group += fillers[:group_size - len(group)]
+        if len(group) < 2 or not is_new(group):
+            continue
+        groups.append(tuple(group))
+        busy.update(group)
+    return groups
+
+
+def next_round(state: TournamentState, tried: set[tuple[str, str]]) -> list[tuple[str, ...]]:
+    """
+    Матчи следующего раунда: пары или группы (settings.tournament_mode) по
+    settings.tournament_schedule; пусто — турнир окончен.
+    """
+    if settings.tournament_mode == "listwise":
+        return generate_groups(state, settings.tournament_group_size, tried)
+    if settings.tournament_schedule == "random":
+        return generate_round(state, COMPARISONS_PER_IDEA, tried)
+    if settings.tournament_schedule == "sparse":
+        # Сначала разреженный граф по всему пулу, затем adaptive-добор для top-K
+        matchups = generate_sparse_round(state, settings.tournament_degree, tried, load_cluster_map())
+        if matchups:
+            return matchups
+    return generate_adaptive_round(state, COMPARISONS_PER_IDEA, tried)
+
+
+def present_order(state: TournamentState, match: tuple[str, ...]) -> tuple[str, ...]:
+    """
+    Порядок идей в промпте по settings.tournament_order. alternate для пары
+    ставит первой идею, которую реже показывали первой; группы при random
+    и alternate перемешиваются.
+    """
+    if settings.tournament_order == "fixed":
+        return match
+    if settings.tournament_order == "alternate" and len(match) == 2:
+        id_a, id_b = match
+        return (id_b, id_a) if state.shown_first[id_b] < state.shown_first[id_a] else match
+    return tuple(random.sample(match, len(match)))
+
+
+def judgment_key(ideas: list[IdeaCard], prompt_version: str) -> str:
+    """Ключ кеша суждений: не зависит от порядка идей, меняется с карточками, промптом и моделью."""
+    cards = sorted(format_idea("", idea) for idea in ideas)
+    content = "\n".join([settings.openai_model, prompt_version, *cards])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:24]
+
+
+def load_judgment_cache() -> dict[str, list[Comparison]]:
+    cache: dict[str, list[Comparison]] = {}
+    for comparison in iter_jsonl(JUDGMENT_CACHE_FILE, Comparison):
+        cache.setdefault(comparison.judgment_key, []).append(comparison)
+    return cache
+
+
+def cached_judgment(
+    match: tuple[str, ...],
+    ideas_map: dict[str, IdeaCard],
+    cache: dict[str, list[Comparison]],
+) -> list[Comparison] | None:
+    """Сравнения из кеша (копии с новыми comparison_id) или None, если суждения нет."""
+    version = PROMPT_VERSION if len(match) == 2 else LISTWISE_PROMPT_VERSION
+    cached = cache.get(judgment_key([ideas_map[id_] for id_ in match], version))
+    if not cached:
+        return None
+    group_id = f"grp_{uuid.uuid4().hex[:10]}" if cached[0].group_id else None
+    return [
+        c.model_copy(update={
+            "comparison_id": f"cmp_{uuid.uuid4().hex[:10]}",
+            "group_id": group_id,
+            "created_at": datetime.now().isoformat(),
+        })
+        for c in cached
+    ]
+
+
+def implied_comparisons(ranked_ids: list[str], reasoning_ru: str, key: str | None = None) -> list[Comparison]:
+    """Все пары из ранжирования группы: идея выше побеждает каждую идею ниже."""
+    group_id = f"grp_{uuid.uuid4().hex[:10]}"
+    return [
+        Comparison(
+            comparison_id=f"cmp_{uuid.uuid4().hex[:10]}",
+            idea_a_id=winner,
+            idea_b_id=loser,
+            winner_id=winner,
+            reasoning_ru=reasoning_ru,
+            group_id=group_id,
+            judgment_key=key,
+        )
+        for winner, loser in combinations(ranked_ids, 2)
+    ]
+
+
+def play_match(match: tuple[str, ...], ideas_map: dict[str, IdeaCard]) -> list[Comparison]:
+    """
+    Сравнения по одному запросу к LLM: пара или ранжирование группы.
+    Идеи показываются в порядке match.
+    """
+    ideas = [ideas_map[id_] for id_ in match]
+    if len(match) == 2:
+        id_a, id_b = match
+        result = compare_ideas(*ideas)
+        if not result:
+            return []
+        return [Comparison(
+            comparison_id=f"cmp_{uuid.uuid4().hex[:10]}",
+            idea_a_id=id_a,
+            idea_b_id=id_b,
+            winner_id=result.winner_id,
+            reasoning_ru=result.reasoning_ru,
+            first_id=id_a,
+            judgment_key=judgment_key(ideas, PROMPT_VERSION),
+        )]
+    ranking = rank_ideas(ideas)
+    if not ranking:
+        return []
+    return implied_comparisons(ranking.ranked_ids, ranking.reasoning_ru, judgment_key(ideas, LISTWISE_PROMPT_VERSION))
+
+
+def save_ratings(state: TournamentState, bootstrap: bool = False) -> list[EloRating]:
+    """
+    Рейтинги Брэдли–Терри в шкале Elo. bootstrap — посчитать 95% интервалы
+    (BOOTSTRAP_SAMPLES переобучений с фиксированным seed; дорого, только в конце турнира).
+    """
+    ids, scores, _ = state.strengths(with_stderr=False)
+    elo = to_elo(scores, INITIAL_ELO)
+    low = high = [None] * len(ids)
+    if bootstrap:
+        low, high = (
+            to_elo(bound, INITIAL_ELO).tolist()
+            for bound in bootstrap_intervals(
+                ids, state.results, samples=BOOTSTRAP_SAMPLES,
+                firsts=state.firsts if settings.tournament_position_correction else None,
+            )
+        )
+    elo_ratings = [
+        EloRating(
+            idea_id=idea_id,
+            elo=float(elo[i]),
+            elo_low=low[i],
+            elo_high=high[i],
+            wins=state.wins[idea_id],
+            losses=state.losses[idea_id],
+            comparisons=state.matches(idea_id),
+        )
+        for i, idea_id in enumerate(ids)
+    ]
+    elo_ratings.sort(key=lambda e: (-e.elo, e.idea_id))
+    write_jsonl(ELO_FILE, elo_ratings)
+    return elo_ratings
+
+
+def main(clusters: list[int] | None = None, per_cluster: int = 0):
     console.print("[bold blue]Step 07: Tournament[/bold blue]")
     
     scores = read_jsonl(SCORES_FILE, ScoreCard)
@@ -132,73 +628,121 @@ def main():
         console.print("[yellow]No scores found. Run step 06 first.[/yellow]")
         return
     
-    # Мягкий фильтр: минимум 25 баллов
-    passed = [s for s in scores if s.total_score >= 25]
+    # Мягкий фильтр: минимум 25 баллов (sparse ранжирует весь пул)
+    full_pool = settings.tournament_schedule == "sparse"
+    passed = scores if full_pool else [s for s in scores if s.total_score >= MIN_TOTAL_SCORE]
     passed.sort(key=lambda s: s.total_score, reverse=True)
     
-    top_scores = passed[:TOP_N_FOR_TOURNAMENT]
-    top_ids = [s.idea_id for s in top_scores]
+    passed_ids = list(dict.fromkeys(s.idea_id for s in passed))
+    if clusters or per_cluster > 0:
+        # Только выбранные кластеры и/или не больше per_cluster лучших идей кластера,
+        # чтобы турнир не заполнялся вариациями одной темы
+        cluster_map = load_cluster_map()
+        if not cluster_map:
+            console.print("[yellow]No cluster table found, run step 05 first.[/yellow]")
+        else:
+            if clusters:
+                passed_ids = filter_by_clusters(passed_ids, cluster_map, set(clusters))
+            if per_cluster > 0:
+                passed_ids = sample_by_cluster(passed_ids, cluster_map, per_cluster)
     
-    console.print(f"Tournament with top {len(top_ids)} ideas")
-    
-    ideas_file = IDEAS_DEDUPED_FILE if IDEAS_DEDUPED_FILE.exists() else IDEAS_FILE
+    ideas_file = IDEAS_DEDUPED_FILE if jsonl_exists(IDEAS_DEDUPED_FILE) else IDEAS_FILE
     all_ideas = read_jsonl(ideas_file, IdeaCard)
     ideas_map = {i.idea_id: i for i in all_ideas}
     
-    matchups = generate_matchups(top_ids, COMPARISONS_PER_IDEA)
-    console.print(f"Generated {len(matchups)} matchups")
+    # Оценённые идеи без карточки (например, ставшие дубликатами после
+    # `bioideas recluster`) сыграть нельзя: в турнире они навсегда остались бы
+    # без матчей и блокировали бы адаптивное расписание
+    missing = [id_ for id_ in passed_ids if id_ not in ideas_map]
+    if missing:
+        console.print(f"[yellow]Skipping {len(missing)} scored ideas without a card in {ideas_file.name}[/yellow]")
+        passed_ids = [id_ for id_ in passed_ids if id_ in ideas_map]
     
-    ratings = {id_: INITIAL_ELO for id_ in top_ids}
-    wins = {id_: 0 for id_ in top_ids}
-    losses = {id_: 0 for id_ in top_ids}
+    top_ids = passed_ids if full_pool else passed_ids[:TOP_N_FOR_TOURNAMENT]
     
-    for id_a, id_b in tqdm(matchups, desc="Running tournament"):
-        idea_a = ideas_map.get(id_a)
-        idea_b = ideas_map.get(id_b)
-        
-        if not idea_a or not idea_b:
-            continue
-        
-        result = compare_ideas(idea_a, idea_b)
-        if not result:
-            continue
+    console.print(f"Tournament with {'all' if full_pool else 'top'} {len(top_ids)} ideas")
+    
+    state, replayed = replay_comparisons(top_ids)
+    console.print(
+        f"Replayed {replayed} stored comparisons "
+        f"({settings.tournament_mode} mode, {settings.tournament_schedule} schedule)"
+    )
+    
+    cache = load_judgment_cache()
+    tried: set[tuple[str, str]] = set()
+    new_requests = 0
+    cache_hits = 0
+    new_matches = 0
+    round_num = 0
+    progress = tqdm(desc="Running tournament", unit="match")
+    
+    # Каждая идея играет в раунде не больше одного матча, и рейтинг не зависит
+    # от порядка матчей, поэтому раунд сравнивается параллельно.
+    # Результаты записываются в порядке матчей раунда, а не завершения.
+    def play(match: tuple[str, ...]) -> list[Comparison]:
+        comparisons = play_match(match, ideas_map)
+        progress.update(1)
+        return comparisons
+    
+    while True:
+        matchups = next_round(state, tried)
+        if not matchups:
+            break
+        round_num += 1
+        tried.update(pair_key(a, b) for match in matchups for a, b in combinations(match, 2))
+        playable = [
+            present_order(state, m)
+            for m in (tuple(id_ for id_ in match if id_ in ideas_map) for match in matchups)
+            if len(m) >= 2
+        ]
         
-        winner_id = result.winner_id
-        loser_id = id_b if winner_id == id_a else id_a
+        results = [cached_judgment(match, ideas_map, cache) for match in playable]
+        pending = [match for match, result in zip(playable, results) if result is None]
+        progress.update(len(matchups) - len(pending))
+        with ThreadPoolExecutor(max_workers=settings.llm_concurrency) as executor:
+            fresh = iter(list(executor.map(play, pending)))
+        results = [result if result is not None else next(fresh) for result in results]
+        new_requests += len(pending)
+        cache_hits += len(playable) - len(pending)
         
-        update_elo(ratings, winner_id, loser_id)
-        wins[winner_id] = wins.get(winner_id, 0) + 1
-        losses[loser_id] = losses.get(loser_id, 0) + 1
+        for comparisons in results:
+            for comparison in comparisons:
+                state.record(comparison.idea_a_id, comparison.idea_b_id, comparison.winner_id, comparison.first_id)
+                append_jsonl(COMPARISONS_FILE, comparison)
+                new_matches += 1
+            if comparisons and comparisons[0].judgment_key not in cache:
+                cache[comparisons[0].judgment_key] = comparisons
+                for comparison in comparisons:
+                    append_jsonl(JUDGMENT_CACHE_FILE, comparison)
         
-        comparison = Comparison(
-            comparison_id=f"cmp_{uuid.uuid4().hex[:10]}",
-            idea_a_id=id_a,
-            idea_b_id=id_b,
-            winner_id=winner_id,
-            reasoning_ru=result.reasoning_ru,
-        )
-        append_jsonl(COMPARISONS_FILE, comparison)
-    
-    elo_ratings = []
-    for idea_id in top_ids:
-        elo = EloRating(
-            idea_id=idea_id,
-            elo=ratings[idea_id],
-            wins=wins.get(idea_id, 0),
-            losses=losses.get(idea_id, 0),
-            comparisons=wins.get(idea_id, 0) + losses.get(idea_id, 0),
-        )
-        elo_ratings.append(elo)
+        save_ratings(state)
+    progress.close()
     
-    elo_ratings.sort(key=lambda e: e.elo, reverse=True)
-    write_jsonl(ELO_FILE, elo_ratings)
+    elo_ratings = save_ratings(state, bootstrap=True)
+    console.print(
+        f"New matches: {new_matches} from {new_requests} LLM requests "
+        f"and {cache_hits} cached judgments in {round_num} rounds"
+    )
+    _, scores, stderr = state.strengths()
+    undecided = undecided_for_top_k(scores, stderr, settings.tournament_top_k, settings.tournament_confidence_z)
+    console.print(f"Top-{settings.tournament_top_k} membership undecided for {len(undecided)} ideas")
+    ordered = [(w, f) for (w, _), f in zip(state.results, state.firsts) if f is not None]
+    if ordered:
+        first_rate = sum(w == f for w, f in ordered) / len(ordered)
+        message = f"Position bias: first-shown idea won {first_rate:.0%} of {len(ordered)} matches"
+        if settings.tournament_position_correction:
+            message += f" (fitted advantage {state.fit(with_stderr=False)[2] * ELO_SCALE:+.0f} Elo, removed from ratings)"
+        console.print(message)
     
-    console.print(f"[green]Done![/green]")
+    console.print("[green]Done![/green]")
     console.print("\n[bold]Final Elo Rankings (Top 10):[/bold]")
     for i, elo in enumerate(elo_ratings[:10], 1):
         idea = ideas_map.get(elo.idea_id)
         title = idea.title_ru if idea else elo.idea_id
-        console.print(f"  {i}. Elo {elo.elo:.0f} ({elo.wins}W-{elo.losses}L): {title[:50]}")
+        console.print(
+            f"  {i}. Elo {elo.elo:.0f} [{elo.elo_low:.0f}–{elo.elo_high:.0f}] "
+            f"({elo.wins}W-{elo.losses}L): {title[:50]}"
+        )
 
 
 if __name__ == "__main__":
@@ -7,9 +7,10 @@ from pathlib import Path
 from tqdm import tqdm
 from rich.console import Console
 
-from ..config import PROCESSED_DIR, MEMOS_DIR
+from ..config import PROCESSED_DIR, MEMOS_DIR, settings
+from ..compression import write_text_compressed
 from ..models import IdeaCard, ScoreCard, EloRating, Nugget
-from ..storage import read_jsonl
+from ..storage import read_jsonl, jsonl_exists
 from ..llm import generate_text
 
 console = Console()
@@ -19,6 +20,7 @@ IDEAS_DEDUPED_FILE = PROCESSED_DIR / "ideas_deduped.jsonl"
 SCORES_FILE = PROCESSED_DIR / "scores.jsonl"
 ELO_FILE = PROCESSED_DIR / "elo_ratings.jsonl"
 NUGGETS_FILE = PROCESSED_DIR / "nuggets.jsonl"
+NUGGETS_DEDUPED_FILE = PROCESSED_DIR / "nuggets_deduped.jsonl"
 
 TOP_N_MEMOS = 10  # Расширено: было 5
 
@@ -69,7 +71,7 @@ SYSTEM_PROMPT = """Ты венчурный аналитик. Напиши кра
 def get_top_ideas(n: int = TOP_N_MEMOS) -> list[tuple[IdeaCard, ScoreCard | None, EloRating | None]]:
     """Получает топ-N идей по Elo (или по score, если турнира не было)."""
     
-    ideas_file = IDEAS_DEDUPED_FILE if IDEAS_DEDUPED_FILE.exists() else IDEAS_FILE
+    ideas_file = IDEAS_DEDUPED_FILE if jsonl_exists(IDEAS_DEDUPED_FILE) else IDEAS_FILE
     ideas = read_jsonl(ideas_file, IdeaCard)
     scores = read_jsonl(SCORES_FILE, ScoreCard)
     elo_ratings = read_jsonl(ELO_FILE, EloRating)
@@ -100,9 +102,19 @@ def get_top_ideas(n: int = TOP_N_MEMOS) -> list[tuple[IdeaCard, ScoreCard | None
 
 
 def get_nuggets_for_idea(idea: IdeaCard, all_nuggets: list[Nugget]) -> list[Nugget]:
-    """Находит nuggets, на которых основана идея."""
+    """
+    Находит nuggets, на которых основана идея. Nugget, схлопнутый в s03b,
+    заменяется каноническим (его evidence включает evidence дубликата).
+    """
     nugget_map = {n.nugget_id: n for n in all_nuggets}
-    return [nugget_map[nid] for nid in idea.source_nugget_ids if nid in nugget_map]
+    for nugget in all_nuggets:
+        for merged_id in nugget.merged_nugget_ids:
+            nugget_map.setdefault(merged_id, nugget)
+    found = {}
+    for nid in idea.source_nugget_ids:
+        if nid in nugget_map:
+            found.setdefault(nugget_map[nid].nugget_id, nugget_map[nid])
+    return list(found.values())
 
 
 def generate_memo(
@@ -132,6 +144,8 @@ SCORES:
 """
     
     elo_text = f"Elo: {elo.elo:.0f} ({elo.wins}W-{elo.losses}L)" if elo else ""
+    if elo and elo.elo_low is not None:
+        elo_text += f", 95% CI {elo.elo_low:.0f}–{elo.elo_high:.0f}"
     
     user_prompt = f"""IDEA CARD:
 - Title: {idea.title_ru}
@@ -171,7 +185,8 @@ def main():
         console.print("[yellow]No ideas found. Run previous steps first.[/yellow]")
         return
     
-    all_nuggets = read_jsonl(NUGGETS_FILE, Nugget)
+    # Канонические nuggets из s03b несут evidence всех схлопнутых дубликатов
+    all_nuggets = read_jsonl(NUGGETS_DEDUPED_FILE, Nugget) or read_jsonl(NUGGETS_FILE, Nugget)
     
     console.print(f"Generating memos for top {len(top_ideas)} ideas...")
     
@@ -184,7 +199,10 @@ def main():
         filename = f"{i:02d}_{safe_title}.md"
         filepath = MEMOS_DIR / filename
         
-        filepath.write_text(memo, encoding="utf-8")
+        if settings.compress_artifacts:
+            write_text_compressed(filepath, memo)
+        else:
+            filepath.write_text(memo, encoding="utf-8")
         print(f"  Saved memo {i}")
     
     print(f"Done! Memos saved to {MEMOS_DIR}")
@@ -0,0 +1,160 @@
+"""
+Пре-фильтр чанков перед s03.
+
+Логистическая регрессия на эмбеддингах чанков из Qdrant (bioideas_chunks)
+предсказывает, даст ли чанк хотя бы один nugget. Обучается на истории:
+чанки с nuggets — положительные, чанки со статусом "empty" в журнале
+извлечения — отрицательные. Интро, реклама и small talk получают низкий
+скор и не отправляются в LLM (s03 помечает их статусом "skipped").
+
+Порог задаётся settings.prefilter_threshold (0 — фильтр выключен);
+подобрать его помогает отчёт recall/экономии (`bioideas prefilter --report`).
+"""
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+from .config import PROCESSED_DIR, settings
+from .models import Chunk, Nugget, ExtractionStatus
+from .storage import read_jsonl, iter_jsonl
+
+console = Console()
+
+CHUNKS_FILE = PROCESSED_DIR / "chunks.jsonl"
+NUGGETS_FILE = PROCESSED_DIR / "nuggets.jsonl"
+LEDGER_FILE = PROCESSED_DIR / "extraction_ledger.jsonl"
+MODEL_FILE = PROCESSED_DIR / "prefilter.npz"
+
+MIN_TRAIN_CHUNKS = 50
+REPORT_THRESHOLDS = [0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5]
+
+
+def load_chunk_vectors(chunk_ids: set[str] | None = None) -> dict[str, np.ndarray]:
+    """Векторы чанков из Qdrant: chunk_id → float32 вектор (все или только chunk_ids)."""
+    from .vectorstore import get_client, iter_points
+
+    client = get_client()
+    if not client.collection_exists(settings.qdrant_chunks_collection):
+        return {}
+    vectors = {}
+    for point in iter_points(client, settings.qdrant_chunks_collection):
+        chunk_id = point["payload"].get("chunk_id", point["id"])
+        if chunk_ids is None or chunk_id in chunk_ids:
+            vectors[chunk_id] = np.asarray(point["vector"], dtype=np.float32)
+    return vectors
+
+
+def load_labels() -> dict[str, int]:
+    """
+    Разметка по истории s03: chunk_id → число nuggets.
+    Для чанков из журнала извлечения источник — журнал (ok/empty). Чанки без
+    записи в журнале (старые запуски) размечаются числом nuggets в nuggets.jsonl
+    по evidence[0].chunk_id. Почти-дубликаты (nuggets скопированы с канонического
+    чанка без вызова LLM) не используются.
+    """
+    duplicates = {chunk.chunk_id for chunk in iter_jsonl(CHUNKS_FILE, Chunk) if chunk.duplicate_of}
+    labels: dict[str, int] = {}
+    in_ledger: set[str] = set()
+    for entry in read_jsonl(LEDGER_FILE, ExtractionStatus):
+        in_ledger.add(entry.chunk_id)
+        if entry.status in ("ok", "empty") and entry.chunk_id not in duplicates:
+            labels[entry.chunk_id] = entry.nuggets
+        else:
+            labels.pop(entry.chunk_id, None)
+    for nugget in iter_jsonl(NUGGETS_FILE, Nugget):
+        if not nugget.evidence:
+            continue
+        chunk_id = nugget.evidence[0].chunk_id
+        if chunk_id not in in_ledger and chunk_id not in duplicates:
+            labels[chunk_id] = labels.get(chunk_id, 0) + 1
+    return labels
+
+
+def _training_set() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(X, y, число nuggets) для размеченных чанков, у которых есть вектор."""
+    labels = load_labels()
+    vectors = load_chunk_vectors(set(labels))
+    ids = sorted(vectors)
+    if not ids:
+        return np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    X = np.stack([vectors[i] for i in ids])
+    counts = np.array([labels[i] for i in ids])
+    return X, (counts > 0).astype(int), counts
+
+
+def _check_training_set(y: np.ndarray) -> None:
+    if len(y) < MIN_TRAIN_CHUNKS or y.min() == y.max():
+        raise RuntimeError(
+            f"Need at least {MIN_TRAIN_CHUNKS} labelled chunks of both classes "
+            f"(have {len(y)}, positive {int(y.sum())}). Run step 03 without the prefilter first."
+        )
+
+
+def _new_classifier():
+    from sklearn.linear_model import LogisticRegression
+    return LogisticRegression(C=1.0, class_weight="balanced", max_iter=1000)
+
+
+def train() -> dict:
+    """Обучает классификатор на истории s03 и сохраняет веса в prefilter.npz."""
+    X, y, _ = _training_set()
+    _check_training_set(y)
+    clf = _new_classifier().fit(X, y)
+    np.savez(MODEL_FILE, coef=clf.coef_[0].astype(np.float32), intercept=clf.intercept_[0])
+    stats = {"chunks": len(y), "positive": int(y.sum())}
+    console.print(
+        f"[green]Prefilter trained on {stats['chunks']} chunks "
+        f"({stats['positive']} with nuggets) → {MODEL_FILE.name}[/green]"
+    )
+    return stats
+
+
+def score_chunks(chunk_ids: list[str]) -> dict[str, float]:
+    """
+    Вероятность, что чанк даст nuggets. Чанки без вектора в Qdrant
+    в результат не попадают (их s03 обрабатывает как обычно).
+    """
+    if not MODEL_FILE.exists() or not chunk_ids:
+        return {}
+    model = np.load(MODEL_FILE)
+    vectors = load_chunk_vectors(set(chunk_ids))
+    ids = [c for c in chunk_ids if c in vectors]
+    if not ids:
+        return {}
+    logits = np.stack([vectors[i] for i in ids]) @ model["coef"] + float(model["intercept"])
+    probs = 1.0 / (1.0 + np.exp(-logits))
+    return dict(zip(ids, probs.tolist()))
+
+
+def report(thresholds: list[float] = REPORT_THRESHOLDS, folds: int = 5) -> list[dict]:
+    """
+    Recall/экономия по порогам на кросс-валидации:
+    какая доля вызовов LLM отсекается и какая доля полезных чанков/nuggets теряется.
+    """
+    from sklearn.model_selection import StratifiedKFold, cross_val_predict
+
+    X, y, counts = _training_set()
+    _check_training_set(y)
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=0)
+    probs = cross_val_predict(_new_classifier(), X, y, cv=cv, method="predict_proba")[:, 1]
+
+    rows = []
+    for threshold in thresholds:
+        skipped = probs < threshold
+        rows.append({
+            "threshold": threshold,
+            "calls_saved": float(skipped.mean()),
+            "chunk_recall": float(y[~skipped].sum() / y.sum()),
+            "nugget_recall": float(counts[~skipped].sum() / counts.sum()),
+        })
+
+    table = Table(title=f"Prefilter: {len(y)} chunks, {int(y.sum())} with nuggets ({folds}-fold CV)")
+    for name in ["threshold", "LLM calls saved", "chunk recall", "nugget recall"]:
+        table.add_column(name)
+    for row in rows:
+        table.add_row(
+            f"{row['threshold']:.2f}", f"{row['calls_saved']:.1%}",
+            f"{row['chunk_recall']:.1%}", f"{row['nugget_recall']:.1%}",
+        )
+    console.print(table)
+    return rows
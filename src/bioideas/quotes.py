@@ -0,0 +1,143 @@
+"""
+Выравнивание цитат Evidence.quote на текст чанка.
+
+Текст чанка нормализуется один раз: нижний регистр, слова \\w+ через один
+пробел (пунктуация, кавычки, тире и переносы строк не влияют на совпадение),
+для каждого слова запоминается его позиция в исходном тексте. Все цитаты
+чанка ищутся в нормализованном тексте точным поиском, для ненайденных —
+ограниченное нечёткое выравнивание по окну слов. Результат — позиции
+цитаты в исходном тексте чанка (char_start, char_end).
+"""
+import re
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from itertools import accumulate
+
+_WORD_RE = re.compile(r"\w+")
+_SPLIT_RE = re.compile(r"(\W+)")
+
+MIN_QUOTE_WORDS = 3
+FUZZY_MIN_RATIO = 0.8
+# Нечёткое выравнивание пробуется только для цитат до стольких слов
+FUZZY_MAX_WORDS = 60
+
+
+@dataclass
+class QuoteMatch:
+    """Найденная цитата: позиции в исходном тексте и степень совпадения."""
+    char_start: int
+    char_end: int
+    score: float
+
+    @property
+    def exact(self) -> bool:
+        return self.score == 1.0
+
+
+class NormalizedText:
+    """Текст чанка, нормализованный для поиска цитат, с картой позиций."""
+
+    def __init__(self, text: str):
+        self.text = text
+        # Слова и разделители чередуются: [слово, разделитель, слово, ...]
+        parts = _SPLIT_RE.split(text)
+        self._first = 0 if parts[0] else 2
+        self._offsets = list(accumulate(map(len, parts), initial=0))
+        words = parts[self._first::2]
+        if words and not words[-1]:
+            words.pop()
+        self.n_words = len(words)
+        # " w1 w2 ... wn ": номер слова по позиции — число пробелов перед ней
+        self.joined = " " + " ".join(words).lower() + " "
+        self._words: list[str] | None = None
+
+    @property
+    def words(self) -> list[str]:
+        if self._words is None:
+            self._words = self.joined.split()
+        return self._words
+
+    def _span(self, first: int, last: int) -> tuple[int, int]:
+        """Позиции в исходном тексте для слов first..last включительно."""
+        return (
+            self._offsets[self._first + 2 * first],
+            self._offsets[self._first + 2 * last + 1],
+        )
+
+    def find_exact(self, quote_words: list[str]) -> QuoteMatch | None:
+        pos = self.joined.find(" " + " ".join(quote_words) + " ")
+        if pos < 0:
+            return None
+        first = self.joined.count(" ", 0, pos + 1) - 1
+        start, end = self._span(first, first + len(quote_words) - 1)
+        return QuoteMatch(start, end, 1.0)
+
+    def find_fuzzy(self, quote_words: list[str]) -> QuoteMatch | None:
+        """
+        Окно из len(quote) слов с наибольшим числом общих слов (скользящий счётчик),
+        затем SequenceMatcher по окну, расширенному на четверть длины цитаты с каждой стороны.
+        """
+        k = len(quote_words)
+        n = self.n_words
+        if not n or k > FUZZY_MAX_WORDS:
+            return None
+
+        needed: dict[str, int] = {}
+        for word in quote_words:
+            needed[word] = needed.get(word, 0) + 1
+        window: dict[str, int] = {}
+        overlap = best_overlap = best_start = 0
+        for i, word in enumerate(self.words):
+            if word in needed:
+                window[word] = window.get(word, 0) + 1
+                if window[word] <= needed[word]:
+                    overlap += 1
+            if i >= k:
+                old = self.words[i - k]
+                if old in needed:
+                    if window[old] <= needed[old]:
+                        overlap -= 1
+                    window[old] -= 1
+            if overlap > best_overlap:
+                best_overlap, best_start = overlap, max(0, i - k + 1)
+        if best_overlap < FUZZY_MIN_RATIO * k:
+            return None
+
+        pad = max(1, k // 4)
+        lo, hi = max(0, best_start - pad), min(n, best_start + k + pad)
+        matcher = SequenceMatcher(None, self.words[lo:hi], quote_words, autojunk=False)
+        blocks = [b for b in matcher.get_matching_blocks() if b.size]
+        if not blocks:
+            return None
+        first = lo + blocks[0].a
+        last = lo + blocks[-1].a + blocks[-1].size - 1
+        matched = sum(b.size for b in blocks)
+        score = 2.0 * matched / (last - first + 1 + k)
+        if score < FUZZY_MIN_RATIO:
+            return None
+        start, end = self._span(first, last)
+        return QuoteMatch(start, end, round(score, 3))
+
+
+def quote_words(quote: str) -> list[str]:
+    """Слова цитаты в той же нормализации, что и NormalizedText."""
+    return " ".join(_WORD_RE.findall(quote)).lower().split()
+
+
+def align_quotes(text: str | NormalizedText, quotes: list[str]) -> list[QuoteMatch | None]:
+    """
+    Выравнивает все цитаты одного чанка. Текст нормализуется один раз.
+    Для коротких цитат (< MIN_QUOTE_WORDS слов) нечёткий поиск не делается.
+    """
+    norm = text if isinstance(text, NormalizedText) else NormalizedText(text)
+    results = []
+    for quote in quotes:
+        words = quote_words(quote)
+        if not words:
+            results.append(None)
+            continue
+        match = norm.find_exact(words)
+        if match is None and len(words) >= MIN_QUOTE_WORDS:
+            match = norm.find_fuzzy(words)
+        results.append(match)
+    return results
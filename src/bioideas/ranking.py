@@ -0,0 +1,224 @@
+"""
+Модель Брэдли–Терри для результатов турнира s07.
+
+P(i побеждает j) = σ(s_i − s_j). Силы s находятся методом Ньютона по
+логарифму правдоподобия с гауссовым априорным распределением (prior —
+точность), поэтому у идей без поражений или без побед оценка конечна.
+Стандартные ошибки — из обратной матрицы Гессе (приближение Лапласа),
+доверительные интервалы для отчёта — бутстрэпом по матчам. Турнир по
+всему пулу идей решается в разреженной форме (bradley_terry_sparse):
+матчей O(n), а не O(n²).
+Оценка зависит только от набора матчей, не от их порядка.
+
+Если известно, какая идея была показана в промпте первой, модель
+учитывает смещение позиции: P(первая побеждает) = σ(s_first − s_second + h),
+h оценивается вместе с силами и в них не попадает.
+"""
+import numpy as np
+
+ELO_SCALE = 400 / np.log(10)
+# До стольких идей стандартные ошибки считаются по полному обратному Гессиану
+DENSE_STDERR_MAX = 2000
+
+
+def win_matrix(idea_ids: list[str], results: list[tuple[str, str]]) -> np.ndarray:
+    """wins[i, j] — сколько раз idea_ids[i] победила idea_ids[j]; results — (победитель, проигравший)."""
+    pairs = _result_pairs(idea_ids, results)
+    wins = np.zeros((len(idea_ids), len(idea_ids)))
+    np.add.at(wins, (pairs[:, 0], pairs[:, 1]), 1)
+    return wins
+
+
+def _result_pairs(idea_ids: list[str], results: list[tuple[str, str]]) -> np.ndarray:
+    """Матчи как массив индексов (победитель, проигравший); матчи с чужими идеями отбрасываются."""
+    index = {id_: i for i, id_ in enumerate(idea_ids)}
+    return np.array(
+        [(index[w], index[l]) for w, l in results if w in index and l in index],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+
+
+def bradley_terry(
+    wins: np.ndarray,
+    prior: float = 0.1,
+    max_iter: int = 50,
+    tol: float = 1e-8,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Силы (логиты, среднее 0) и их стандартные ошибки по матрице побед."""
+    n = len(wins)
+    if n == 0:
+        return np.zeros(0), np.zeros(0)
+    games = wins + wins.T
+    won = wins.sum(axis=1)
+    scores = np.zeros(n)
+    for _ in range(max_iter):
+        p = 1.0 / (1.0 + np.exp(scores[None, :] - scores[:, None]))
+        grad = won - (games * p).sum(axis=1) - prior * scores
+        info = games * p * p.T
+        hessian = info - np.diag(info.sum(axis=1) + prior)
+        step = np.linalg.solve(hessian, grad)
+        scores -= step
+        if np.abs(step).max() < tol:
+            break
+    p = 1.0 / (1.0 + np.exp(scores[None, :] - scores[:, None]))
+    info = games * p * p.T
+    hessian = info - np.diag(info.sum(axis=1) + prior)
+    stderr = np.sqrt(np.clip(np.diag(np.linalg.inv(-hessian)), 0, None))
+    return scores - scores.mean(), stderr
+
+
+def _match_arrays(
+    idea_ids: list[str],
+    results: list[tuple[str, str]],
+    firsts: list[str | None] | None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Матчи как массивы индексов победителя и проигравшего и знак позиции:
+    +1 — победитель был показан первым, −1 — проигравший, 0 — порядок неизвестен.
+    """
+    index = {id_: i for i, id_ in enumerate(idea_ids)}
+    firsts = firsts if firsts is not None else [None] * len(results)
+    rows = [
+        (index[w], index[l], 1 if f == w else -1 if f == l else 0)
+        for (w, l), f in zip(results, firsts) if w in index and l in index
+    ]
+    winners, losers, order = np.array(rows, dtype=np.int64).reshape(-1, 3).T
+    return winners, losers, order.astype(np.float64)
+
+
+def bradley_terry_sparse(
+    winners: np.ndarray,
+    losers: np.ndarray,
+    order: np.ndarray,
+    n: int,
+    prior: float = 0.1,
+    advantage_prior: float = 1.0,
+    max_iter: int = 50,
+    tol: float = 1e-8,
+    with_stderr: bool = True,
+) -> tuple[np.ndarray, np.ndarray | None, float]:
+    """
+    Брэдли–Терри по списку матчей: P(победа) = σ(s_w − s_l + order·h).
+    Гессиан разреженный (лапласиан графа сравнений + prior), шаг Ньютона —
+    сопряжённые градиенты, поэтому память и время линейны по числу матчей.
+    h оценивается, только если порядок известен хотя бы для одного матча.
+    Стандартные ошибки — из обратного Гессиана при n ≤ DENSE_STDERR_MAX,
+    иначе по его диагонали (без ковариаций, немного занижены).
+    with_stderr=False пропускает их расчёт (бутстрэп, промежуточные рейтинги).
+    Возвращает (силы со средним 0, стандартные ошибки или None, h).
+    """
+    from scipy import sparse
+    from scipy.sparse.linalg import cg
+
+    if n == 0:
+        return np.zeros(0), np.zeros(0), 0.0
+    fit_advantage = bool(np.any(order))
+    dim = n + 1 if fit_advantage else n
+    theta = np.zeros(dim)
+    
+    def newton_terms(theta: np.ndarray) -> tuple[np.ndarray, sparse.csr_matrix]:
+        """Градиент лог-правдоподобия и информационная матрица (−Гессиан)."""
+        scores, advantage = theta[:n], theta[n] if fit_advantage else 0.0
+        z = scores[winners] - scores[losers] + order * advantage
+        residual = 1.0 / (1.0 + np.exp(z))        # σ(−z)
+        weight = residual * (1.0 - residual)      # σ(z)·σ(−z)
+        grad = np.zeros(dim)
+        grad[:n] = np.bincount(winners, residual, n) - np.bincount(losers, residual, n) - prior * theta[:n]
+        rows = [winners, losers, winners, losers]
+        cols = [winners, losers, losers, winners]
+        vals = [weight, weight, -weight, -weight]
+        if fit_advantage:
+            grad[n] = order @ residual - advantage_prior * theta[n]
+            h = np.full(len(winners), n)
+            rows += [winners, h, losers, h, h[:1]]
+            cols += [h, winners, h, losers, h[:1]]
+            vals += [order * weight, order * weight, -order * weight, -order * weight, [order ** 2 @ weight]]
+        info = sparse.coo_matrix(
+            (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(dim, dim)
+        ).tocsr()
+        ridge = np.full(dim, prior)
+        if fit_advantage:
+            ridge[n] = advantage_prior
+        return grad, info + sparse.diags(ridge)
+    
+    for _ in range(max_iter):
+        grad, info = newton_terms(theta)
+        step, _ = cg(info, grad, rtol=1e-10, maxiter=10 * dim)
+        theta += step
+        if np.abs(step).max() < tol:
+            break
+    stderr = None
+    if with_stderr:
+        _, info = newton_terms(theta)
+        if dim <= DENSE_STDERR_MAX:
+            variance = np.diag(np.linalg.inv(info.toarray()))
+        else:
+            variance = 1.0 / info.diagonal()
+        stderr = np.sqrt(np.clip(variance[:n], 0, None))
+    scores = theta[:n]
+    return scores - scores.mean(), stderr, float(theta[n]) if fit_advantage else 0.0
+
+
+def fit_results(
+    idea_ids: list[str],
+    results: list[tuple[str, str]],
+    firsts: list[str | None] | None = None,
+    with_stderr: bool = True,
+) -> tuple[np.ndarray, np.ndarray | None, float]:
+    """
+    Силы, стандартные ошибки и смещение позиции по списку матчей
+    (bradley_terry_sparse). Без firsts, или если порядок не известен ни для
+    одного матча, смещение не оценивается и h = 0.
+    """
+    winners, losers, order = _match_arrays(idea_ids, results, firsts)
+    return bradley_terry_sparse(winners, losers, order, len(idea_ids), with_stderr=with_stderr)
+
+
+def undecided_for_top_k(scores: np.ndarray, stderr: np.ndarray, k: int, z: float) -> np.ndarray:
+    """
+    Индексы идей, принадлежность которых к top-k не определена с уровнем z:
+    доверительный интервал s ± z·se пересекает границу между k-й и (k+1)-й силой.
+    """
+    if len(scores) <= k:
+        return np.zeros(0, dtype=int)
+    ordered = np.sort(scores)[::-1]
+    boundary = (ordered[k - 1] + ordered[k]) / 2
+    return np.flatnonzero(np.abs(scores - boundary) < z * stderr)
+
+
+def to_elo(scores: np.ndarray, center: float = 1500.0) -> np.ndarray:
+    """Логиты Брэдли–Терри в шкалу Elo (разница 400 — шансы 10:1)."""
+    return center + scores * ELO_SCALE
+
+
+def bootstrap_intervals(
+    idea_ids: list[str],
+    results: list[tuple[str, str]],
+    samples: int = 200,
+    level: float = 0.95,
+    seed: int = 0,
+    firsts: list[str | None] | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Бутстрэп-интервалы сил: матчи пересэмплируются с возвращением,
+    модель (fit_results) переобучается на каждой выборке.
+    Возвращает (нижняя, верхняя) границы в логитах.
+    """
+    n = len(idea_ids)
+    firsts = firsts if firsts is not None else [None] * len(results)
+    known = set(idea_ids)
+    matches = [(w, l, f) for (w, l), f in zip(results, firsts) if w in known and l in known]
+    if not matches:
+        return np.zeros(n), np.zeros(n)
+
+    # Канонический порядок матчей: интервалы не зависят от порядка записи
+    matches.sort(key=lambda m: (m[0], m[1], m[2] or ""))
+    rng = np.random.default_rng(seed)
+    draws = np.empty((samples, n))
+    for b in range(samples):
+        sample = [matches[i] for i in rng.integers(0, len(matches), size=len(matches))]
+        draws[b] = fit_results(
+            idea_ids, [(w, l) for w, l, _ in sample], [f for _, _, f in sample], with_stderr=False
+        )[0]
+    tail = (1 - level) / 2 * 100
+    return np.percentile(draws, tail, axis=0), np.percentile(draws, 100 - tail, axis=0)
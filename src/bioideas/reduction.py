@@ -0,0 +1,68 @@
+"""
+Снижение размерности эмбеддингов перед кластеризацией HDBSCAN.
+
+Плотностная кластеризация на 3072-мерных векторах медленная (деревья
+ближайших соседей вырождаются в перебор) и плохо различает плотность:
+в такой размерности все попарные расстояния почти одинаковы. Векторы
+нормируются и сжимаются до settings.cluster_dims измерений:
+
+- pca  — sklearn PCA (randomized SVD), быстро и детерминированно;
+- umap — UMAP с косинусной метрикой, лучше сохраняет локальную
+  структуру, но медленнее (нужен umap-learn: pip install -e .[umap]);
+- none — HDBSCAN на исходных векторах.
+
+Обученный редуктор сохраняется вместе с моделью HDBSCAN, чтобы новые идеи
+переводились в то же пространство (transform).
+"""
+import numpy as np
+
+from .similarity import normalize_rows
+
+REDUCERS = ("pca", "umap", "none")
+
+
+def _umap():
+    """Лениво импортирует umap (опциональная зависимость)."""
+    try:
+        import umap
+    except ImportError as e:
+        raise RuntimeError(
+            "UMAP reduction requires the 'umap-learn' package: pip install -e .[umap]"
+        ) from e
+    return umap
+
+
+def make_reducer(method: str, dims: int, n_samples: int):
+    """Необученный редуктор; None — снижать размерность не нужно."""
+    if method not in REDUCERS:
+        raise ValueError(f"Unknown reducer {method!r}, expected one of {REDUCERS}")
+    # PCA и UMAP требуют, чтобы компонент было меньше числа точек
+    dims = min(dims, n_samples - 2)
+    if method == "none" or dims < 2:
+        return None
+    if method == "pca":
+        from sklearn.decomposition import PCA
+        return PCA(n_components=dims, svd_solver="randomized", random_state=42)
+    return _umap().UMAP(
+        n_components=dims,
+        n_neighbors=15,
+        min_dist=0.0,
+        metric="cosine",
+    )
+
+
+def fit_reduce(embeddings, method: str, dims: int):
+    """Обучает редуктор на эмбеддингах. Возвращает (редуктор или None, матрица для HDBSCAN)."""
+    matrix = normalize_rows(embeddings)
+    reducer = make_reducer(method, dims, len(matrix))
+    if reducer is None:
+        return None, matrix.astype(np.float64)
+    return reducer, np.asarray(reducer.fit_transform(matrix), dtype=np.float64)
+
+
+def reduce(reducer, embeddings) -> np.ndarray:
+    """Переводит новые эмбеддинги в пространство обученного редуктора."""
+    matrix = normalize_rows(embeddings)
+    if reducer is None:
+        return matrix.astype(np.float64)
+    return np.asarray(reducer.transform(matrix), dtype=np.float64)
@@ -0,0 +1,213 @@
+"""
+Предсказание оценок s06 по эмбеддингам идей.
+
+kNN (косинус) по идеям, которые уже оценил LLM: каждый критерий — взвешенное
+по близости среднее соседей, риски — взвешенная мода. Уверенность —
+разброс total_score соседей и их средняя близость к идее. Эмбеддинги берутся
+из кеша s05 (idea_embeddings.npz), так что для уже дедуплицированных идей
+запросов к API нет.
+
+Идея уходит в LLM, если предсказание неуверенное (разброс больше
+settings.score_predictor_max_std или соседи дальше
+settings.score_predictor_min_similarity) либо оно близко к порогу турнира
+(total_score ≥ 25) или к нокаут-фильтрам s06 — там ошибка меняет судьбу идеи.
+Согласие с LLM на отложенных идеях — `bioideas score-predictor`.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from rich.console import Console
+from rich.table import Table
+
+from .config import PROCESSED_DIR, settings
+from .models import IdeaCard, ScoreCard
+from .storage import read_jsonl, jsonl_exists
+from .similarity import normalize_rows
+
+console = Console()
+
+SCORES_FILE = PROCESSED_DIR / "scores.jsonl"
+IDEAS_FILE = PROCESSED_DIR / "ideas.jsonl"
+IDEAS_DEDUPED_FILE = PROCESSED_DIR / "ideas_deduped.jsonl"
+
+N_NEIGHBOURS = 10
+MIN_TRAIN_IDEAS = 50
+CRITERIA = [
+    "score_horizon",
+    "score_blue_ocean",
+    "score_solo_start",
+    "score_community_6m",
+    "score_exit_2_3y",
+]
+RISKS = ["data_access_risk", "regulatory_risk", "execution_risk"]
+REPORT_MAX_STD = [1.5, 2.0, 2.5, 3.0, 4.0, float("inf")]
+
+
+@dataclass
+class ScorePrediction:
+    """Предсказанная оценка идеи и её уверенность."""
+    card: ScoreCard
+    criteria: dict[str, float]
+    total: float
+    std: float
+    similarity: float
+
+
+def idea_embeddings(ideas: list[IdeaCard]) -> np.ndarray:
+    """Эмбеддинги идей в том же виде, что и в s05 (общий кеш)."""
+    from .embeddings import embed_texts_cached
+    from .pipeline.s05_dedupe_cluster import EMBEDDING_CACHE_FILE, create_idea_embedding_text
+
+    return embed_texts_cached([create_idea_embedding_text(i) for i in ideas], EMBEDDING_CACHE_FILE)
+
+
+class ScorePredictor:
+    """kNN по оценённым LLM идеям."""
+
+    def __init__(self, embeddings, scores: list[ScoreCard], k: int = N_NEIGHBOURS):
+        self.matrix = normalize_rows(embeddings)
+        self.scores = scores
+        self.k = min(k, len(scores))
+        self.values = np.array([[getattr(s, c) for c in CRITERIA] for s in scores], dtype=np.float64)
+
+    def predict(self, idea_ids: list[str], embeddings) -> list[ScorePrediction]:
+        sims = normalize_rows(embeddings) @ self.matrix.T
+        top = np.argpartition(-sims, self.k - 1, axis=1)[:, :self.k]
+        predictions = []
+        for row, idea_id in enumerate(idea_ids):
+            idx = top[row]
+            weights = np.clip(sims[row, idx], 0, None) + 1e-6
+            weights = weights / weights.sum()
+            criteria = weights @ self.values[idx]
+            totals = self.values[idx].sum(axis=1)
+            total = float(weights @ totals)
+            std = float(np.sqrt(weights @ (totals - total) ** 2))
+
+            risks = {}
+            for risk in RISKS:
+                votes: dict[str, float] = {}
+                for w, i in zip(weights, idx):
+                    level = getattr(self.scores[i], risk)
+                    votes[level] = votes.get(level, 0.0) + w
+                risks[risk] = max(votes, key=votes.get)
+
+            rounded = {c: int(np.clip(round(v), 1, 10)) for c, v in zip(CRITERIA, criteria)}
+            card = ScoreCard(
+                idea_id=idea_id,
+                **rounded,
+                total_score=sum(rounded.values()),
+                **risks,
+                rationale_ru=f"Оценка предсказана по {len(idx)} похожим идеям (разброс ±{std:.1f}).",
+                predicted=True,
+            )
+            predictions.append(ScorePrediction(
+                card=card,
+                criteria=dict(zip(CRITERIA, criteria.tolist())),
+                total=total,
+                std=std,
+                similarity=float(sims[row, idx].mean()),
+            ))
+        return predictions
+
+
+def _shifted_card(prediction: ScorePrediction, delta: float) -> ScoreCard:
+    card = prediction.card.model_copy()
+    for c, v in prediction.criteria.items():
+        setattr(card, c, int(np.clip(round(v + delta), 1, 10)))
+    return card
+
+
+def needs_llm(prediction: ScorePrediction, max_std: float | None = None) -> str | None:
+    """Причина отправить идею в LLM или None, если предсказанию можно верить."""
+    from .pipeline.s06_score import apply_knockout_filters
+    from .pipeline.s07_tournament import MIN_TOTAL_SCORE
+
+    max_std = settings.score_predictor_max_std if max_std is None else max_std
+    if prediction.similarity < settings.score_predictor_min_similarity:
+        return "no close neighbours"
+    if prediction.std > max_std:
+        return "uncertain"
+    if abs(prediction.total - MIN_TOTAL_SCORE) < settings.score_predictor_margin:
+        return "near tournament threshold"
+    # Нокаут-фильтр решает по-разному при оценках на балл ниже и выше предсказанных
+    low, high = _shifted_card(prediction, -1), _shifted_card(prediction, 1)
+    if bool(apply_knockout_filters([low])[0]) != bool(apply_knockout_filters([high])[0]):
+        return "near knockout"
+    return None
+
+
+def training_set(ideas: list[IdeaCard]) -> tuple[list[IdeaCard], list[ScoreCard]]:
+    """Идеи с оценкой LLM (предсказанные оценки в обучение не идут)."""
+    by_id = {i.idea_id: i for i in ideas}
+    scored = {}
+    for score in read_jsonl(SCORES_FILE, ScoreCard):
+        if not score.predicted and score.idea_id in by_id:
+            scored[score.idea_id] = score
+    return [by_id[i] for i in scored], list(scored.values())
+
+
+def load_predictor(ideas: list[IdeaCard]) -> ScorePredictor | None:
+    """Предиктор по всем оценённым LLM идеям; None, если их меньше MIN_TRAIN_IDEAS."""
+    train_ideas, train_scores = training_set(ideas)
+    if len(train_scores) < MIN_TRAIN_IDEAS:
+        return None
+    return ScorePredictor(idea_embeddings(train_ideas), train_scores)
+
+
+def _load_ideas() -> list[IdeaCard]:
+    ideas_file = IDEAS_DEDUPED_FILE if jsonl_exists(IDEAS_DEDUPED_FILE) else IDEAS_FILE
+    return read_jsonl(ideas_file, IdeaCard)
+
+
+def report(folds: int = 5, max_stds: list[float] = REPORT_MAX_STD) -> list[dict]:
+    """
+    Согласие с LLM на кросс-валидации: для каждой отложенной идеи предсказание
+    строится по остальным фолдам. По порогам разброса — доля сэкономленных
+    вызовов и, среди идей, которым предсказанию поверили, MAE total_score и
+    совпадение решений «проходит в турнир» и «проходит нокаут-фильтры».
+    """
+    from sklearn.model_selection import KFold
+    from .pipeline.s06_score import apply_knockout_filters
+    from .pipeline.s07_tournament import MIN_TOTAL_SCORE
+
+    ideas, scores = training_set(_load_ideas())
+    if len(scores) < MIN_TRAIN_IDEAS:
+        raise RuntimeError(f"Need at least {MIN_TRAIN_IDEAS} LLM-scored ideas (have {len(scores)}).")
+    embeddings = idea_embeddings(ideas)
+
+    predictions: list[ScorePrediction | None] = [None] * len(scores)
+    for train_idx, test_idx in KFold(n_splits=folds, shuffle=True, random_state=0).split(embeddings):
+        predictor = ScorePredictor(embeddings[train_idx], [scores[i] for i in train_idx])
+        fold = predictor.predict([scores[i].idea_id for i in test_idx], embeddings[test_idx])
+        for i, prediction in zip(test_idx, fold):
+            predictions[i] = prediction
+
+    def passes(card: ScoreCard) -> tuple[bool, bool]:
+        return card.total_score >= MIN_TOTAL_SCORE, bool(apply_knockout_filters([card])[0])
+
+    actual = [passes(s) for s in scores]
+    predicted = [passes(p.card) for p in predictions]
+    rows = []
+    for max_std in max_stds:
+        trusted = [i for i, p in enumerate(predictions) if needs_llm(p, max_std) is None]
+        row = {"max_std": max_std, "calls_saved": len(trusted) / len(scores), "trusted": len(trusted)}
+        if trusted:
+            row["mae"] = float(np.mean([abs(predictions[i].card.total_score - scores[i].total_score) for i in trusted]))
+            row["tournament_agree"] = float(np.mean([predicted[i][0] == actual[i][0] for i in trusted]))
+            row["knockout_agree"] = float(np.mean([predicted[i][1] == actual[i][1] for i in trusted]))
+        rows.append(row)
+
+    overall_mae = float(np.mean([abs(p.card.total_score - s.total_score) for p, s in zip(predictions, scores)]))
+    table = Table(title=f"Score predictor: {len(scores)} LLM-scored ideas ({folds}-fold CV, MAE on all {overall_mae:.2f})")
+    for name in ["max std", "LLM calls saved", "trusted", "MAE total", "tournament agree", "knockout agree"]:
+        table.add_column(name)
+    for row in rows:
+        has = "mae" in row
+        table.add_row(
+            f"{row['max_std']:.1f}", f"{row['calls_saved']:.1%}", str(row["trusted"]),
+            f"{row['mae']:.2f}" if has else "-",
+            f"{row['tournament_agree']:.1%}" if has else "-",
+            f"{row['knockout_agree']:.1%}" if has else "-",
+        )
+    console.print(table)
+    return rows
@@ -0,0 +1,70 @@
+"""
+Поиск близких векторов без полной матрицы сходства.
+
+Векторы нормируются и переводятся в float32, матрица сходства считается
+блоками по BLOCK_SIZE строк — память O(BLOCK_SIZE × n) вместо O(n²).
+Пары, у которых float32-сходство отличается от порога меньше чем на
+EXACT_MARGIN, пересчитываются в float64, поэтому решения совпадают с
+полной float64-матрицей (sklearn cosine_similarity).
+"""
+import numpy as np
+
+BLOCK_SIZE = 512
+EXACT_MARGIN = 1e-4
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """L2-нормировка строк (float32); нулевые строки остаются нулевыми."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.size == 0:
+        return matrix.reshape(len(matrix), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def greedy_duplicates(
+    vectors,
+    threshold: float,
+    groups: list | None = None,
+    block_size: int = BLOCK_SIZE,
+) -> dict[int, int]:
+    """
+    Жадная дедупликация в порядке входа: каждый ещё не помеченный элемент i
+    забирает все последующие непомеченные j с косинусной близостью ≥ threshold.
+    groups — необязательная метка на элемент: сравниваются только элементы
+    с одинаковой меткой. Возвращает {индекс дубликата: индекс канонического}.
+    """
+    original = np.asarray(vectors)
+    matrix = normalize_rows(original)
+    n = len(matrix)
+    if n < 2:
+        return {}
+    labels = np.asarray(groups) if groups is not None else None
+    # Нормы в float64 — для точного пересчёта пар у порога
+    norms = np.sqrt(np.einsum("ij,ij->i", original, original, dtype=np.float64))
+    norms[norms == 0] = 1.0
+
+    seen = np.zeros(n, dtype=bool)
+    duplicates: dict[int, int] = {}
+    for lo in range(0, n, block_size):
+        hi = min(n, lo + block_size)
+        sims = matrix[lo:hi] @ matrix[lo:].T
+        for i in range(lo, hi):
+            if seen[i]:
+                continue
+            row = sims[i - lo, i - lo + 1:]
+            border = np.flatnonzero(np.abs(row - threshold) < EXACT_MARGIN)
+            if len(border):
+                j = border + i + 1
+                exact = original[j].astype(np.float64) @ original[i].astype(np.float64)
+                row[border] = exact / (norms[j] * norms[i])
+            mask = (row >= threshold) & ~seen[i + 1:]
+            if labels is not None:
+                mask &= labels[i + 1:] == labels[i]
+            candidates = np.flatnonzero(mask) + i + 1
+            if len(candidates):
+                seen[candidates] = True
+                for j in candidates.tolist():
+                    duplicates[j] = i
+    return duplicates
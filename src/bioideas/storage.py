@@ -1,11 +1,31 @@
-"""Утилиты для работы с JSONL файлами."""
+"""Утилиты для работы с JSONL файлами.
+
+Артефакт (например, nuggets.jsonl) может храниться двумя способами:
+- одним файлом `nuggets.jsonl`;
+- по шардам `nuggets/<doc_id>.jsonl` + `nuggets/_manifest.json`.
+
+Любой из этих файлов может быть дополнительно сжат в zstd (`*.jsonl.zst`,
+см. compression.py). Читатели (`read_jsonl`, `iter_jsonl`, `load_processed_ids`)
+видят объединение всех вариантов, поэтому стадии пайплайна не зависят
+от выбранной раскладки.
+"""
 import json
+import os
+import shutil
+from collections import defaultdict
+from datetime import datetime
 from pathlib import Path
-from typing import TypeVar
+from typing import Iterable, Iterator, TypeVar
 from pydantic import BaseModel
 
+from .compression import (
+    ZSTD_SUFFIX, compress_jsonl, compressed_path, drop_compressed, iter_compressed_lines
+)
+
 T = TypeVar("T", bound=BaseModel)
 
+MANIFEST_NAME = "_manifest.json"
+
 
 def append_jsonl(filepath: Path, obj: BaseModel) -> None:
     """Добавляет объект в JSONL файл."""
@@ -13,39 +33,250 @@ def append_jsonl(filepath: Path, obj: BaseModel) -> None:
         f.write(obj.model_dump_json(ensure_ascii=False) + "\n")
 
 
-def write_jsonl(filepath: Path, objects: list[BaseModel]) -> None:
-    """Записывает список объектов в JSONL файл (перезаписывает)."""
+def write_jsonl(filepath: Path, objects: Iterable[BaseModel]) -> int:
+    """Записывает объекты в JSONL файл (перезаписывает). Возвращает их число."""
+    drop_compressed(filepath)
+    count = 0
     with open(filepath, "w", encoding="utf-8") as f:
         for obj in objects:
             f.write(obj.model_dump_json(ensure_ascii=False) + "\n")
+            count += 1
+    return count
 
 
-def read_jsonl(filepath: Path, model: type[T]) -> list[T]:
-    """Читает JSONL файл и возвращает список объектов."""
-    if not filepath.exists():
+def append_jsonl_batch(filepath: Path, objects: Iterable[BaseModel]) -> int:
+    """
+    Дописывает объекты в JSONL целиком или никак: они пишутся во временный
+    файл и добавляются в filepath, только если objects отдал все записи.
+    Возвращает их число.
+    """
+    tmp_path = filepath.with_name(filepath.name + f".{os.getpid()}.tmp")
+    try:
+        count = write_jsonl(tmp_path, objects)
+        with open(tmp_path, "rb") as src, open(filepath, "ab") as dst:
+            shutil.copyfileobj(src, dst)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return count
+
+
+def shard_dir(filepath: Path) -> Path:
+    """Каталог шардов артефакта: nuggets.jsonl -> nuggets/."""
+    return filepath.with_suffix("")
+
+
+def shard_path(filepath: Path, key: str | None) -> Path:
+    """Путь к шарду артефакта для ключа (обычно doc_id)."""
+    safe_key = "".join(c if c.isalnum() or c in "-_" else "_" for c in (key or ""))
+    return shard_dir(filepath) / f"{safe_key or '_none'}.jsonl"
+
+
+def jsonl_exists(path: Path) -> bool:
+    """Есть ли у логического файла обычная или сжатая (`bioideas compress`) часть."""
+    return path.exists() or compressed_path(path).exists()
+
+
+def _physical_stat(path: Path) -> tuple[int, float]:
+    """Суммарный размер и последний mtime обычной и сжатой частей файла."""
+    parts = [p.stat() for p in (path, compressed_path(path)) if p.exists()]
+    return sum(st.st_size for st in parts), max((st.st_mtime for st in parts), default=0.0)
+
+
+def list_shards(filepath: Path) -> list[Path]:
+    """Возвращает шарды артефакта в детерминированном порядке."""
+    directory = shard_dir(filepath)
+    if not directory.is_dir():
         return []
-    
-    objects = []
-    with open(filepath, "r", encoding="utf-8") as f:
+    names = {p.name for p in directory.glob("*.jsonl")}
+    names |= {p.name[:-len(ZSTD_SUFFIX)] for p in directory.glob("*.jsonl" + ZSTD_SUFFIX)}
+    return [directory / name for name in sorted(names)]
+
+
+def write_shard(filepath: Path, key: str | None, objects: Iterable[BaseModel]) -> int:
+    """
+    Атомарно перезаписывает шард ключа. Возвращает число записей.
+    Остальные шарды не затрагиваются — повторная обработка эпизода
+    переписывает только его файл.
+    """
+    path = shard_path(filepath, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    count = write_jsonl(tmp_path, objects)
+    os.replace(tmp_path, path)
+    drop_compressed(path)
+    return count
+
+
+def append_shard(filepath: Path, key: str | None, obj: BaseModel) -> None:
+    """Добавляет объект в шард ключа."""
+    path = shard_path(filepath, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    append_jsonl(path, obj)
+
+
+def drop_flat(filepath: Path) -> None:
+    """Удаляет общий файл артефакта и его сжатую часть (данные уже в шардах)."""
+    filepath.unlink(missing_ok=True)
+    drop_compressed(filepath)
+
+
+def drop_shards(filepath: Path) -> None:
+    """Удаляет шарды артефакта, их сжатые части и манифест (данные уже в общем файле)."""
+    for path in list_shards(filepath):
+        path.unlink(missing_ok=True)
+        drop_compressed(path)
+    (shard_dir(filepath) / MANIFEST_NAME).unlink(missing_ok=True)
+
+
+def _artifact_files(filepath: Path) -> list[Path]:
+    """Все физические файлы артефакта: общий файл, затем шарды."""
+    files = [filepath] if jsonl_exists(filepath) else []
+    return files + list_shards(filepath)
+
+
+def _iter_records(path: Path) -> Iterator[dict]:
+    """Потоково читает словари из одного файла: сначала сжатые фреймы, затем хвост."""
+    for line in iter_compressed_lines(path):
+        yield json.loads(line)
+    if not path.exists():
+        return
+    with open(path, "r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
             if line:
-                data = json.loads(line)
-                objects.append(model.model_validate(data))
-    return objects
+                yield json.loads(line)
+
+
+def iter_jsonl(filepath: Path, model: type[T]) -> Iterator[T]:
+    """Потоково читает артефакт (общий файл и все шарды)."""
+    for path in _artifact_files(filepath):
+        for data in _iter_records(path):
+            yield model.model_validate(data)
+
+
+def read_jsonl(filepath: Path, model: type[T]) -> list[T]:
+    """Читает JSONL файл и возвращает список объектов."""
+    return list(iter_jsonl(filepath, model))
+
+
+def iter_partitions(
+    filepath: Path,
+    model: type[T],
+    key_field: str = "doc_id",
+) -> Iterator[tuple[str | None, list[T]]]:
+    """
+    Возвращает объекты артефакта, сгруппированные по key_field.
+    Шарды читаются по одному, так что в памяти держится только один эпизод.
+    Если рядом лежит общий файл (данные до `bioideas partition`),
+    группировка делается в памяти по всему артефакту.
+    """
+    if jsonl_exists(filepath):
+        groups: dict[str | None, list[T]] = defaultdict(list)
+        for obj in iter_jsonl(filepath, model):
+            groups[getattr(obj, key_field)].append(obj)
+        yield from groups.items()
+        return
+
+    for path in list_shards(filepath):
+        objects = [model.model_validate(data) for data in _iter_records(path)]
+        if objects:
+            yield getattr(objects[0], key_field), objects
+
+
+def load_manifest(filepath: Path) -> dict:
+    """Загружает манифест шардов артефакта (пустой, если его нет)."""
+    manifest_path = shard_dir(filepath) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {"shards": {}}
+    return json.loads(manifest_path.read_text(encoding="utf-8"))
+
+
+def update_manifest(filepath: Path, key_field: str = "doc_id") -> dict:
+    """
+    Пересобирает манифест шардов: ключ, файл, число записей, размер.
+    Неизменившиеся шарды (тот же размер и mtime) не перечитываются.
+    Вызывается оркестратором после записи, а не воркерами.
+    """
+    shards = list_shards(filepath)
+    if not shards:
+        return {"shards": {}}
+
+    previous = {entry["file"]: entry for entry in load_manifest(filepath)["shards"].values()}
+    entries = {}
+    for path in shards:
+        size, mtime = _physical_stat(path)
+        entry = previous.get(path.name)
+        if not entry or entry["bytes"] != size or entry["mtime"] != mtime:
+            key = None
+            records = 0
+            for data in _iter_records(path):
+                if records == 0:
+                    key = data.get(key_field)
+                records += 1
+            entry = {
+                "key": key,
+                "file": path.name,
+                "records": records,
+                "bytes": size,
+                "mtime": mtime,
+            }
+        entries[entry["key"] or path.stem] = entry
+
+    manifest = {
+        "artifact": filepath.name,
+        "key_field": key_field,
+        "updated_at": datetime.now().isoformat(),
+        "shards": entries,
+    }
+    manifest_path = shard_dir(filepath) / MANIFEST_NAME
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def partition_jsonl(filepath: Path, model: type[T], key_field: str = "doc_id") -> int:
+    """
+    Переносит общий JSONL файл в шарды по key_field.
+    Исходный файл (и его сжатая часть) получает суффикс .migrated.
+    Возвращает число шардов.
+    """
+    if not jsonl_exists(filepath):
+        return 0
+
+    groups: dict[str | None, list[T]] = defaultdict(list)
+    for data in _iter_records(filepath):
+        obj = model.model_validate(data)
+        groups[getattr(obj, key_field)].append(obj)
+
+    for key, objects in groups.items():
+        path = shard_path(filepath, key)
+        existing = [model.model_validate(d) for d in _iter_records(path)] if jsonl_exists(path) else []
+        write_shard(filepath, key, existing + objects)
+
+    for path in (filepath, compressed_path(filepath)):
+        if path.exists():
+            os.replace(path, path.with_name(path.name + ".migrated"))
+    drop_compressed(filepath)
+    update_manifest(filepath, key_field)
+    return len(groups)
+
+
+def compress_artifact(filepath: Path) -> int:
+    """Сжимает несжатые части артефакта (общий файл и шарды). Возвращает число записей."""
+    total = 0
+    for path in _artifact_files(filepath):
+        total += compress_jsonl(path)
+    if list_shards(filepath):
+        update_manifest(filepath)
+    return total
 
 
 def load_processed_ids(filepath: Path, id_field: str = "doc_id") -> set[str]:
     """Загружает множество уже обработанных ID из JSONL."""
-    if not filepath.exists():
-        return set()
-    
     ids = set()
-    with open(filepath, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                data = json.loads(line)
-                if id_field in data:
-                    ids.add(data[id_field])
+    for path in _artifact_files(filepath):
+        for data in _iter_records(path):
+            if id_field in data:
+                ids.add(data[id_field])
     return ids
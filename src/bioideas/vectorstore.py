@@ -39,12 +39,16 @@ def upsert_vectors(
     collection: str,
     ids: list[str],
     vectors: list[list[float]],
-    payloads: list[dict]
+    payloads: list[dict],
+    start_id: int = 0,
 ) -> None:
-    """Добавляет или обновляет векторы в коллекции."""
+    """
+    Добавляет или обновляет векторы в коллекции.
+    ID точек — позиции start_id + i; для дозаписи передаётся число уже загруженных точек.
+    """
     points = [
         PointStruct(
-            id=i,
+            id=start_id + i,
             vector=vectors[i],
             payload={**payloads[i], "_str_id": ids[i]}
         )
@@ -84,13 +88,13 @@ def search_similar(
             ]
         )
     
-    results = client.search(
+    results = client.query_points(
         collection_name=collection,
-        query_vector=query_vector,
+        query=query_vector,
         limit=limit,
         score_threshold=score_threshold,
         query_filter=search_filter,
-    )
+    ).points
     
     return [
         {
@@ -126,6 +130,32 @@ def get_all_points(
     return points
 
 
+def iter_points(
+    client: QdrantClient,
+    collection: str,
+    batch_size: int = 1000,
+    with_vectors: bool = True,
+):
+    """Постранично обходит все точки коллекции (без лимита get_all_points)."""
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=with_vectors,
+        )
+        for r in records:
+            yield {
+                "id": r.payload.get("_str_id", str(r.id)),
+                "vector": r.vector,
+                "payload": r.payload
+            }
+        if offset is None:
+            break
+
+
 def delete_collection(client: QdrantClient, name: str) -> None:
     """Удаляет коллекцию."""
     if client.collection_exists(name):